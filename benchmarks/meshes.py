@@ -0,0 +1,200 @@
+"""
+Synthetic meshes for the benchmarks.
+
+Everything is generated from a few numbers, so the benchmarks need no
+external data: GLL models of box shaped domains with hexahedral (3D) or
+quadrilateral (2D) elements of any order, and exodus hexahedral meshes.
+The elements can be deformed with a smooth mapping, so they are not axis
+aligned boxes any more, and part of the domain can be refined.
+"""
+import os
+
+import h5py
+import numpy as np
+from pyexodus import exodus
+
+from multi_mesh.components import tensor_gll
+
+TTI_PARAMETERS = ["VPV", "VPH", "VSV", "VSH", "RHO", "ETA", "QKAPPA", "QMU"]
+ISO_PARAMETERS = ["QKAPPA", "QMU", "RHO", "VP", "VS"]
+
+
+def deform(points, deformation, length):
+    """
+    Smoothly move points around inside the box [0, length]^dimension. The
+    boundary stays where it is, so meshes of the same box cover the same
+    domain.
+
+    :param points: Points [..., dimension]
+    :param deformation: Largest displacement relative to length
+    :param length: Edge length of the box
+    """
+    if deformation == 0.0:
+        return points
+    phase = np.pi * points / length
+    bump = np.prod(np.sin(phase), axis=-1)[..., np.newaxis]
+    return points + deformation * length * bump * np.cos(phase[..., ::-1])
+
+
+def element_boxes(nelem, dimension=3, length=1.0, refinement=1):
+    """
+    Lower corners and sizes of the elements of a box split into nelem
+    elements along every axis. With refinement > 1 the elements in the lower
+    half of the last axis are split into refinement elements along every
+    axis, which gives hanging nodes but that does not matter for
+    interpolation.
+
+    :return: Lower corners [n, dimension] and sizes [n] of the elements
+    """
+    size = length / nelem
+    cells = np.stack(np.meshgrid(*[np.arange(nelem)] * dimension,
+                                 indexing="ij"), axis=-1)
+    lower = cells.reshape(-1, dimension) * size
+    sizes = np.full(lower.shape[0], size)
+    if refinement > 1:
+        refine = lower[:, -1] + size / 2.0 < length / 2.0
+        fine = np.stack(np.meshgrid(*[np.arange(refinement)] * dimension,
+                                    indexing="ij"), axis=-1)
+        fine = fine.reshape(-1, dimension) * size / refinement
+        refined = (lower[refine][:, np.newaxis] + fine).reshape(-1,
+                                                                dimension)
+        lower = np.concatenate((lower[~refine], refined))
+        sizes = np.concatenate((sizes[~refine],
+                                np.full(refined.shape[0],
+                                        size / refinement)))
+    return lower, sizes
+
+
+def gll_coordinates(nelem, order=4, dimension=3, length=1.0, deformation=0.0,
+                    refinement=1):
+    """
+    Coordinates of the GLL points of a box shaped mesh.
+
+    :param nelem: Elements along every axis
+    :param order: Polynomial order of the elements
+    :param dimension: 2 for quadrilaterals, 3 for hexahedra
+    :param length: Edge length of the box
+    :param deformation: Largest displacement of the points relative to
+        length, see deform
+    :param refinement: Refinement of the lower half, see element_boxes
+    :return: Coordinates [nelements, (order + 1) ** dimension, dimension]
+    """
+    lower, sizes = element_boxes(nelem, dimension, length, refinement)
+    xi = (tensor_gll.gll_points(order) + 1.0) / 2.0
+    index = np.arange((order + 1) ** dimension)
+    relative = np.stack([xi[(index // (order + 1) ** d) % (order + 1)]
+                         for d in range(dimension)], axis=1)
+    points = lower[:, np.newaxis] + sizes[:, np.newaxis, np.newaxis] * \
+        relative
+    return deform(points, deformation, length)
+
+
+def model_values(points, nparameters):
+    """
+    Smooth parameter values at points, one row per parameter.
+
+    :param points: Points [..., dimension]
+    :param nparameters: Amount of parameters
+    :return: Values [nparameters, ...]
+    """
+    x = np.moveaxis(points, -1, 0)
+    return np.stack([1.0 + i + np.sin((i + 1) * x[0]) +
+                     x[1] * x[-1] * (i + 2) for i in range(nparameters)])
+
+
+def write_gll_model(filename, coordinates, parameters=ISO_PARAMETERS):
+    """
+    Write a gll model in the layout of salvus, with smooth values for the
+    parameters and all elements solid.
+
+    :param filename: Where to write the model
+    :param coordinates: GLL point coordinates [nelem, ngll, dimension]
+    :param parameters: Names of the parameters
+    """
+    values = model_values(coordinates, len(parameters))
+    with h5py.File(filename, "w") as f:
+        f.create_dataset("MODEL/coordinates", data=coordinates)
+        data = f.create_dataset("MODEL/data",
+                                data=values.transpose(1, 0, 2))
+        data.attrs["DIMENSION_LABELS"] = np.array(
+            [b"element", ("[ " + " | ".join(parameters) + " ]").encode(),
+             b"point"])
+        element_data = f.create_dataset(
+            "MODEL/element_data", data=np.zeros((coordinates.shape[0], 1)))
+        element_data.attrs["DIMENSION_LABELS"] = np.array(
+            [b"element", b"[ fluid ]"])
+
+
+def write_gll_gradient(filename, coordinates, parameters=("VP", "VS"),
+                       scale=1.0):
+    """
+    Write a gradient in the layout of salvus simulation output,
+    [time, element, parameter, point] below ELASTIC.
+
+    :param filename: Where to write the gradient
+    :param coordinates: GLL point coordinates [nelem, ngll, dimension]
+    :param parameters: Names of the parameters
+    :param scale: Factor on the values, to tell gradients apart
+    """
+    values = scale * model_values(coordinates, len(parameters))
+    with h5py.File(filename, "w") as f:
+        f.create_dataset("ELASTIC/coordinates", data=coordinates)
+        data = f.create_dataset(
+            "ELASTIC/data", data=values.transpose(1, 0, 2)[np.newaxis],
+            dtype="f4")
+        data.dims[2].label = "[ " + " | ".join(parameters) + " ]"
+
+
+def exodus_hex_mesh(nelem, length=1.0, deformation=0.0):
+    """
+    Nodes and connectivity of a box split into nelem hexahedra along every
+    axis.
+
+    :return: Points [nnodes, 3] and 0 based connectivity [nelem ** 3, 8] in
+        exodus node order
+    """
+    axis = np.linspace(0.0, length, nelem + 1)
+    points = np.stack(np.meshgrid(axis, axis, axis, indexing="ij"),
+                      axis=-1).reshape(-1, 3)
+    node = np.arange((nelem + 1) ** 3).reshape((nelem + 1,) * 3)
+    corners = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0),
+               (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]
+    connectivity = np.stack(
+        [node[i:i + nelem, j:j + nelem, k:k + nelem].ravel()
+         for i, j, k in corners], axis=1)
+    return deform(points, deformation, length), connectivity
+
+
+def write_exodus(filename, points, connectivity, fields=("VP",)):
+    """
+    Write an exodus hexahedral mesh with smooth nodal fields.
+
+    :param filename: Where to write the mesh
+    :param points: Node coordinates [nnodes, 3]
+    :param connectivity: 0 based connectivity [nelem, 8]
+    :param fields: Names of the nodal fields, multi_mesh needs at least
+        one to read the mesh
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    e = exodus(filename, mode="w", array_type="numpy", title="benchmark",
+               numDims=3, numNodes=points.shape[0],
+               numElems=connectivity.shape[0], numBlocks=1,
+               numNodeSets=0, numSideSets=0)
+    try:
+        e.put_coords(points[:, 0], points[:, 1], points[:, 2])
+        e.put_elem_blk_info(1, "HEX", connectivity.shape[0], 8, 0)
+        e.put_elem_connectivity(1, connectivity + 1)
+        e.set_element_variable_number(1)
+        e.put_element_variable_name("element_id", 1)
+        e.set_node_variable_number(len(fields))
+        e.put_time(1, 0.0)
+        e.put_element_variable_values(1, "element_id", 1,
+                                      np.arange(connectivity.shape[0],
+                                                dtype=np.float64))
+        values = model_values(points, len(fields))
+        for i, name in enumerate(fields):
+            e.put_node_variable_name(name, i + 1)
+            e.put_node_variable_values(name, 1, values[i])
+    finally:
+        e.close()
@@ -0,0 +1,578 @@
+"""
+Benchmarks of the public interpolation functions on synthetic meshes.
+
+Every case generates its meshes first and then runs the api function in a
+fresh process, so the peak memory is that of the function alone and no
+state is shared between the cases. The results are written as JSON to
+compare them across commits:
+
+    python -m benchmarks.run --size small --output before.json
+    python -m benchmarks.run --size small --output after.json
+    python -m benchmarks.run compare before.json after.json
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from benchmarks import meshes
+
+# Elements along every axis of the gll and exodus meshes.
+SIZES = {
+    "small": {"gll": 5, "gll_2d": 20, "exodus": 10, "gradients": 4,
+              "points": 100000},
+    "medium": {"gll": 10, "gll_2d": 60, "exodus": 25, "gradients": 8,
+               "points": 1000000},
+    "large": {"gll": 20, "gll_2d": 150, "exodus": 50, "gradients": 16,
+              "points": 5000000},
+}
+
+
+def _peak_rss():
+    """
+    Peak resident memory of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Case(object):
+    """
+    A benchmark: prepare writes the input files, the phases are then run
+    one after the other in a fresh process. The throughput is reported for
+    the measured phase, the first one if None.
+    """
+    name = None
+    measured = None
+
+    def prepare(self, workdir, size):
+        """
+        Write the input files to workdir.
+
+        :return: A dictionary which is passed to the phases, with the amount
+            of interpolated points under "npoints"
+        """
+        raise NotImplementedError
+
+    def phases(self, setup):
+        """
+        :return: List of (name, function) which are called with setup
+        """
+        raise NotImplementedError
+
+
+class GllToGll(Case):
+    name = "gll_2_gll"
+    dimension = 3
+    order = 4
+    to_order = 4
+    deformation = 0.05
+    refinement = 1
+    precision = "double"
+
+    def nelem(self, size):
+        return SIZES[size]["gll_2d" if self.dimension == 2 else "gll"]
+
+    def prepare(self, workdir, size):
+        n = self.nelem(size)
+        source = meshes.gll_coordinates(n, self.order, self.dimension,
+                                        deformation=self.deformation)
+        target = meshes.gll_coordinates(n + 1, self.to_order, self.dimension,
+                                        deformation=self.deformation / 2,
+                                        refinement=self.refinement)
+        setup = {"from_gll": os.path.join(workdir, "from.h5"),
+                 "to_gll": os.path.join(workdir, "to.h5"),
+                 "cache_dir": os.path.join(workdir, "cache"),
+                 "npoints": target.shape[0] * target.shape[1]}
+        meshes.write_gll_model(setup["from_gll"], source)
+        meshes.write_gll_model(setup["to_gll"], target)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gll_2_gll(setup["from_gll"], setup["to_gll"],
+                          parameters="ISO", cache_dir=setup["cache_dir"],
+                          precision=self.precision)
+        return [("cold", interpolate), ("cached", interpolate)]
+
+
+class GllToGllSingle(GllToGll):
+    name = "gll_2_gll_single"
+    precision = "single"
+
+
+class GllToGll2D(GllToGll):
+    name = "gll_2_gll_2d"
+    dimension = 2
+
+
+class GllToGllRefined(GllToGll):
+    name = "gll_2_gll_refined_order2"
+    to_order = 2
+    refinement = 2
+
+
+class GllToGllStructured(GllToGll):
+    name = "gll_2_gll_structured"
+    deformation = 0.0
+
+
+class GllToGllStreaming(GllToGll):
+    name = "gll_2_gll_streaming"
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gll_2_gll(setup["from_gll"], setup["to_gll"],
+                          parameters="ISO", memory_budget=16 * 1024 ** 2)
+        return [("streaming", interpolate)]
+
+
+class ExodusToGll(Case):
+    name = "exodus_2_gll"
+
+    def prepare(self, workdir, size):
+        points, connectivity = meshes.exodus_hex_mesh(
+            SIZES[size]["exodus"], deformation=0.05)
+        target = meshes.gll_coordinates(SIZES[size]["gll"], 4,
+                                        deformation=0.02)
+        setup = {"mesh": os.path.join(workdir, "mesh.e"),
+                 "gll_model": os.path.join(workdir, "gll.h5"),
+                 "cache_dir": os.path.join(workdir, "cache"),
+                 "npoints": target.shape[0] * target.shape[1]}
+        meshes.write_exodus(setup["mesh"], points, connectivity,
+                            meshes.TTI_PARAMETERS)
+        meshes.write_gll_model(setup["gll_model"], target,
+                               meshes.TTI_PARAMETERS)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.exodus_2_gll(setup["mesh"], setup["gll_model"],
+                             cache_dir=setup["cache_dir"])
+        return [("cold", interpolate), ("cached", interpolate)]
+
+
+class GllToExodus(Case):
+    name = "gll_2_exodus"
+
+    def prepare(self, workdir, size):
+        source = meshes.gll_coordinates(SIZES[size]["gll"], 4,
+                                        deformation=0.05)
+        points, connectivity = meshes.exodus_hex_mesh(SIZES[size]["exodus"])
+        setup = {"gll_model": os.path.join(workdir, "gll.h5"),
+                 "exodus_model": os.path.join(workdir, "mesh.e"),
+                 "cache_dir": os.path.join(workdir, "cache"),
+                 "npoints": points.shape[0]}
+        meshes.write_gll_model(setup["gll_model"], source,
+                               meshes.ISO_PARAMETERS)
+        # The fields are overwritten, they have to exist already.
+        meshes.write_exodus(setup["exodus_model"], points, connectivity,
+                            meshes.ISO_PARAMETERS)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gll_2_exodus(setup["gll_model"], setup["exodus_model"],
+                             cache_dir=setup["cache_dir"])
+        return [("cold", interpolate), ("cached", interpolate)]
+
+
+class SumGllGradients(Case):
+    name = "sum_gll_gradients"
+
+    def prepare(self, workdir, size):
+        n = SIZES[size]["gll"]
+        # The events are simulated on two different meshes.
+        event_meshes = [meshes.gll_coordinates(n, 4, deformation=0.05),
+                        meshes.gll_coordinates(n, 4, deformation=0.03)]
+        master = meshes.gll_coordinates(n + 1, 4, deformation=0.01)
+        simulations = []
+        for i in range(SIZES[size]["gradients"]):
+            simulations.append(os.path.join(workdir, f"gradient_{i}.h5"))
+            meshes.write_gll_gradient(simulations[-1], event_meshes[i % 2],
+                                      scale=1.0 + i)
+        setup = {"simulations": simulations,
+                 "master": os.path.join(workdir, "master.h5"),
+                 "cache_dir": os.path.join(workdir, "cache"),
+                 "npoints": len(simulations) * master.shape[0] *
+                 master.shape[1]}
+        meshes.write_gll_gradient(setup["master"], master, scale=0.0)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.sum_gll_gradients(setup["simulations"], setup["master"],
+                                  cache_dir=setup["cache_dir"])
+        return [("cold", interpolate), ("cached", interpolate)]
+
+
+class GllToGllGradients(Case):
+    name = "gll_2_gll_gradients"
+
+    def prepare(self, workdir, size):
+        n = SIZES[size]["gll"]
+        simulation = meshes.gll_coordinates(n, 4, deformation=0.05)
+        master = meshes.gll_coordinates(n + 1, 4, deformation=0.01)
+        setup = {"simulation": os.path.join(workdir, "gradient.h5"),
+                 "master": os.path.join(workdir, "master.h5"),
+                 "npoints": master.shape[0] * master.shape[1]}
+        meshes.write_gll_gradient(setup["simulation"], simulation)
+        meshes.write_gll_gradient(setup["master"], master, scale=0.0)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gll_2_gll_gradients(setup["simulation"], setup["master"])
+        return [("interpolate", interpolate)]
+
+
+class GradientToCartesianHdf5(Case):
+    name = "gradient_2_cartesian_hdf5"
+    deformation = 0.05
+    # The first and the last parameter of the gradient are not interpolated.
+    parameters = ("RHO", "VP", "VS", "MassMatrix")
+
+    def prepare(self, workdir, size):
+        gradient = meshes.gll_coordinates(SIZES[size]["gll_2d"], 4, 2,
+                                          deformation=self.deformation)
+        points, connectivity = meshes.exodus_hex_mesh(SIZES[size]["exodus"])
+        setup = {"gradient": os.path.join(workdir, "gradient.h5"),
+                 "cartesian": os.path.join(workdir, "cartesian.e"),
+                 "npoints": points.shape[0]}
+        meshes.write_gll_gradient(setup["gradient"], gradient,
+                                  self.parameters)
+        meshes.write_exodus(setup["cartesian"], points, connectivity,
+                            self.parameters[1:-1])
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gradient_2_cartesian_hdf5(setup["gradient"],
+                                          setup["cartesian"], first=True)
+        return [("interpolate", interpolate)]
+
+
+class GradientToCartesianHdf5Structured(GradientToCartesianHdf5):
+    name = "gradient_2_cartesian_hdf5_structured"
+    deformation = 0.0
+
+
+class GradientToCartesianExodus(Case):
+    name = "gradient_2_cartesian_exodus"
+    fields = ["VP", "VS"]
+
+    def prepare(self, workdir, size):
+        n = SIZES[size]["exodus"]
+        # Deformed elements move the boundary, the cartesian mesh would no
+        # longer be covered. The meshes do not line up either way.
+        gradient = meshes.exodus_hex_mesh(n)
+        points, connectivity = meshes.exodus_hex_mesh(n + 1)
+        setup = {"gradient": os.path.join(workdir, "gradient.e"),
+                 "cartesian": os.path.join(workdir, "cartesian.e"),
+                 "npoints": points.shape[0]}
+        meshes.write_exodus(setup["gradient"], *gradient, self.fields)
+        meshes.write_exodus(setup["cartesian"], points, connectivity,
+                            self.fields)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def interpolate(setup):
+            api.gradient_2_cartesian_exodus(setup["gradient"],
+                                            setup["cartesian"], self.fields)
+        return [("interpolate", interpolate)]
+
+
+class WeightedSumExodusFields(Case):
+    name = "weighted_sum_exodus_fields"
+    fields = ["VP", "VS", "RHO"]
+
+    def prepare(self, workdir, size):
+        points, connectivity = meshes.exodus_hex_mesh(SIZES[size]["exodus"])
+        added = [os.path.join(workdir, f"added_{i}.e")
+                 for i in range(SIZES[size]["gradients"])]
+        setup = {"collection_mesh": os.path.join(workdir, "sum.e"),
+                 "added_meshes": added,
+                 "npoints": len(added) * points.shape[0]}
+        for mesh in [setup["collection_mesh"]] + added:
+            meshes.write_exodus(mesh, points, connectivity, self.fields)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh import api
+
+        def add(setup):
+            api.weighted_sum_exodus_fields(
+                setup["collection_mesh"], setup["added_meshes"], self.fields,
+                weights=np.linspace(0.5, 1.5, len(setup["added_meshes"])),
+                threads=2)
+        return [("sum", add)]
+
+
+class TrilinearWeights(Case):
+    name = "trilinear_weights"
+    measured = "weights"
+
+    def prepare(self, workdir, size):
+        points, connectivity = meshes.exodus_hex_mesh(SIZES[size]["exodus"],
+                                                      deformation=0.05)
+        setup = {"mesh": os.path.join(workdir, "mesh.e"),
+                 "npoints": SIZES[size]["points"]}
+        meshes.write_exodus(setup["mesh"], points, connectivity)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh.components import interpolator
+        from multi_mesh.io.exodus import Exodus, TRILINEAR_NODE_ORDER
+
+        state = {}
+
+        def index(setup):
+            exodus = Exodus(setup["mesh"], node_order=TRILINEAR_NODE_ORDER)
+            state["nodes"] = exodus.points
+            state["connectivity"] = exodus.connectivity_in_order(
+                TRILINEAR_NODE_ORDER)
+            state["index"] = interpolator.trilinear_index(
+                state["nodes"], state["connectivity"])
+            state["points"] = np.random.default_rng(0).uniform(
+                0.0, 1.0, (setup["npoints"], 3))
+
+        def weights(setup):
+            _, _, nfailed = interpolator.trilinear_weights(
+                state["index"], state["connectivity"], state["nodes"],
+                state["points"])
+            assert nfailed == 0, f"{nfailed} points were not found"
+        return [("index", index), ("weights", weights)]
+
+
+class RotateMesh(Case):
+    name = "rotate_mesh"
+
+    def prepare(self, workdir, size):
+        points, connectivity = meshes.exodus_hex_mesh(SIZES[size]["exodus"])
+        coordinates = meshes.gll_coordinates(SIZES[size]["gll"])
+        setup = {"mesh": os.path.join(workdir, "mesh.e"),
+                 "gll": os.path.join(workdir, "model.h5"),
+                 "npoints": points.shape[0] +
+                 coordinates.shape[0] * coordinates.shape[1]}
+        meshes.write_exodus(setup["mesh"], points - 0.5, connectivity)
+        meshes.write_gll_model(setup["gll"], coordinates - 0.5)
+        return setup
+
+    def phases(self, setup):
+        from multi_mesh.components import rotation
+
+        matrix = rotation.compose(
+            rotation.event_rotation((0.5, 1.0)),
+            rotation.event_rotation((-0.3, 2.0), backwards=True))
+
+        def rotate(setup):
+            rotation.rotate_mesh(setup["mesh"], matrix)
+            rotation.rotate_mesh(setup["gll"], matrix)
+        return [("rotate", rotate)]
+
+
+CASES = {case.name: case for case in [
+    GllToGll(), GllToGllSingle(), GllToGll2D(), GllToGllRefined(),
+    GllToGllStructured(), GllToGllStreaming(), ExodusToGll(), GllToExodus(),
+    SumGllGradients(), GllToGllGradients(), GradientToCartesianHdf5(),
+    GradientToCartesianHdf5Structured(), GradientToCartesianExodus(),
+    WeightedSumExodusFields(), TrilinearWeights(), RotateMesh()]}
+
+
+def _run_phases(name, setup, results):
+    """
+    Run the phases of a case, in a fresh process. The output of the
+    functions is discarded, the stats they record are kept per phase.
+    """
+    from multi_mesh.components import stats
+
+    phases = {}
+    breakdown = {}
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        for phase, function in CASES[name].phases(setup):
+            start = time.perf_counter()
+            with stats.collect() as collected:
+                function(setup)
+            phases[phase] = time.perf_counter() - start
+            breakdown[phase] = collected.to_dict()
+    results.put({"phases": phases, "stats": breakdown,
+                 "peak_rss": _peak_rss()})
+
+
+def run_case(name, size, workdir):
+    """
+    Generate the meshes of a case and time its phases in a fresh process.
+
+    :param name: Name of the case
+    :param size: small, medium or large
+    :param workdir: Directory for the files of the case, it is emptied
+        afterwards
+    :return: Dictionary of the results
+    """
+    case = CASES[name]
+    casedir = os.path.join(workdir, name)
+    os.makedirs(casedir, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        setup = case.prepare(casedir, size)
+        generate = time.perf_counter() - start
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        process = context.Process(target=_run_phases,
+                                  args=(name, setup, results))
+        process.start()
+        # Get the results before joining, the child only exits once the
+        # queue has sent them, which blocks if they do not fit into the
+        # pipe.
+        result = None
+        while result is None and process.is_alive():
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                pass
+        if result is None:
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                pass
+        process.join()
+        if process.exitcode != 0 or result is None:
+            return {"case": name, "error": f"exit code {process.exitcode}"}
+    finally:
+        shutil.rmtree(casedir, ignore_errors=True)
+
+    seconds = result["phases"][case.measured or
+                               next(iter(result["phases"]))]
+    return {"case": name,
+            "npoints": setup["npoints"],
+            "seconds": seconds,
+            "points_per_second": setup["npoints"] / seconds,
+            "peak_rss": result["peak_rss"],
+            "phases": dict(generate=generate, **result["phases"]),
+            "stats": result["stats"]}
+
+
+def environment():
+    """
+    The commit and versions the benchmarks ran with.
+    """
+    import h5py
+    import scipy
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "h5py": h5py.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+
+@click.group(invoke_without_command=True)
+@click.option("--size", type=click.Choice(sorted(SIZES)), default="small",
+              help="Size of the synthetic meshes")
+@click.option("--case", "cases", multiple=True,
+              type=click.Choice(sorted(CASES)),
+              help="Run only these cases, all of them if not given")
+@click.option("--output", type=click.Path(dir_okay=False),
+              help="Write the results to this JSON file")
+@click.option("--workdir", type=click.Path(file_okay=False),
+              help="Directory for the generated meshes, a temporary "
+                   "directory if not given")
+@click.pass_context
+def main(ctx, size, cases, output, workdir):
+    """
+    Time the interpolation functions on synthetic meshes.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="multi_mesh_benchmarks_")
+    results = {"size": size, "environment": environment(), "cases": []}
+    try:
+        for name in cases or CASES:
+            print(f"Running {name}", file=sys.stderr)
+            result = run_case(name, size, workdir)
+            results["cases"].append(result)
+            if "error" in result:
+                print(f"  failed: {result['error']}", file=sys.stderr)
+                continue
+            phases = ", ".join(f"{phase} {seconds:.3f} s"
+                               for phase, seconds in result["phases"].items())
+            print(f"  {result['points_per_second']:.4g} points/s, peak "
+                  f"memory {result['peak_rss'] / 1024 ** 2:.0f} MB "
+                  f"({phases})", file=sys.stderr)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+@main.command()
+@click.argument("before", type=click.Path(exists=True, dir_okay=False))
+@click.argument("after", type=click.Path(exists=True, dir_okay=False))
+def compare(before, after):
+    """
+    Compare the results of two benchmark runs, speedups above one mean
+    after is faster.
+    """
+    with open(before) as f:
+        before = json.load(f)
+    with open(after) as f:
+        after = json.load(f)
+    if before["size"] != after["size"]:
+        print(f"Warning: comparing {before['size']} to {after['size']} "
+              f"meshes")
+    old = {case["case"]: case for case in before["cases"]
+           if "error" not in case}
+    print(f"{'case':<28} {'speedup':>8} {'memory':>8}")
+    for case in after["cases"]:
+        if case["case"] not in old or "error" in case:
+            continue
+        speedup = old[case["case"]]["seconds"] / case["seconds"]
+        memory = case["peak_rss"] / old[case["case"]]["peak_rss"]
+        print(f"{case['case']:<28} {speedup:>8.2f} {memory:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
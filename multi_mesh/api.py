@@ -1,38 +1,16 @@
 
-# from multi_mesh.helpers import load_lib
-# from multi_mesh.io.exodus import Exodus
-from multi_mesh import utils
-from pykdtree.kdtree import KDTree
+from multi_mesh.io.exodus import Exodus
+from multi_mesh.io.gll_model import label_parameters
+from multi_mesh.components.box_index import ElementBoxIndex
+from multi_mesh.components.structured import StructuredGrid
+from multi_mesh.components import tensor_gll
+from multi_mesh.components.backends import get_backend
+from multi_mesh.components import stats
 import h5py
-import sys
 import time
 import numpy as np
 import warnings
 
-import salvus_fem
-# Buffer the salvus_fem functions, so accessing becomes much faster
-for name, func in salvus_fem._fcts:
-    # if name == "__GetInterpolationCoefficients__int_n0_1__int_n1_1__int_n2_0__Matrix_Derive" \
-    #            "dA_Eigen::Matrix<double, 2, 1>__Matrix_DerivedB_Eigen::Matrix<double, 4, 1>":
-    #     GetInterpolationCoefficients3D = func
-    if name == "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_4__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 3, 1>__Matrix_DerivedB_Eigen::Matrix<double, 125, 1>":
-        GetInterpolationCoefficients3D_order_4 = func
-    if name == "__GetInterpolationCoefficients__int_n0_2__int_n1_2__int_n2_2__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 3, 1>__Matrix_DerivedB_Eigen::Matrix<double, 27, 1>":
-        GetInterpolationCoefficients3D_order_2 = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_4__int_d_3":
-        InverseCoordinateTransformWrapper3D_4 = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_2__int_d_3":
-        InverseCoordinateTransformWrapper3D_2 = func
-    if name == "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_0__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 2, 1>__Matrix_DerivedB_Eigen::Matrix<double, 25, 1>":
-        GetInterpolationCoefficients2D = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_4__int_d_2":
-        InverseCoordinateTransformWrapper2D = func
-    if name == "__CheckHullWrapper__int_n_4__int_d_3":
-        CheckHull = func
-
 
 """
 In here we have many interpolation routines. Currently there is quite a bit of
@@ -41,7 +19,7 @@ at the time. Hopefully I'll have time one day to make it more abstract.
 """
 
 
-def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3, nelem_to_search=20, parameters="TTI", model_path="MODEL/data", coordinates_path="MODEL/coordinates"):
+def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3, nelem_to_search=20, parameters="TTI", model_path="MODEL/data", coordinates_path="MODEL/coordinates", operator_file=None, cache_dir=None, threads=0, chunks=None, compression=None, stats_file=None, precision="double", region=None):
     """
     Interpolate parameters between exodus file and hdf5 gll file. Only works in 3 dimensions.
     :param mesh: The exodus file
@@ -50,12 +28,41 @@ def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3, nelem_to_search=20,
     :param dimensions: How many spatial dimensions in meshes
     :param nelem_to_search: Amount of closest elements to consider
     :param parameters: Parameters to be interolated, possible to pass, "ISO", "TTI" or a list of parameters.
+    :param operator_file: Interpolation operator file (.h5 or .npz). If it
+    exists it is applied directly, otherwise it is computed and saved there
+    so the next interpolation between the same meshes is fast.
+    :param cache_dir: Directory of the operator cache. Operators are stored
+    there under a hash of the mesh geometries and reused automatically
+    whenever the same meshes come up again. Defaults to the
+    MULTI_MESH_CACHE_DIR environment variable, no caching if neither is set.
+    :param threads: Amount of OpenMP threads used by the trilinear
+    interpolation, 0 uses the OpenMP default (OMP_NUM_THREADS).
+    :param chunks: HDF5 chunking of the written model, an integer is the
+    amount of elements per chunk. Contiguous if None.
+    :param compression: HDF5 compression of the written model, e.g. "gzip"
+    :param region: Only update the target elements which depend on this
+    changed region of the source model, in place. A Region from
+    multi_mesh.components.region, e.g. Region.box(lower, upper) or
+    Region.from_previous(previous_model).
+    :param precision: "single" stores and interpolates the values in single
+    precision, halving their memory and file size. The points are located
+    in double precision either way.
+    :param stats_file: Write the time spent in every phase of the
+    interpolation and its counters to this JSON file
+    :return: Stats of the interpolation, see multi_mesh.components.stats
     """
     start = time.time()
     from multi_mesh.components.interpolator import exodus_2_gll
 
-    exodus_2_gll(mesh, gll_model, gll_order, dimensions,
-                 nelem_to_search, parameters, model_path, coordinates_path)
+    with stats.collect() as collected:
+        exodus_2_gll(mesh, gll_model, gll_order, dimensions,
+                     nelem_to_search, parameters, model_path,
+                     coordinates_path, operator_file=operator_file,
+                     cache_dir=cache_dir, threads=threads, chunks=chunks,
+                     compression=compression, precision=precision,
+                     region=region)
+    if stats_file is not None:
+        collected.write_json(stats_file)
 
     end = time.time()
     runtime = end - start
@@ -65,36 +72,73 @@ def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3, nelem_to_search=20,
         print(f"Finished in time: {runtime} minutes")
     else:
         print(f"Finished in time: {runtime} seconds")
+    return collected
 
 
 def gll_2_gll(from_gll, to_gll,
               nelem_to_search=20, parameters="TTI", from_model_path="MODEL/data",
               to_model_path="MODEL/data", from_coordinates_path="MODEL/coordinates",
-              to_coordinates_path="MODEL/coordinates", gradient=False):
+              to_coordinates_path="MODEL/coordinates", gradient=False,
+              operator_file=None, cache_dir=None, workers=1,
+              memory_budget=None, stats_file=None, precision="double",
+              region=None):
     """
     Interpolate parameters between two gll models.
     :param from_gll: path to gll mesh to interpolate from
     :param to_gll: path to gll mesh to interpolate to
     :param nelem_to_search: amount of elements to check
     :param parameters: Parameters to be interpolated, possible to pass, "ISO", "TTI" or a list of parameters.
-    :return: gll_mesh with new model on it
     :param gradient: If this is a gradient to be added to another gradient,
     only put true if you want to add on top of a currently existing gradient.
+    :param operator_file: Interpolation operator file (.h5 or .npz). If it
+    exists it is applied directly, otherwise it is computed and saved there
+    so the next interpolation between the same meshes is fast.
+    :param cache_dir: Directory of the operator cache. Operators are stored
+    there under a hash of the mesh geometries and reused automatically
+    whenever the same meshes come up again. Defaults to the
+    MULTI_MESH_CACHE_DIR environment variable, no caching if neither is set.
+    :param workers: Amount of processes used to locate the points. The
+    unique points of to_gll are split into chunks which are located in
+    parallel.
+    :param memory_budget: Stream the models in chunks of elements using
+    roughly this many bytes, instead of loading them to memory. Use this
+    for models which do not fit into memory. No interpolation operators are
+    used or stored in this mode, so operator_file and cache_dir can not be
+    given.
+    :param region: Only update the target elements which depend on this
+    changed region of the source model, in place. A Region from
+    multi_mesh.components.region, e.g. Region.box(lower, upper) or
+    Region.from_previous(previous_model).
+    :param precision: "single" stores and interpolates the values in single
+    precision, halving their memory and file size. The points are located
+    in double precision either way.
+    :param stats_file: Write the time spent in every phase of the
+    interpolation and its counters to this JSON file
+    :return: Stats of the interpolation, see multi_mesh.components.stats
     """
     start = time.time()
     from multi_mesh.components.interpolator import gll_2_gll
     
-    gll_2_gll(
-        from_gll=from_gll,
-        to_gll=to_gll,
-        nelem_to_search=nelem_to_search,
-        parameters=parameters,
-        from_model_path=from_model_path,
-        to_model_path=to_model_path,
-        from_coordinates_path=from_coordinates_path,
-        to_coordinates_path=to_coordinates_path,
-        gradient=gradient
-    )
+    with stats.collect() as collected:
+        gll_2_gll(
+            from_gll=from_gll,
+            to_gll=to_gll,
+            nelem_to_search=nelem_to_search,
+            parameters=parameters,
+            from_model_path=from_model_path,
+            to_model_path=to_model_path,
+            from_coordinates_path=from_coordinates_path,
+            to_coordinates_path=to_coordinates_path,
+            gradient=gradient,
+            operator_file=operator_file,
+            cache_dir=cache_dir,
+            workers=workers,
+            memory_budget=memory_budget,
+            precision=precision,
+            region=region
+        )
+    if stats_file is not None:
+        collected.write_json(stats_file)
 
     end = time.time()
     runtime = end - start
@@ -104,114 +148,110 @@ def gll_2_gll(from_gll, to_gll,
         print(f"Finished in time: {runtime} minutes")
     else:
         print(f"Finished in time: {runtime} seconds")
+    return collected
 
 
 # Will keep this function for now, while not really knowing the terminology in Salvus
-def gll_2_gll_gradients(simulation, master, first=True):
+def gll_2_gll_gradients(simulation, master, first=True, precision="double"):
     """
     Interpolate gradient from simulation mesh to master model. All hdf5 format.
-    This can be used to sum gradients too, by making first=False
+    This can be used to sum gradients too, by making first=False. It is
+    sum_gll_gradients with a single simulation.
     :param simulation: path to simulation mesh
     :param master: path to master mesh
     :param first: if false the gradient will be summed on top of existing
     gradient
+    :param precision: "single" interpolates the gradient in single
+    precision, halving its memory. The master model is stored in single
+    precision regardless.
+    :return: Stats of the interpolation, see multi_mesh.components.stats
     """
-    with h5py.File(simulation, 'r') as sim:
-        sim_points = np.array(sim['ELASTIC/coordinates'][:], dtype=np.float64)
-        sim_data = sim['ELASTIC/data'][:]
-        params = sim["ELASTIC/data"].attrs.get("DIMENSION_LABELS")[2].decode()
-        params = params[2:-2].replace(" ", "").replace("grad", "").split("|")
-
-    if "RHO" in params:
-        params.remove("RHO")
-    if "MassMatrix" in params:
-        params.remove("MassMatrix")
-
-    sim_centroids = _find_gll_centroids(sim_points, 2)
-    # print(sim_centroids.shape)
-
-    sim_centroid_tree = KDTree(sim_centroids)
-
-    nelem_to_search = 25
-    master = h5py.File(master, 'r+')
-
-    master_points = np.array(
-        master['ELASTIC/coordinates'][:], dtype=np.float64)
-    master_data = master['ELASTIC/data']
-
-    gll_points = (4 + 1) ** 2
-    values = np.zeros(
-        shape=[1, master_points.shape[0], len(params), gll_points])
-
-    nearest_element_indices = np.zeros(shape=[master_points.shape[0],
-                                              gll_points, nelem_to_search],
-                                       dtype=np.int64)
-    master_params = master["ELASTIC/data"].attrs.get("DIMENSION_LABELS")[
-        2].decode()
-    master_params = master_params[2:-
-                                  2].replace(" ", "").replace("grad", "").split("|")
-    index_map = {}
-    for i in range(len(master_params)):
-        if master_params[i] in params:
-            index_map[i] = params.index(master_params[i])
-
-    for i in range(gll_points):
-        _, nearest_element_indices[:, i, :] = sim_centroid_tree.query(
-            master_points[:, i, :], k=nelem_to_search)
-
-    for s in range(master_points.shape[0]):
-        # print(f"Element: {s}")
-        for i in range(gll_points):
-            # print(f"gll point: {i}")
-            point = master_points[s, i, :]
-            if point[0] < 1.0e5 or point[0] > 1.3e6:
-                for key, value in index_map.items():
-                    values[0, :, value, i] += master_data[0, :, key, i]
-                # values[0, s, :, i] = master_data[0, s, :, i]
-                continue
-            if point[1] < 1.0e5 or point[1] > 1.3e6:
-                for key, value in index_map.items():
-                    values[0, :, value, i] += master_data[0, :, key, i]
-                # values[0, s, :, i] = master_data[0, s, :, i]
-                continue
-            element, ref_coord = _check_if_inside_element(
-                sim_points, nearest_element_indices[s, i, :], point)
-            # print(ref_coord)
-            coeffs = get_coefficients(4, 4, 0, ref_coord, 2)
-            k = 0
-            for param in params:
-                # print(f"Parameter: {param}")
-                values[0, s, k, i] = np.sum(
-                    sim_data[0, element, k, :] * coeffs)
-                k += 1
-    if not first:
-        for key, value in index_map.items():
-            values[0, :, value, :] += master_data[0, :, key, :]
+    return sum_gll_gradients([simulation], master, first=first,
+                             precision=precision)
+
+
+def sum_gll_gradients(simulations, master, first=True, nelem_to_search=25,
+                      model_path="ELASTIC/data",
+                      coordinates_path="ELASTIC/coordinates",
+                      cache_dir=None, workers=1, buffer_file=None,
+                      stats_file=None, precision="double"):
+    """
+    Interpolate the gradients of many simulations to the master model and
+    sum them, in one go instead of calling gll_2_gll_gradients per event.
+    Gradients on the same mesh share their interpolation operator and the
+    master model is only written once.
+    :param simulations: List of paths to simulation gradients
+    :param master: path to master mesh
+    :param first: if false the sum will be added on top of the existing
+    gradient
+    :param nelem_to_search: amount of elements to check
+    :param cache_dir: Directory of the operator cache, operators are reused
+    from there across iterations. Defaults to the MULTI_MESH_CACHE_DIR
+    environment variable, no caching if neither is set.
+    :param workers: Amount of processes used to locate the points
+    :param buffer_file: Accumulate the sum in a memory mapped scratch file
+    instead of in memory
+    :param precision: "single" interpolates and sums the gradients in single
+    precision, halving the memory of the sum
+    :param stats_file: Write the time spent in every phase of the
+    interpolation and its counters to this JSON file
+    :return: Stats of the interpolation, see multi_mesh.components.stats
+    """
+    start = time.time()
+    from multi_mesh.components.interpolator import sum_gll_gradients
+
+    with stats.collect() as collected:
+        sum_gll_gradients(
+            simulations=simulations,
+            master=master,
+            first=first,
+            nelem_to_search=nelem_to_search,
+            model_path=model_path,
+            coordinates_path=coordinates_path,
+            cache_dir=cache_dir,
+            workers=workers,
+            buffer_file=buffer_file,
+            precision=precision
+        )
+    if stats_file is not None:
+        collected.write_json(stats_file)
+
+    end = time.time()
+    runtime = end - start
 
-    del master['ELASTIC/data']
-    master.create_dataset('ELASTIC/data', data=values, dtype='f4')
-    master['ELASTIC/data'].dims[0].label = 'time'
-    master['ELASTIC/data'].dims[1].label = 'element'
-    for i in params:
-        i = "grad" + i
-    dimstr = '[ ' + ' | '.join(params) + ' ]'
-    master['ELASTIC/data'].dims[2].label = dimstr
-    master['ELASTIC/data'].dims[3].label = 'point'
+    if runtime >= 60:
+        runtime = runtime / 60
+        print(f"Finished in time: {runtime} minutes")
+    else:
+        print(f"Finished in time: {runtime} seconds")
+    return collected
 
 
-def gll_2_exodus(gll_model, exodus_model, gll_order=4, dimensions=3, nelem_to_search=20, parameters="TTI", model_path="MODEL/data", coordinates_path="MODEL/coordinates", gradient=False):
+def gll_2_exodus(gll_model, exodus_model, gll_order=4, dimensions=3, nelem_to_search=20, parameters="TTI", model_path="MODEL/data", coordinates_path="MODEL/coordinates", gradient=False, operator_file=None, cache_dir=None, stats_file=None):
     """
     Interpolate parameters from gll file to exodus model. Currently I only
     need this for visualization. I could maybe make an xdmf file but that would
     be terribly boring so I'll rather do this for now.
     :param gll_model: path to gll_model
     :param exodus_model: path_to_exodus_model
+    :param operator_file: Interpolation operator file (.h5 or .npz). If it
+    exists it is applied directly, otherwise it is computed and saved there.
+    :param cache_dir: Directory of the operator cache, defaults to the
+    MULTI_MESH_CACHE_DIR environment variable.
+    :param stats_file: Write the time spent in every phase of the
+    interpolation and its counters to this JSON file
+    :return: Stats of the interpolation, see multi_mesh.components.stats
     """
     start = time.time()
     from multi_mesh.components.interpolator import gll_2_exodus
 
-    gll_2_exodus(gll_model, exodus_model, gll_order, dimensions,
-                 nelem_to_search, parameters, model_path, coordinates_path, gradient)
+    with stats.collect() as collected:
+        gll_2_exodus(gll_model, exodus_model, gll_order, dimensions,
+                     nelem_to_search, parameters, model_path,
+                     coordinates_path, gradient, operator_file=operator_file,
+                     cache_dir=cache_dir)
+    if stats_file is not None:
+        collected.write_json(stats_file)
 
     end = time.time()
     runtime = end - start
@@ -221,6 +261,7 @@ def gll_2_exodus(gll_model, exodus_model, gll_order=4, dimensions=3, nelem_to_se
         print(f"Finished in time: {runtime} minutes")
     else:
         print(f"Finished in time: {runtime} seconds")
+    return collected
 
 
 # I'll keep this function for now, might be needed for smoothiepaper revision
@@ -235,7 +276,8 @@ def gradient_2_cartesian_exodus(gradient, cartesian, params, first=False):
     :param first: If this is the first gradient, it will overwrite fields
     :return: Gradient interpolated to a cartesian mesh.
     """
-    lib = load_lib()
+    from multi_mesh.components.interpolator import (trilinear_index,
+                                                    trilinear_weights)
 
     exodus_a = Exodus(gradient, mode="a")
     print(exodus_a.points)
@@ -243,48 +285,28 @@ def gradient_2_cartesian_exodus(gradient, cartesian, params, first=False):
     points = np.array(exodus_a.points, dtype=np.float64)
     exodus_a.points = points
 
-    a_centroids = exodus_a.get_element_centroid()
-
-    # The trilinear interpolator only works in 3D so we fool it to think
-    # we are working in 3D
-    a_centroids = np.concatenate((a_centroids, np.zeros(
-        shape=(a_centroids.shape[0], 1))), axis=1)
-
-    centroid_tree = KDTree(a_centroids)
+    # The points always have three coordinates, the z coordinate of 2D
+    # meshes is zero so the trilinear interpolator thinks it works in 3D
+    connectivity = np.ascontiguousarray(exodus_a.connectivity,
+                                        dtype=np.int64)
+    box_index = trilinear_index(exodus_a.points, connectivity)
 
     nelem_to_search = 20
     exodus_b = Exodus(cartesian, mode="a")
 
-    _, nearest_element_indices = centroid_tree.query(
-        exodus_b.points, k=nelem_to_search)
-    nearest_element_indices = np.array(nearest_element_indices, dtype=np.int64)
-
-    npoints = exodus_b.npoint
-    enclosing_element_node_indices = np.zeros((npoints, 4), dtype=np.int64)
-    weights = np.zeros((npoints, 4))
-    connectivity = exodus_a.connectivity[:, :]
-    nfailed = lib.triLinearInterpolator(nelem_to_search,
-                                        npoints,
-                                        nearest_element_indices,
-                                        np.ascontiguousarray(
-                                            connectivity, dtype=np.int64),
-                                        enclosing_element_node_indices,
-                                        np.ascontiguousarray(exodus_a.points),
-                                        weights,
-                                        np.ascontiguousarray(exodus_b.points))
-
-    assert nfailed is 0, f"{nfailed} points could not be interpolated"
-
-    for param in params:
-        param_a = exodus_a.get_nodal_field(param)
-        values = np.sum(
-            param_a[enclosing_element_node_indices] * weights, axis=1)
-        if not first:
-            param_b = exodus_b.get_nodal_field(
-                param)  # Get pre-existing gradient
-            values += param_b  # Add new gradient on top of old one
-        exodus_b.attach_field(param, np.zeros_like(values))
-        exodus_b.attach_field(param, values)
+    enclosing_element_node_indices, weights, nfailed = trilinear_weights(
+        box_index, connectivity, np.ascontiguousarray(exodus_a.points),
+        exodus_b.points, nelem_to_search)
+
+    assert nfailed == 0, f"{nfailed} points could not be interpolated"
+
+    params_a = exodus_a.get_nodal_fields(params)
+    values = np.sum(params_a[:, enclosing_element_node_indices] * weights,
+                    axis=2)
+    if not first:
+        # Add new gradient on top of the pre-existing one
+        values += exodus_b.get_nodal_fields(params)
+    exodus_b.attach_fields(dict(zip(params, values)))
 
 
 # Keep this one for now, will be removed later
@@ -304,91 +326,113 @@ def gradient_2_cartesian_hdf5(gradient, cartesian, first=False):
         grad_points = np.array(
             grad['ELASTIC/coordinates'][:], dtype=np.float64)
         grad_data = grad['ELASTIC/data'][:]
-        params = grad["ELASTIC/data"].attrs.get("DIMENSION_LABELS")[2].decode()
-        params = params[2:-2].replace(" ", "").replace("grad", "").split("|")
+        params = label_parameters(grad["ELASTIC/data"])
         params = params[1:-1]
 
     print(params)
 
-    grad_centroids = _find_gll_centroids(grad_points, 2)
-    centroid_tree = KDTree(grad_centroids)
-
-    nelem_to_search = 25
     cartesian = Exodus(cartesian, mode="a")
-
-    _, nearest_element_indices = centroid_tree.query(
-        cartesian.points[:, :2], k=nelem_to_search)
-    npoints = cartesian.npoint
-
-    values = np.zeros(shape=[npoints, len(params)])
     scaling_factor = 1.0  # 34825988.0
 
-    s = 0
-    for point in cartesian.points[:, :2]:
-        element, ref_coord = _check_if_inside_element(
-            grad_points, nearest_element_indices[s, :], point)
-        if element is None and ref_coord is None:
-            k = 0
-            for param in params:
-                values[s, k] = 0.0
-                k += 1
-            s += 1
-            continue
-
-        coeffs = get_coefficients(4, 4, 0, ref_coord, 2)
-        k = 0
-        for param in params:
-            values[s, k] = np.sum(grad_data[0, element, k+1, :] * coeffs) * \
-                scaling_factor  # I do a k+1 because I'm not using RHO
-            k += 1
-
-        s += 1
-    i = 0
-    for param in params:
-        if not first:
-            prev_field = cartesian.get_nodal_field(param)
-            values[:, i] += prev_field
-        print(param)
-        cartesian.attach_field(param, np.zeros_like(values[:, i]))
-        cartesian.attach_field(param, values[:, i])
-        i += 1
+    points = cartesian.points[:, :2]
+    grid = StructuredGrid.from_elements(grad_points)
+    if grid is not None:
+        print("The gradient is on a structured grid, locating points "
+              "directly")
+        elements, ref_coords, _ = grid.locate(points)
+    else:
+        from multi_mesh.components.interpolator import inverse_transform_batch
+        from multi_mesh.components.locator import locate_points
+
+        nelem_to_search = 25
+        grad_box_index = ElementBoxIndex.from_elements(grad_points)
+        elements, ref_coords, _ = locate_points(
+            points, grad_box_index.query(points, fallback=0), grad_points, 2,
+            inverse=inverse_transform_batch,
+            boxes=(grad_box_index.lower, grad_box_index.upper),
+            nearest=grad_box_index.nearest, k_start=4,
+            k_max=nelem_to_search)
+
+    coeffs = get_backend().coefficients(
+        tensor_gll.order_from_nodes(grad_points.shape[1], 2), ref_coords)
+    # I do a +1 because I'm not using RHO
+    values = np.einsum("npa,na->np",
+                       grad_data[0, elements, 1:len(params) + 1],
+                       coeffs) * scaling_factor
+    if not first:
+        values += cartesian.get_nodal_fields(params).T
+    cartesian.attach_fields(dict(zip(params, values.T)))
 
 
 # These functions will be removed when I can properly clean this up.
 def sum_exodus_fields(collection_mesh, added_mesh, components, first=True):
-    from multi_mesh.io.exodus import Exodus
+    weighted_sum_exodus_fields(collection_mesh, [added_mesh], components,
+                               first=first)
 
-    exodus_a = Exodus(collection_mesh, mode="a")
-    exodus_b = Exodus(added_mesh)
 
-    for component in components:
-        param = exodus_b.get_nodal_field(component)
-        if first:
-            exodus_a.attach_field(component, np.zeros_like(param))
-        prev_param = exodus_a.get_nodal_field(component)
-        param += prev_param
-        exodus_a.attach_field(component, param)
+def weighted_sum_exodus_fields(collection_mesh, added_meshes, components,
+                               weights=None, first=True, threads=1):
+    """
+    Sum nodal fields of many exodus meshes with the same nodes onto the
+    collection mesh. The fields of every mesh are added to running sums
+    as they are read and the collection mesh is only written once, at the
+    end.
+    :param collection_mesh: path to the mesh the sums are written to
+    :param added_meshes: paths to the meshes to sum up
+    :param components: names of the nodal fields to sum
+    :param weights: weight of every added mesh, all ones if None
+    :param first: if False the sums are added on top of the fields which
+    are on the collection mesh already
+    :param threads: amount of meshes read ahead in background threads while
+    the previous ones are being added
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from multi_mesh.io.exodus import Exodus, read_nodal_fields
+
+    if weights is None:
+        weights = np.ones(len(added_meshes))
+    if len(weights) != len(added_meshes):
+        raise ValueError("Give one weight per added mesh")
+
+    collection = Exodus(collection_mesh, mode="a")
+    summed = np.zeros((len(components), collection.npoint))
+
+    def add(mesh, weight, values):
+        if values.shape != summed.shape:
+            raise ValueError(f"{mesh} does not have the same nodes as "
+                             f"{collection_mesh}")
+        summed[:] += weight * values
+
+    threads = max(1, threads)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for i, (mesh, weight) in enumerate(zip(added_meshes, weights)):
+            print(f"Reading mesh {i + 1}/{len(added_meshes)}: {mesh}")
+            pending.append((mesh, weight, pool.submit(read_nodal_fields,
+                                                      mesh, components)))
+            if len(pending) > threads:
+                mesh, weight, values = pending.popleft()
+                add(mesh, weight, values.result())
+        while pending:
+            mesh, weight, values = pending.popleft()
+            add(mesh, weight, values.result())
+
+    if not first:
+        summed += collection.get_nodal_fields(components)
+    collection.attach_fields(dict(zip(components, summed)))
 
 
 def get_coefficients(a, b, c, ref_coord, dimension):
-    if dimension == 3:
-        if a == 2:
-            return GetInterpolationCoefficients3D_order_2(ref_coord)
-        else:
-            return GetInterpolationCoefficients3D_order_4(ref_coord)
-    elif dimension == 2:
-        return GetInterpolationCoefficients2D(ref_coord)
+    return get_backend().coefficients(
+        a, np.reshape(ref_coord, (1, dimension)))[0]
 
 
 def inverse_transform(point, gll_points, dimension):
-    if dimension == 3:
-        if len(gll_points) == 125:
-            return InverseCoordinateTransformWrapper3D_4(pnt=point, ctrlNodes=gll_points)
-        if len(gll_points) == 27:
-            return InverseCoordinateTransformWrapper3D_2(pnt=point, ctrlNodes=gll_points)
-    elif dimension == 2:
-        return InverseCoordinateTransformWrapper2D(pnt=point, ctrlNodes=gll_points)
-    # return salvus_fem._fcts[29][1](pnt=point, ctrlNodes=gll_points)
+    ref_coords, _ = get_backend().inverse_transform(
+        np.reshape(point, (1, -1))[:, :dimension],
+        np.asarray(gll_points)[np.newaxis, :, :dimension])
+    return ref_coords[0]
 
 
 def _find_gll_centroids(gll_coordinates, dimensions):
@@ -0,0 +1,168 @@
+"""
+Backends for the GLL basis functions.
+
+A backend provides the two things the interpolation needs from the basis:
+the inverse coordinate transform, which finds the reference coordinates of
+points in their elements, and the interpolation coefficients at reference
+coordinates. Both work on stacks of points.
+
+The numpy backend (tensor_gll) is the default and is always available.
+salvus_fem is an optional backend which is only imported the first time it
+is asked for, so nothing else depends on it being installed. The backend is
+picked with set_backend or the MULTI_MESH_BACKEND environment variable.
+"""
+import os
+
+import numpy as np
+
+from multi_mesh.components import tensor_gll
+
+
+class NumpyBackend(object):
+    """
+    The vectorized tensor product GLL implementation of tensor_gll.
+    """
+    name = "numpy"
+
+    def inverse_transform(self, points, ctrl_nodes):
+        """
+        Reference coordinates of points in their elements.
+
+        :param points: Points, shape [npoints, dimension]
+        :param ctrl_nodes: Control nodes of the element of every point,
+            shape [npoints, nnodes, dimension]
+        :return: Reference coordinates [npoints, dimension] and a boolean
+            mask of the points for which they were found
+        """
+        return tensor_gll.inverse_transform(points, ctrl_nodes)
+
+    def coefficients(self, order, ref_coords):
+        """
+        Interpolation coefficients of the element nodes at reference
+        coordinates.
+
+        :param order: Polynomial order of the elements
+        :param ref_coords: Reference coordinates [npoints, dimension]
+        :return: Coefficients [npoints, nnodes]
+        """
+        return tensor_gll.get_coefficients_batch(order, ref_coords)
+
+
+class SalvusBackend(object):
+    """
+    The compiled salvus_fem functions, one point at a time. Only the orders
+    and dimensions salvus_fem was compiled for are available.
+    """
+    name = "salvus"
+
+    _coefficient_functions = {
+        (4, 3): "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_4"
+                "__Matrix_DerivedA_Eigen::Matrix<double, 3, 1>__Matrix_Derive"
+                "dB_Eigen::Matrix<double, 125, 1>",
+        (2, 3): "__GetInterpolationCoefficients__int_n0_2__int_n1_2__int_n2_2"
+                "__Matrix_DerivedA_Eigen::Matrix<double, 3, 1>__Matrix_Derive"
+                "dB_Eigen::Matrix<double, 27, 1>",
+        (4, 2): "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_0"
+                "__Matrix_DerivedA_Eigen::Matrix<double, 2, 1>__Matrix_Derive"
+                "dB_Eigen::Matrix<double, 25, 1>"}
+    _inverse_functions = {
+        (4, 3): "__InverseCoordinateTransformWrapper__int_n_4__int_d_3",
+        (2, 3): "__InverseCoordinateTransformWrapper__int_n_2__int_d_3",
+        (4, 2): "__InverseCoordinateTransformWrapper__int_n_4__int_d_2"}
+
+    def __init__(self):
+        try:
+            import salvus_fem
+        except ImportError:
+            raise ImportError("The salvus backend needs salvus_fem, use the "
+                              "numpy backend without it")
+        # Look the functions up once, accessing them by name is slow.
+        functions = dict(salvus_fem._fcts)
+        self._coefficients = {
+            key: functions[name]
+            for key, name in self._coefficient_functions.items()
+            if name in functions}
+        self._inverse = {key: functions[name]
+                         for key, name in self._inverse_functions.items()
+                         if name in functions}
+
+    @staticmethod
+    def _function(functions, order, dimension):
+        if (order, dimension) not in functions:
+            raise ValueError(f"salvus_fem has no functions for order {order} "
+                             f"in {dimension} dimensions")
+        return functions[(order, dimension)]
+
+    def inverse_transform(self, points, ctrl_nodes):
+        points = np.asarray(points, dtype=np.float64)
+        ctrl_nodes = np.asarray(ctrl_nodes, dtype=np.float64)
+        npoints, dimension = points.shape
+        order = tensor_gll.order_from_nodes(ctrl_nodes.shape[1], dimension)
+        function = self._function(self._inverse, order, dimension)
+        ref_coords = np.empty((npoints, dimension))
+        for i in range(npoints):
+            ref_coords[i] = function(pnt=np.asfortranarray(points[i]),
+                                     ctrlNodes=np.asfortranarray(
+                                         ctrl_nodes[i]))
+        return ref_coords, np.all(np.isfinite(ref_coords), axis=1)
+
+    def coefficients(self, order, ref_coords):
+        ref_coords = np.asarray(ref_coords, dtype=np.float64)
+        function = self._function(self._coefficients, order,
+                                  ref_coords.shape[1])
+        return np.array([np.ravel(function(np.asfortranarray(ref_coord)))
+                         for ref_coord in ref_coords]).reshape(
+            ref_coords.shape[0], -1)
+
+
+_factories = {"numpy": NumpyBackend, "salvus": SalvusBackend}
+_backends = {}
+_default = [os.environ.get("MULTI_MESH_BACKEND", "numpy")]
+
+
+def register_backend(name, factory):
+    """
+    Make a backend available under a name.
+
+    :param name: Name of the backend
+    :param factory: Called without arguments the first time the backend is
+        used, returns an object with inverse_transform and coefficients
+        methods like NumpyBackend
+    """
+    _factories[name] = factory
+    _backends.pop(name, None)
+
+
+def available_backends():
+    """
+    Names of the registered backends.
+    """
+    return sorted(_factories)
+
+
+def set_backend(name):
+    """
+    Use the backend with this name from now on.
+
+    :param name: Name of a registered backend
+    """
+    if name not in _factories:
+        raise ValueError(f"Unknown backend {name}, available are "
+                         f"{available_backends()}")
+    _default[0] = name
+
+
+def get_backend(name=None):
+    """
+    The backend with this name, it is created the first time it is asked
+    for.
+
+    :param name: Name of a registered backend, the current one if None
+    """
+    name = _default[0] if name is None else name
+    if name not in _backends:
+        if name not in _factories:
+            raise ValueError(f"Unknown backend {name}, available are "
+                             f"{available_backends()}")
+        _backends[name] = _factories[name]()
+    return _backends[name]
@@ -0,0 +1,234 @@
+"""
+A spatial index of element bounding boxes.
+
+Rather than querying a KDTree of element centroids for a fixed amount of
+nearest elements, which fetches too many elements in regular parts of a
+mesh and can miss the enclosing one where elements are distorted or
+refined, the index returns exactly the elements whose bounding boxes
+contain a point. The boxes are binned into a uniform grid with cells about
+the size of an element, so a query only has to look at the few elements
+overlapping the cell of the point. Elements much bigger than the typical
+one would overlap a huge amount of cells, they are kept in a second, coarser
+index of their own instead, which is always queried as well.
+"""
+import numpy as np
+from pykdtree.kdtree import KDTree
+
+from multi_mesh.components.locator import element_bounding_boxes
+
+
+class ElementBoxIndex(object):
+    """
+    A uniform grid of element bounding boxes. Every cell knows the elements
+    whose boxes overlap it.
+    """
+    def __init__(self, lower, upper, cells_per_element=1.0, max_cells=None,
+                 chunk_size=1000000, max_cells_per_element=None):
+        """
+        :param lower: Lower corners of the element boxes [nelem, dimension]
+        :param upper: Upper corners of the element boxes [nelem, dimension]
+        :param cells_per_element: Cells along every axis of a typical
+            element, more cells make the candidate lists shorter but the
+            grid bigger
+        :param max_cells: Upper limit of the amount of cells, defaults to
+            eight times the amount of elements
+        :param chunk_size: Elements to bin at a time
+        :param max_cells_per_element: Elements overlapping more cells go to
+            the index of large elements, defaults to 4 ** dimension
+        """
+        self.lower = np.ascontiguousarray(lower, dtype=np.float64)
+        self.upper = np.ascontiguousarray(upper, dtype=np.float64)
+        nelem, dimension = self.lower.shape
+        self._tree = None
+
+        self.origin = self.lower.min(axis=0)
+        domain = self.upper.max(axis=0) - self.origin
+        cell_size = np.median(self.upper - self.lower, axis=0) / \
+            cells_per_element
+        # Flat meshes, e.g. 2D meshes with a zero z coordinate, get a single
+        # cell along the flat axes.
+        cell_size = np.where(cell_size > 0.0, cell_size,
+                             np.where(domain > 0.0, domain, 1.0))
+        shape = np.maximum(np.ceil(domain / cell_size), 1)
+        max_cells = 8 * nelem if max_cells is None else max_cells
+        if np.prod(shape) > max_cells:
+            cell_size *= (np.prod(shape) / max_cells) ** (1.0 / dimension)
+            shape = np.maximum(np.ceil(domain / cell_size), 1)
+        self.cell_size = cell_size
+        self.shape = shape.astype(np.int64)
+
+        first = self._cells(self.lower)
+        span = self._cells(self.upper) - first + 1
+        counts = np.prod(span, axis=1)
+
+        if max_cells_per_element is None:
+            max_cells_per_element = 4 ** dimension
+        large = counts > max_cells_per_element
+        if large.all():
+            # Only happens with a tiny max_cells_per_element, bin them all
+            # rather than recursing forever.
+            large[:] = False
+        self._large = np.flatnonzero(large)
+        self._large_index = None
+        if self._large.size > 0:
+            self._large_index = ElementBoxIndex(
+                self.lower[large], self.upper[large], cells_per_element,
+                chunk_size=chunk_size,
+                max_cells_per_element=max_cells_per_element)
+            counts[large] = 0
+        offsets = np.zeros(nelem + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        cell_ids = np.empty(offsets[-1], dtype=np.int64)
+        element_ids = np.empty(offsets[-1], dtype=np.int64)
+        for start in range(0, nelem, chunk_size):
+            stop = min(start + chunk_size, nelem)
+            elements = np.repeat(np.arange(start, stop),
+                                 counts[start:stop])
+            # Position of every cell within the block of cells of its
+            # element, unravelled with the first axis varying fastest.
+            local = np.arange(offsets[start], offsets[stop]) - \
+                offsets[elements]
+            cell = np.zeros(local.shape, dtype=np.int64)
+            stride = 1
+            for d in range(dimension):
+                cell += (first[elements, d] + local % span[elements, d]) * \
+                    stride
+                local //= span[elements, d]
+                stride *= self.shape[d]
+            cell_ids[offsets[start]:offsets[stop]] = cell
+            element_ids[offsets[start]:offsets[stop]] = elements
+
+        order = np.argsort(cell_ids, kind="stable")
+        self._elements = element_ids[order]
+        self._cell_start = np.zeros(np.prod(self.shape) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_ids, minlength=np.prod(self.shape)),
+                  out=self._cell_start[1:])
+
+    @classmethod
+    def from_elements(cls, element_nodes, padding=0.01, **kwargs):
+        """
+        Build the index of a gll mesh.
+
+        :param element_nodes: Coordinates of the elements,
+            [nelem, nnodes, dimension]
+        :param padding: Relative padding of the boxes, see
+            element_bounding_boxes
+        """
+        lower, upper = element_bounding_boxes(element_nodes, padding)
+        return cls(lower, upper, **kwargs)
+
+    @classmethod
+    def from_connectivity(cls, points, connectivity, padding=0.01,
+                          chunk_size=1000000, **kwargs):
+        """
+        Build the index of a mesh given by its nodes and connectivity, e.g.
+        an exodus mesh.
+
+        :param points: Coordinates of the nodes [nnodes, dimension]
+        :param connectivity: Nodes of every element [nelem, nnodes]
+        :param padding: Relative padding of the boxes, see
+            element_bounding_boxes
+        :param chunk_size: Elements to process at a time
+        """
+        nelem = connectivity.shape[0]
+        lower = np.empty((nelem, points.shape[1]))
+        upper = np.empty((nelem, points.shape[1]))
+        for start in range(0, nelem, chunk_size):
+            rows = slice(start, start + chunk_size)
+            lower[rows], upper[rows] = element_bounding_boxes(
+                points[connectivity[rows]], padding)
+        return cls(lower, upper, **kwargs)
+
+    def _cells(self, points):
+        """
+        Grid cell of every point along every axis, clipped to the grid.
+        """
+        cells = np.floor((points - self.origin) / self.cell_size)
+        return np.clip(cells, 0, self.shape - 1).astype(np.int64)
+
+    def nearest(self, points, k):
+        """
+        The k elements with the closest box centres.
+
+        :param points: Points, shape [npoints, dimension]
+        :param k: Amount of elements
+        :return: Elements [npoints, k], closest first
+        """
+        if self._tree is None:
+            self._tree = KDTree((self.lower + self.upper) / 2.0)
+        k = min(k, self.lower.shape[0])
+        _, nearest = self._tree.query(np.ascontiguousarray(points), k=k)
+        return np.asarray(nearest, dtype=np.int64).reshape(len(points), k)
+
+    def query(self, points, fallback=4, chunk_size=100000):
+        """
+        Find the elements whose boxes contain the points.
+
+        :param points: Points, shape [npoints, dimension]
+        :param fallback: Points which are inside no box at all, e.g.
+            because they are slightly outside of the mesh, get this many
+            elements with the closest box centres instead
+        :param chunk_size: Points to process at a time
+        :return: Candidate elements [npoints, ncandidates], closest box
+            centre first and padded with -1
+        """
+        points = np.ascontiguousarray(points, dtype=np.float64)
+        npoints = points.shape[0]
+        chunks = []
+        for start in range(0, npoints, chunk_size):
+            chunks.append(self._query_chunk(points[start:start + chunk_size],
+                                            fallback))
+
+        width = max([chunk.shape[1] for chunk in chunks] + [1])
+        candidates = np.full((npoints, width), -1, dtype=np.int64)
+        for start, chunk in zip(range(0, npoints, chunk_size), chunks):
+            candidates[start:start + chunk.shape[0], :chunk.shape[1]] = chunk
+        return candidates
+
+    def _contained(self, points):
+        """
+        All pairs of points and elements whose boxes contain them.
+
+        :return: Point and element indices of the pairs
+        """
+        cell = np.ravel_multi_index(self._cells(points).T,
+                                    tuple(self.shape), order="F")
+        start = self._cell_start[cell]
+        count = self._cell_start[cell + 1] - start
+
+        point = np.repeat(np.arange(points.shape[0]), count)
+        local = np.arange(point.size) - np.repeat(np.cumsum(count) - count,
+                                                  count)
+        elements = self._elements[np.repeat(start, count) + local]
+        inside = np.all((points[point] >= self.lower[elements]) &
+                        (points[point] <= self.upper[elements]), axis=1)
+        point, elements = point[inside], elements[inside]
+        if self._large_index is not None:
+            large_point, large_elements = self._large_index._contained(points)
+            point = np.concatenate((point, large_point))
+            elements = np.concatenate((elements, self._large[large_elements]))
+        return point, elements
+
+    def _query_chunk(self, points, fallback):
+        npoints = points.shape[0]
+        point, elements = self._contained(points)
+
+        centres = (self.lower[elements] + self.upper[elements]) / 2.0
+        distance = np.sum((points[point] - centres) ** 2, axis=1)
+        order = np.lexsort((distance, point))
+        point, elements = point[order], elements[order]
+
+        hits = np.bincount(point, minlength=npoints)
+        rank = np.arange(point.size) - np.repeat(np.cumsum(hits) - hits,
+                                                 hits)
+        width = max(int(hits.max(initial=0)), fallback)
+        candidates = np.full((npoints, width), -1, dtype=np.int64)
+        candidates[point, rank] = elements
+
+        outside = np.where(hits == 0)[0]
+        if outside.size > 0 and fallback > 0:
+            nearest = self.nearest(points[outside], fallback)
+            candidates[outside, :nearest.shape[1]] = nearest
+        return candidates[:, :max(int(hits.max(initial=0)),
+                                  fallback if outside.size > 0 else 0, 1)]
@@ -0,0 +1,216 @@
+"""
+An on-disk cache of interpolation operators.
+
+Operators are stored under a key which is a hash of the geometry of the
+two meshes and the search settings, so the same pair of meshes always maps
+to the same operator no matter what the files are called. The cache has a
+size cap and evicts the least recently used operators first.
+"""
+import hashlib
+import json
+import os
+import time
+
+import h5py
+import numpy as np
+
+from multi_mesh.components.operator import InterpolationOperator
+
+# Bump this when the way operators are computed changes, so old entries
+# are not reused.
+CACHE_VERSION = 2
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3
+
+
+def default_cache_dir():
+    """
+    The cache directory set with the MULTI_MESH_CACHE_DIR environment
+    variable, None if it is not set.
+    """
+    return os.environ.get("MULTI_MESH_CACHE_DIR")
+
+
+def hash_array(array, hasher=None, chunk_rows=100000):
+    """
+    Hash an array or an HDF5 dataset, reading it in chunks of rows so
+    large datasets are never fully loaded.
+
+    :param array: numpy array or h5py dataset
+    :param hasher: Running hashlib object to update, a new one if None
+    :param chunk_rows: Rows to read at a time
+    :return: The hasher
+    """
+    if hasher is None:
+        hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(str((tuple(array.shape), str(array.dtype))).encode())
+    for start in range(0, array.shape[0], chunk_rows):
+        chunk = np.ascontiguousarray(array[start:start + chunk_rows])
+        hasher.update(chunk.tobytes())
+    return hasher
+
+
+def gll_geometry_hash(filename, coordinates_path="MODEL/coordinates"):
+    """
+    Hash the coordinates of a gll model.
+
+    :param filename: The gll model
+    :param coordinates_path: Location of the coordinates in the file
+    :return: Hex digest
+    """
+    with h5py.File(filename, "r") as f:
+        return hash_array(f[coordinates_path]).hexdigest()
+
+
+def exodus_geometry_hash(exodus):
+    """
+    Hash the coordinates and the connectivity of an exodus mesh.
+
+    :param exodus: An Exodus object
+    :return: Hex digest
+    """
+    hasher = hash_array(exodus.points)
+    return hash_array(exodus.connectivity, hasher).hexdigest()
+
+
+def operator_key(kind, source_hash, target_hash, **settings):
+    """
+    Build the cache key of an operator.
+
+    :param kind: Which interpolation, e.g. "gll_2_gll"
+    :param source_hash: Geometry hash of the source mesh
+    :param target_hash: Geometry hash of the target mesh
+    :param settings: Anything else the operator depends on, like
+        nelem_to_search
+    :return: Hex digest
+    """
+    description = json.dumps(
+        {"version": CACHE_VERSION, "kind": kind, "source": source_hash,
+         "target": target_hash, "settings": settings}, sort_keys=True)
+    return hashlib.blake2b(description.encode(),
+                           digest_size=20).hexdigest()
+
+
+class OperatorCache(object):
+    """
+    A directory of interpolation operators with least recently used
+    eviction. Every entry is an operator file named after its key and a
+    small json file describing it. The modification time of the operator
+    file is the last time it was used.
+    """
+    def __init__(self, directory=None, max_size=None):
+        """
+        :param directory: Cache directory. Defaults to the
+            MULTI_MESH_CACHE_DIR environment variable.
+        :param max_size: Size cap in bytes. Defaults to the
+            MULTI_MESH_CACHE_SIZE environment variable in GB or 20 GB.
+        """
+        directory = directory or default_cache_dir()
+        if directory is None:
+            raise ValueError("No cache directory given and "
+                             "MULTI_MESH_CACHE_DIR is not set")
+        if max_size is None:
+            max_size = os.environ.get("MULTI_MESH_CACHE_SIZE")
+            max_size = DEFAULT_MAX_SIZE if max_size is None else \
+                int(float(max_size) * 1024 ** 3)
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _operator_file(self, key):
+        return os.path.join(self.directory, key + ".h5")
+
+    def _info_file(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        Get an operator and mark it as used.
+
+        :param key: The key of the operator
+        :return: The operator or None if it is not cached
+        """
+        filename = self._operator_file(key)
+        if not os.path.exists(filename):
+            return None
+        print(f"Using cached interpolation operator {key}")
+        os.utime(filename)
+        return InterpolationOperator.read(filename)
+
+    def put(self, key, operator, **info):
+        """
+        Store an operator and evict old ones if the cache is too big.
+
+        :param key: The key of the operator
+        :param operator: The InterpolationOperator
+        :param info: Description of the operator, shown when listing
+        """
+        filename = self._operator_file(key)
+        tmp_filename = filename + f".{os.getpid()}.tmp"
+        operator.write(tmp_filename)
+        os.replace(tmp_filename, filename)
+
+        info["created"] = time.time()
+        with open(self._info_file(key), "w") as f:
+            json.dump(info, f)
+        self.prune(keep=key)
+
+    def entries(self):
+        """
+        All the cached operators, most recently used first.
+
+        :return: List of dictionaries with key, size, last_used and the
+            info the operator was stored with
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".h5"):
+                continue
+            key = filename[:-3]
+            stat = os.stat(self._operator_file(key))
+            entry = {"key": key, "size": stat.st_size,
+                     "last_used": stat.st_mtime}
+            if os.path.exists(self._info_file(key)):
+                with open(self._info_file(key), "r") as f:
+                    entry.update(json.load(f))
+            entries.append(entry)
+        return sorted(entries, key=lambda e: e["last_used"], reverse=True)
+
+    def size(self):
+        """
+        Total size of the cached operators in bytes.
+        """
+        return sum(entry["size"] for entry in self.entries())
+
+    def remove(self, key):
+        """
+        Remove an operator from the cache.
+
+        :param key: The key of the operator
+        """
+        for filename in [self._operator_file(key), self._info_file(key)]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def prune(self, max_size=None, keep=None):
+        """
+        Evict the least recently used operators until the cache is smaller
+        than max_size.
+
+        :param max_size: Size in bytes, defaults to the cap of the cache.
+            Zero empties the cache.
+        :param keep: Key which is never evicted
+        :return: The keys of the removed operators
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        removed = []
+        for entry in reversed(entries):
+            if total <= max_size:
+                break
+            if entry["key"] == keep:
+                continue
+            self.remove(entry["key"])
+            total -= entry["size"]
+            removed.append(entry["key"])
+        return removed
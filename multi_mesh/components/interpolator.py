@@ -1,38 +1,38 @@
 """
 A collection of functions which perform interpolations between various meshes.
 """
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-# from multi_mesh.helpers import load_lib
-# from multi_mesh.io.exodus import Exodus
+from multi_mesh.helpers import load_lib
+from multi_mesh.io.exodus import Exodus, TRILINEAR_NODE_ORDER
+from multi_mesh.io.gll_model import GLLModel, parameter_label
 from multi_mesh import utils
-from pykdtree.kdtree import KDTree
+from multi_mesh.components.box_index import ElementBoxIndex
+from multi_mesh.components.locator import (element_bounding_boxes,
+                                           locate_points)
+from multi_mesh.components import tensor_gll
+from multi_mesh.components.backends import get_backend
+from multi_mesh.components.structured import StructuredGrid
+from multi_mesh.components.operator import (InterpolationOperator,
+                                            read_operator)
+from multi_mesh.components import cache
+from multi_mesh.components import stats
+from multi_mesh.components.numbering import (cached_global_numbering,
+                                             default_tolerance,
+                                             global_numbering)
 import h5py
-import salvus_fem
-# Buffer the salvus_fem functions, so accessing becomes much faster
-for name, func in salvus_fem._fcts:
-    if name == "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_4__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 3, 1>__Matrix_DerivedB_Eigen::Matrix<double, 125, 1>":
-        GetInterpolationCoefficients3D_order_4 = func
-    if name == "__GetInterpolationCoefficients__int_n0_2__int_n1_2__int_n2_2__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 3, 1>__Matrix_DerivedB_Eigen::Matrix<double, 27, 1>":
-        GetInterpolationCoefficients3D_order_2 = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_4__int_d_3":
-        InverseCoordinateTransformWrapper3D_4 = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_2__int_d_3":
-        InverseCoordinateTransformWrapper3D_2 = func
-    if name == "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_0__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 2, 1>__Matrix_DerivedB_Eigen::Matrix<double, 25, 1>":
-        GetInterpolationCoefficients2D = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_4__int_d_2":
-        InverseCoordinateTransformWrapper2D = func
-    if name == "__CheckHullWrapper__int_n_4__int_d_3":
-        CheckHull = func
 
 
 def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3,
                  nelem_to_search=20, parameters="TTI",
                  model_path="MODEL/data",
-                 coordinates_path="MODEL/coordinates"):
+                 coordinates_path="MODEL/coordinates", operator_file=None,
+                 cache_dir=None, threads=0, chunks=None, compression=None,
+                 block_bytes=256 * 1024 ** 2, precision="double",
+                 region=None):
     """
     Interpolate parameters between exodus file and hdf5 gll file.
     Only works in 3 dimensions.
@@ -40,136 +40,259 @@ def exodus_2_gll(mesh, gll_model, gll_order=4, dimensions=3,
     :param gll_model: The gll file
     :param gll_order: The order of the gll polynomials
     :param dimensions: How many spatial dimensions in meshes
-    :param nelem_to_search: Amount of closest elements to consider
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
     :param parameters: Parameters to be interolated, possible to pass, "ISO",
     "TTI" or a list of parameters.
+    :param operator_file: If this file exists, the interpolation operator in
+    it is used instead of locating the points, otherwise the operator is
+    computed and saved to it. An operator computed for other meshes is an
+    error.
+    :param cache_dir: Operator cache directory, defaults to the
+    MULTI_MESH_CACHE_DIR environment variable. Without either no cache is
+    used.
+    :param threads: Amount of threads for the trilinear interpolation, the
+    OpenMP default if 0
+    :param chunks: HDF5 chunking of the written dataset, an integer is the
+    amount of elements per chunk
+    :param compression: HDF5 compression of the written dataset
+    :param block_bytes: The results are computed and written in blocks of
+    whole elements of about this size
+    :param precision: "single" stores and interpolates the values in
+    single precision, which halves the memory and the file size of the
+    values. The points are located in double precision either way.
+    :param region: Region of the source model which changed since the
+    target was last interpolated, see multi_mesh.components.region. Only
+    the target elements which depend on it are interpolated and written,
+    in place, the rest of the target model is left untouched. The target
+    model has to hold the same parameters already.
     """
+    dtype = utils.value_dtype(precision)
+    with stats.phase(stats.READ):
+        exodus = Exodus(mesh, node_order=TRILINEAR_NODE_ORDER)
+    with h5py.File(gll_model, "r") as gll:
+        operator = _get_operator(
+            lambda: exodus_2_gll_operator(exodus, gll[coordinates_path],
+                                          nelem_to_search, threads),
+            operator_file, cache_dir,
+            lambda: (cache.exodus_geometry_hash(exodus),
+                     cache.gll_geometry_hash(gll_model, coordinates_path)),
+            dict(nelem_to_search=nelem_to_search),
+            kind="exodus_2_gll", source=mesh, target=gll_model)
 
-    lib = load_lib()
-    exodus, centroid_tree = utils.load_exodus(mesh, find_centroids=True)
+    parameters = utils.pick_parameters(parameters)
+    with stats.phase(stats.READ):
+        param_exodus = np.asarray(exodus.get_nodal_fields(parameters),
+                                  dtype=dtype)
+    if region is not None:
+        changed = region.changed(
+            exodus.points, param_exodus,
+            lambda previous: Exodus(previous).get_nodal_fields(parameters))
+        with GLLModel(gll_model, "r+", model_path,
+                      coordinates_path) as model:
+            _update_changed_elements(
+                model, operator, param_exodus,
+                operator.changed_targets(changed), parameters, dtype,
+                block_bytes=block_bytes)
+        return
+
+    with h5py.File(gll_model, "r+") as gll:
+        with stats.phase(stats.WRITE):
+            utils.remove_and_create_empty_dataset(
+                gll, parameters, model_path, coordinates_path, chunks=chunks,
+                compression=compression, dtype=dtype)
 
-    gll = h5py.File(gll_model, 'r+')
+        # Write element major blocks which line up with the HDF5 chunks, so
+        # every chunk is written exactly once.
+        dataset = gll[model_path]
+        block_size = max(1, block_bytes // (dataset.dtype.itemsize *
+                                            int(np.prod(dataset.shape[1:]))))
+        if dataset.chunks is not None:
+            block_size = max(1, block_size // dataset.chunks[0]) * \
+                dataset.chunks[0]
+        for start, stop, values in operator.apply_blocks(param_exodus,
+                                                         block_size, dtype):
+            with stats.phase(stats.WRITE):
+                dataset[start:stop] = values
+
+
+def exodus_2_gll_operator(exodus, gll_coords, nelem_to_search=20, threads=0):
+    """
+    Compute the operator which trilinearly interpolates the nodal fields of
+    an exodus mesh onto the points of a gll model.
+    :param exodus: The exodus mesh, an Exodus object
+    :param gll_coords: Coordinates of the gll model [nelem, ngll, 3]
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
+    :param threads: Amount of OpenMP threads, the OpenMP default if 0
+    :return: InterpolationOperator
+    """
+    connectivity = exodus.connectivity_in_order(TRILINEAR_NODE_ORDER)
+    exopoints = exodus.points
+    with stats.phase(stats.READ):
+        # The coordinates can be an HDF5 dataset, read them once instead of
+        # one strided slice per gll point.
+        gll_coords = np.asarray(gll_coords, dtype=np.float64)
+    with stats.phase(stats.TREE_BUILD):
+        box_index = trilinear_index(exopoints, connectivity)
 
-    gll_coords = gll[coordinates_path]
     npoints = gll_coords.shape[0]
     gll_points = gll_coords.shape[1]
 
-    nearest_element_indices = np.zeros(shape=[npoints, gll_points,
-                                              nelem_to_search],
-                                       dtype=np.int64)
+    enclosing_elem_node_indices = np.zeros((npoints, gll_points, 8),
+                                           dtype=np.int64)
+    weights = np.zeros((npoints, gll_points, 8))
 
     for i in range(gll_points):
-        _, nearest_element_indices[:, i, :] = centroid_tree.query(
-            gll_coords[:, i, :], k=nelem_to_search)
+        points = np.ascontiguousarray(gll_coords[:, i, :])
+        point_node_indices, point_weights, nfailed = trilinear_weights(
+            box_index, connectivity, exopoints, points, nelem_to_search,
+            threads)
+        assert nfailed == 0, f"{nfailed} points could not be interpolated."
+        enclosing_elem_node_indices[:, i, :] = point_node_indices
+        weights[:, i, :] = point_weights
 
-    nearest_element_indices = np.swapaxes(nearest_element_indices, 0, 1)
+    with stats.phase(stats.ASSEMBLY):
+        return InterpolationOperator.from_stencils(
+            enclosing_elem_node_indices.reshape(-1, 8),
+            weights.reshape(-1, 8), source_shape=(exodus.npoint,),
+            target_shape=(npoints, gll_points))
 
-    enclosing_elem_node_indices = np.zeros((gll_points, npoints, 8),
-                                           dtype=np.int64)
-    weights = np.zeros((gll_points, npoints, 8))
-    permutation = [0, 3, 2, 1, 4, 5, 6, 7]
-    i = np.argsort(permutation)
 
-    # i = np.argsort(permutation)
-    connectivity = np.ascontiguousarray(exodus.connectivity[:, i])
-    exopoints = np.ascontiguousarray(exodus.points)
-    nfailed = 0
+def trilinear_index(nodes, connectivity):
+    """
+    The index to find the trilinear interpolation weights with, the
+    structured grid of the mesh if it is one or its element box index.
+    :param nodes: Coordinates of the nodes [nnodes, 3]
+    :param connectivity: Connectivity in TRILINEAR_NODE_ORDER [nelem, 8]
+    :return: StructuredGrid or ElementBoxIndex
+    """
+    grid = StructuredGrid.from_connectivity(nodes, connectivity)
+    if grid is not None:
+        print("The mesh is a structured grid, locating points directly")
+        return grid
+    return ElementBoxIndex.from_connectivity(nodes, connectivity)
 
-    parameters = utils.pick_parameters(parameters)
-    utils.remove_and_create_empty_dataset(gll, parameters, model_path,
-                                          coordinates_path)
-    param_exodus = np.zeros(shape=(len(parameters),
-                                   len(exodus.get_nodal_field(parameters[0]))))
-    values = np.zeros(shape=(len(parameters),
-                             len(exodus.get_nodal_field(parameters[0]))))
-    for _i, param in enumerate(parameters):
-        param_exodus[_i, :] = exodus.get_nodal_field(param)
 
-    for i in range(gll_points):
-        if (i+1) % 10 == 0 or i == gll_points-1 or i == 0:
-            print(f"Trilinear interpolation for gll point: {i+1}/{gll_points}")
-        nfailed += lib.triLinearInterpolator(nelem_to_search,
-                                             npoints,
-                                             np.ascontiguousarray(
-                                                 nearest_element_indices[
-                                                     i, :, :]),
-                                             connectivity,
-                                             enclosing_elem_node_indices[
-                                                 i, :, :],
-                                             exopoints,
-                                             weights[i, :, :],
-                                             np.ascontiguousarray(
-                                                 gll_coords[:, i, :]))
-        assert nfailed is 0, f"{nfailed} points could not be interpolated."
-        values = np.sum(param_exodus[:,
-                                     enclosing_elem_node_indices[i, :, :]] * weights[
-                        i, :, :], axis=2)
-
-        gll[model_path][:, :, i] = values.T
+def trilinear_weights(box_index, connectivity, nodes, points,
+                      nelem_to_search=20, threads=0, k_start=4):
+    """
+    Find the trilinear interpolation weights of points in a hexahedral mesh.
+    The points are first looked for in the elements whose bounding boxes
+    contain them. The ones which are not found are tried again with the
+    k_start nearest elements, then with twice as many and so on up to
+    nelem_to_search, only testing the elements which are new every time.
+    In a structured grid the weights are computed directly.
+    :param box_index: ElementBoxIndex or StructuredGrid of the mesh, see
+    trilinear_index
+    :param connectivity: Connectivity in TRILINEAR_NODE_ORDER [nelem, 8]
+    :param nodes: Coordinates of the nodes [nnodes, 3]
+    :param points: Points to interpolate onto [npoints, 3]
+    :param nelem_to_search: Largest amount of nearest elements to search
+    :param threads: Amount of OpenMP threads, the OpenMP default if 0
+    :param k_start: Amount of nearest elements of the first retry
+    :return: Nodes of the enclosing elements [npoints, 8], their weights
+    [npoints, 8] and the amount of points which could not be interpolated
+    """
+    stats.count("points_located", len(points))
+    if isinstance(box_index, StructuredGrid):
+        with stats.phase(stats.POINT_LOCATION):
+            node_indices, weights, nfailed = box_index.trilinear_weights(
+                points)
+        stats.count("points_not_found", nfailed)
+        return node_indices, weights, nfailed
+
+    lib = load_lib()
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    npoints = points.shape[0]
+    node_indices = np.zeros((npoints, 8), dtype=np.int64)
+    weights = np.zeros((npoints, 8))
+
+    missing = np.arange(npoints)
+    with stats.phase(stats.CANDIDATE_QUERY):
+        candidates = box_index.query(points, fallback=0)
+    k_tested = 0
+    k = k_start
+    while True:
+        missing_nodes = np.zeros((missing.size, 8), dtype=np.int64)
+        missing_weights = np.zeros((missing.size, 8))
+        stats.count("candidates_tested", np.count_nonzero(candidates >= 0))
+        with stats.phase(stats.POINT_LOCATION):
+            lib.triLinearInterpolator(candidates.shape[1], missing.size,
+                                      candidates, connectivity,
+                                      missing_nodes, nodes, missing_weights,
+                                      np.ascontiguousarray(points[missing]),
+                                      threads)
+        node_indices[missing] = missing_nodes
+        weights[missing] = missing_weights
+        # The weights of an interpolated point sum up to one, the ones of a
+        # failed point are left at zero.
+        missing = missing[~np.any(missing_weights != 0.0, axis=1)]
+        if missing.size == 0 or k_tested >= nelem_to_search:
+            break
+        if k_tested == 0:
+            stats.count("fallback_points", missing.size)
+        k = min(k, nelem_to_search)
+        with stats.phase(stats.CANDIDATE_QUERY):
+            candidates = np.ascontiguousarray(
+                box_index.nearest(points[missing], k)[:, k_tested:])
+        k_tested = k
+        k *= 2
+    stats.count("points_not_found", missing.size)
+    return node_indices, weights, missing.size
 
 
 def gll_2_exodus(gll_model, exodus_model, gll_order=4, dimensions=3,
                  nelem_to_search=20, parameters="TTI",
                  model_path="MODEL/data",
-                 coordinates_path="MODEL/coordinates", gradient=False):
+                 coordinates_path="MODEL/coordinates", gradient=False,
+                 operator_file=None, cache_dir=None):
     """
     Interpolate parameters from gll file to exodus model. This will mostly be
     used to interpolate gradients to begin with.
     :param gll_model: path to gll_model
     :param exodus_model: path_to_exodus_model
     :param parameters: Currently not used but will be fixed later
+    :param operator_file: If this file exists, the interpolation operator in
+    it is used instead of locating the points, otherwise the operator is
+    computed and saved to it. An operator computed for other meshes is an
+    error.
+    :param cache_dir: Operator cache directory, defaults to the
+    MULTI_MESH_CACHE_DIR environment variable. Without either no cache is
+    used.
     """
-    with h5py.File(gll_model, 'r') as gll_model:
-        gll_points = np.array(gll_model[coordinates_path][:], dtype=np.float64)
-        gll_data = gll_model[model_path][:]
-        params = gll_model[model_path].attrs.get(
-            "DIMENSION_LABELS")[1].decode()
-        parameters = params[2:-2].replace(" ", "").split("|")
-
-    centroids = _find_gll_centroids(gll_points, dimensions)
-    print("centroids", np.shape(centroids))
-    # Build a KDTree of the centroids to look for nearest elements
-    print("Building KDTree")
-    centroid_tree = KDTree(centroids)
+    with stats.phase(stats.READ), \
+            GLLModel(gll_model, model_path=model_path,
+                     coordinates_path=coordinates_path) as model:
+        gll_points = model.read_coordinates()
+        gll_data = model.read()
+        parameters = model.labels
 
     print("Read in mesh")
-    exodus = Exodus(exodus_model, mode="a")
-    # Find nearest elements
-    print("Querying the KDTree")
-    print(exodus.points.shape)
-    # if exodus.points.shape[1] == 3:
-    #     exodus.points = exodus.points[:, :-1]
-    _, nearest_element_indices = centroid_tree.query(exodus.points,
-                                                     k=nelem_to_search)
-    npoints = exodus.npoint
-    # parameters = utils.pick_parameters(parameters)
-    values = np.zeros(shape=[npoints, len(parameters)])
+    with stats.phase(stats.READ):
+        exodus = Exodus(exodus_model, mode="a")
     print(parameters)
-    s = 0
-
-    for point in exodus.points:
-        if s == 0 or (s+1) % 1000 == 0:
-            print(f"Now I'm looking at point number:"
-                  f"{s+1}{len(exodus.points)}")
-        element, ref_coord = _check_if_inside_element(gll_points,
-                                                      nearest_element_indices[
-                                                          s, :],
-                                                      point, dimensions)
-
-        coeffs = get_coefficients(4, 4, 0, ref_coord, dimensions)
-        values[s, :] = np.sum(gll_data[element, :, :] * coeffs, axis=1)
-        s += 1
-    i = 0
-    for param in parameters:
-        exodus.attach_field(param, np.zeros_like(values[:, i]))
-        exodus.attach_field(param, values[:, i])
-        i += 1
+
+    operator = _get_operator(
+        lambda: gll_2_exodus_operator(gll_points, exodus.points,
+                                      dimensions, nelem_to_search),
+        operator_file, cache_dir,
+        lambda: (cache.gll_geometry_hash(gll_model, coordinates_path),
+                 cache.exodus_geometry_hash(exodus)),
+        dict(nelem_to_search=nelem_to_search, dimensions=dimensions),
+        kind="gll_2_exodus", source=gll_model, target=exodus_model)
+
+    values = operator.apply(gll_data)
+    with stats.phase(stats.WRITE):
+        exodus.attach_fields(dict(zip(parameters, values)))
 
 
 def gll_2_gll(from_gll, to_gll,
               nelem_to_search=20, parameters="ISO", from_model_path="MODEL/data",
               to_model_path="MODEL/data", from_coordinates_path="MODEL/coordinates",
-              to_coordinates_path="MODEL/coordinates", gradient=False):
+              to_coordinates_path="MODEL/coordinates", gradient=False,
+              operator_file=None, cache_dir=None, workers=1,
+              memory_budget=None, precision="double", region=None):
     """
     Interpolate parameters between two gll models.
     It loads from_gll to memory, looks at the points of the to_gll and
@@ -188,149 +311,723 @@ def gll_2_gll(from_gll, to_gll,
     "TTI" or a list of parameters.
     :param gradient: If this is a gradient to be added to another gradient,
     only put true if you want to add on top of a currently existing gradient
+    :param operator_file: If this file exists, the interpolation operator in
+    it is used instead of locating the points, otherwise the operator is
+    computed and saved to it. An operator computed for other meshes is an
+    error.
+    :param cache_dir: Operator cache directory, defaults to the
+    MULTI_MESH_CACHE_DIR environment variable. Without either no cache is
+    used.
+    :param workers: Amount of processes to locate the points with
+    :param memory_budget: If given, the models are streamed in chunks of
+    elements instead of being loaded to memory, using roughly this many
+    bytes at a time. Interpolation operators are not used in that case,
+    operator_file and cache_dir are an error and the
+    MULTI_MESH_CACHE_DIR cache is not used.
+    :param precision: "single" stores and interpolates the values in
+    single precision, which halves the memory and the file size of the
+    values. The points are located in double precision either way.
+    :param region: Region of the source model which changed since the
+    target was last interpolated, see multi_mesh.components.region. Only
+    the target elements which depend on it are interpolated and written,
+    in place, the rest of the target model is left untouched. The target
+    model has to hold the same parameters already.
     """
-    from tqdm import tqdm
+    dtype = utils.value_dtype(precision)
+    if memory_budget is not None:
+        if operator_file is not None or cache_dir is not None or \
+                region is not None:
+            raise ValueError("Interpolation operators, the operator cache "
+                             "and regions can not be used when streaming "
+                             "with a memory budget")
+        return gll_2_gll_streaming(
+            from_gll, to_gll, memory_budget, nelem_to_search,
+            from_model_path, to_model_path, from_coordinates_path,
+            to_coordinates_path, gradient, workers, precision)
 
     print("Initialization stage")
-    original_points, original_data, original_params = utils.load_hdf5_params_to_memory(
-        from_gll, from_model_path, from_coordinates_path)
+    with stats.phase(stats.READ):
+        original_points, original_data, original_params = utils.load_hdf5_params_to_memory(
+            from_gll, from_model_path, from_coordinates_path, dtype)
 
-    dimensions = original_points.shape[2]
-    from_gll_order = int(round(original_data.shape[2] ** (1.0/dimensions))) - 1
     parameters = original_params
-    # parameters = utils.pick_parameters(parameters)
-    assert set(parameters) <= set(
-        original_params), f"Original mesh does not have all the parameters you wish to interpolate. You asked for {parameters}, mesh has {original_params}"
-
-    all_old_points = original_points.reshape(
-        original_points.shape[0] * original_points.shape[1], original_points.shape[2])
-
-    original_tree = KDTree(all_old_points)
-    new = h5py.File(to_gll, 'r+')
-    
-    # We look for the fluid elements, we wan't to avoid solids getting fluid values
-    # which can happen if one gll point hits a solid value.
-    new_points = np.array(new[to_coordinates_path][:], dtype=np.float64)
-    elem_params = new["MODEL/element_data"].attrs.get("DIMENSION_LABELS")[1].decode()
-    elem_params = elem_params[2:-2].replace(" ", "").split("|")
-    fluid_index = elem_params.index("fluid")
-    fluid_elements = new["MODEL/element_data"][:, fluid_index].astype(bool)
-    solid_elements = np.invert(fluid_elements)
-    # Save the current values in order to fix any case of solid getting fluid values
-    new_values = np.copy(new[to_model_path][:])
-
-    permutation = np.arange(0, len(parameters))
-    i = 0
-    for param in original_params:
-        if param in parameters:
-            permutation[i] = parameters.index(param)
-            i += 1
-    """
-    The reordering of parameters is currently not used, what is used is simply to
-    interpolate all parameters from the parent mesh to the receiving mesh
-    # Check if there is some need for reordering of parameters.
-    reorder = False
-    for i in range(len(permutation)):
-        if i == 0:
-            if permutation[i] != 0:
-                reorder = True
-                break
-        else:
-            if permutation[i] != permutation[i-1] + 1:
-                reorder = True
-                break
-
-    if reorder:
-        print("I have to reorder parameters")
-        args = np.argsort(permutation).astype(int)
-    else:
-        args = np.arange(start=0, stop=len(permutation)).astype(int)
-    parameters = [parameters[x] for x in args]
-    print(parameters)
+
+    with GLLModel(to_gll, "r+", to_model_path, to_coordinates_path,
+                  dtype) as new:
+        # We look for the fluid elements, we wan't to avoid solids getting
+        # fluid values which can happen if one gll point hits a solid value.
+        with stats.phase(stats.READ):
+            new_points = new.read_coordinates()
+            solid_elements = new.solid_elements()
+            # Save the current values in order to fix any case of solid
+            # getting fluid values
+            if region is None:
+                new_values = new.read()
+
+        operator = _get_operator(
+            lambda: gll_2_gll_operator(
+                original_points, new_points, nelem_to_search, workers,
+                numbering=cached_global_numbering(new.file,
+                                                  to_coordinates_path)),
+            operator_file, cache_dir,
+            lambda: (cache.gll_geometry_hash(from_gll, from_coordinates_path),
+                     cache.gll_geometry_hash(to_gll, to_coordinates_path)),
+            dict(nelem_to_search=nelem_to_search),
+            kind="gll_2_gll", source=from_gll, target=to_gll)
+
+        if region is not None:
+            changed = region.changed(
+                original_points, original_data,
+                lambda previous: utils.load_hdf5_params_to_memory(
+                    previous, from_model_path, from_coordinates_path,
+                    dtype)[1])
+            _update_changed_elements(
+                new, operator, original_data,
+                operator.changed_targets(changed), parameters, dtype,
+                solid_elements=None if gradient else solid_elements)
+            return
+
+        print("Interpolation done, Need to organize the results and write "
+              "to file")
+        values = operator.apply(original_data, dtype)
+        stats.count("nan_values", np.count_nonzero(np.isnan(values)))
+
+        if not gradient:
+            values[~solid_elements] = new_values[~solid_elements]
+
+            vs_index = parameters.index("VS")
+            # look at fake fluid values
+            zero_vs = np.where(values[:, vs_index, :] == 0.0)
+            print("If any fluid values accidentally went to the solid part "
+                  "we fix it")
+            for _i, elem in enumerate(np.unique(zero_vs[0])):
+                if solid_elements[elem]:
+                    values[elem, :, :] = new_values[elem, :, :]
+
+        # This needs to be implemented as a sum not gradient.
+        # if gradient:
+        #     # Gradient implementations still need to be looked at.
+        #     existing = new[to_model_path]
+        #     values += existing
+        with stats.phase(stats.WRITE):
+            utils.remove_and_create_empty_dataset(new.file, parameters,
+                                                  to_model_path,
+                                                  to_coordinates_path,
+                                                  dtype=dtype)
+
+            new.file[to_model_path][:, :, :] = values
+
+
+def gll_2_gll_streaming(from_gll, to_gll, memory_budget, nelem_to_search=20,
+                        from_model_path="MODEL/data",
+                        to_model_path="MODEL/data",
+                        from_coordinates_path="MODEL/coordinates",
+                        to_coordinates_path="MODEL/coordinates",
+                        gradient=False, workers=1, precision="double"):
+    """
+    Interpolate parameters between two gll models without loading either of
+    them to memory. The new model is processed in chunks of elements, for
+    every chunk only the elements of the original model which are
+    candidates for its points are read and the results are written
+    straight to file. The only thing kept in memory for the whole run is
+    the box index of the original elements.
+
+    The results are written to a new dataset next to to_model_path which
+    replaces it once everything is interpolated, so the new model is left
+    untouched if something goes wrong on the way.
+
+    :param from_gll: path to gll mesh to interpolate from
+    :param to_gll: path to gll mesh to interpolate to
+    :param memory_budget: Approximate amount of bytes to use for a chunk
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
+    :param gradient: If True the fluid elements are not reset to their
+    current values
+    :param workers: Amount of processes to locate the points of a chunk
+    :param precision: "single" stores and interpolates the values in
+    single precision, which halves the memory and the file size of the
+    values. The points are located in double precision either way.
+    """
+    dtype = utils.value_dtype(precision)
+    with GLLModel(from_gll, "r", from_model_path, from_coordinates_path,
+                  dtype) as original, \
+            GLLModel(to_gll, "r+", to_model_path, to_coordinates_path,
+                     dtype) as new:
+        parameters = original.parameters
+        nelem, ngll, dimensions = \
+            original.nelem, original.ngll, original.dimension
+        nparams = len(parameters)
+        order = tensor_gll.order_from_nodes(ngll, dimensions)
+
+        print("Computing the bounding boxes of the original elements")
+        rows = max(1, memory_budget // (4 * ngll * dimensions * 8))
+        lower = np.empty((nelem, dimensions))
+        upper = np.empty((nelem, dimensions))
+        with stats.phase(stats.TREE_BUILD):
+            for start in range(0, nelem, rows):
+                coords = original.read_coordinates(
+                    slice(start, start + rows))
+                lower[start:start + rows], upper[start:start + rows] = \
+                    element_bounding_boxes(coords)
+                del coords
+            box_index = ElementBoxIndex(lower, upper)
+
+        new_nelem, new_ngll = new.nelem, new.ngll
+        solid_elements = new.solid_elements()
+
+        # The working memory per point is dominated by the gathered control
+        # nodes, shape functions and source values of its element, half of
+        # the budget is left for the original elements read for a chunk.
+        point_bytes = 8 * (ngll * (nparams + 2 * dimensions + 2) +
+                           nelem_to_search * (dimensions + 2) +
+                           dimensions + 2 * nparams)
+        source_bytes = memory_budget // 2
+        chunk = max(1, source_bytes // (new_ngll * point_bytes))
+
+        streaming_path = to_model_path + "_streaming"
+        if streaming_path in new.file:
+            del new.file[streaming_path]
+        output = new.file.create_dataset(streaming_path,
+                                    shape=(new_nelem, nparams, new_ngll),
+                                    dtype=dtype)
+
+        print(f"Interpolating {new_nelem} elements in chunks of {chunk}")
+        tolerance = default_tolerance(
+            new.read_coordinates(slice(0, chunk)))
+        nnan = 0
+        chunks = [(start, min(start + chunk, new_nelem))
+                  for start in range(0, new_nelem, chunk)][::-1]
+        while chunks:
+            start, stop = chunks.pop()
+            with stats.phase(stats.READ):
+                chunk_coords = new.read_coordinates(slice(start, stop))
+            recon, unique_points = global_numbering(chunk_coords, tolerance)
+            with stats.phase(stats.CANDIDATE_QUERY):
+                candidates = box_index.query(unique_points,
+                                             fallback=nelem_to_search)
+            needed = np.unique(candidates[candidates >= 0])
+            if needed.size * ngll * (dimensions + nparams) * 8 > \
+                    source_bytes and stop - start > 1:
+                middle = (start + stop) // 2
+                chunks += [(middle, stop), (start, middle)]
+                continue
+
+            print(f"Elements {start}-{stop} of {new_nelem}, reading "
+                  f"{needed.size} original elements")
+            with stats.phase(stats.READ):
+                element_nodes = _read_elements(original.coordinates, needed,
+                                               source_bytes)
+                element_data = _read_elements(original.data, needed,
+                                              source_bytes)
+            local_candidates = np.where(
+                candidates >= 0, np.searchsorted(needed, candidates), -1)
+
+            if workers > 1:
+                with stats.phase(stats.POINT_LOCATION):
+                    elements, coeffs = _locate_in_parallel(
+                        unique_points, local_candidates, element_nodes,
+                        workers)
+            else:
+                with stats.phase(stats.POINT_LOCATION):
+                    elements, ref_coords, _ = locate_points(
+                        unique_points, local_candidates, element_nodes,
+                        dimensions, inverse=inverse_transform_batch,
+                        boxes=(lower[needed], upper[needed]))
+                with stats.phase(stats.COEFFICIENTS):
+                    coeffs = get_backend().coefficients(order, ref_coords)
+            with stats.phase(stats.GATHER):
+                values = np.einsum("npa,na->np", element_data[elements],
+                                   coeffs.astype(dtype, copy=False))
+                del element_nodes, element_data, coeffs
+                values = values[recon].reshape(
+                    stop - start, new_ngll, nparams).transpose(0, 2, 1)
+            nnan += np.count_nonzero(np.isnan(values))
+
+            if not gradient:
+                with stats.phase(stats.READ):
+                    current_values = new.read(slice(start, stop))
+                _keep_fluid_values(values, current_values,
+                                   solid_elements[start:stop],
+                                   parameters.index("VS"))
+
+            with stats.phase(stats.WRITE):
+                output[start:stop] = values
+
+        stats.count("nan_values", nnan)
+        del new.file[to_model_path]
+        new.file.move(streaming_path, to_model_path)
+        utils.create_dimension_labels(new.file, parameters)
+
+
+def sum_gll_gradients(simulations, master, first=True, nelem_to_search=25,
+                      model_path="ELASTIC/data",
+                      coordinates_path="ELASTIC/coordinates",
+                      cache_dir=None, workers=1, buffer_file=None,
+                      block_bytes=256 * 1024 ** 2, precision="double"):
+    """
+    Interpolate the gradients of many simulations onto the master model and
+    sum them up. The simulations are grouped by mesh, so the points are
+    located once per mesh rather than once per gradient, and only the
+    operator of the current mesh is kept in memory. The sum is accumulated
+    in a buffer and the master model is written once at the end.
+
+    The gradients are stored as [time, element, parameter, point] with the
+    parameters labelled on the third dimension, the RHO and MassMatrix
+    parameters of the simulations are not summed.
+
+    :param simulations: Paths to the gradients of the simulations
+    :param master: Path to the master model the sum is written to
+    :param first: If False the sum is added on top of the gradient which is
+    already on the master model
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
+    :param cache_dir: Operator cache directory, defaults to the
+    MULTI_MESH_CACHE_DIR environment variable. Without either no cache is
+    used.
+    :param workers: Amount of processes to locate the points with
+    :param buffer_file: If given, the sum is accumulated in a memory mapped
+    scratch file there instead of in memory, it is removed afterwards
+    :param block_bytes: Gradients are interpolated and added in blocks of
+    whole elements of about this size
+    :param precision: "single" interpolates and sums the gradients in
+    single precision, which halves the memory of the sum. The points are
+    located in double precision either way and the master model is stored
+    in single precision regardless.
+    """
+    if not simulations:
+        raise ValueError("There are no gradients to sum")
+    dtype = utils.value_dtype(precision)
+    itemsize = np.dtype(dtype).itemsize
+    print("Grouping the gradients by mesh")
+    meshes = {}
+    with stats.phase(stats.READ):
+        for simulation in simulations:
+            key = cache.gll_geometry_hash(simulation, coordinates_path)
+            meshes.setdefault(key, []).append(simulation)
+    print(f"{len(simulations)} gradients on {len(meshes)} different meshes")
+
+    summed = None
+    try:
+        with GLLModel(master, "r+", model_path,
+                      coordinates_path) as master_model:
+            with stats.phase(stats.READ):
+                master_points = master_model.read_coordinates()
+            master_hash = cache.gll_geometry_hash(master, coordinates_path)
+            nelem, ngll = master_points.shape[:2]
+            numbering = None
+            parameters = None
+            done = 0
+
+            for key, gradients in meshes.items():
+                with stats.phase(stats.READ), \
+                        GLLModel(gradients[0], "r", model_path,
+                                 coordinates_path) as sim:
+                    sim_points = sim.read_coordinates()
+                if numbering is None:
+                    numbering = cached_global_numbering(master_model.file,
+                                                        coordinates_path)
+                operator = _get_operator(
+                    lambda: gll_2_gll_operator(sim_points, master_points,
+                                               nelem_to_search, workers,
+                                               numbering=numbering),
+                    None, cache_dir, lambda: (key, master_hash),
+                    dict(nelem_to_search=nelem_to_search),
+                    kind="gll_2_gll", source=gradients[0], target=master)
+
+                for simulation in gradients:
+                    done += 1
+                    print(f"Adding gradient {done}/{len(simulations)}: "
+                          f"{simulation}")
+                    with stats.phase(stats.READ), \
+                            GLLModel(simulation, "r", model_path,
+                                     coordinates_path, dtype) as sim:
+                        if parameters is None:
+                            parameters = [
+                                param for param in sim.parameters
+                                if param not in ("RHO", "MassMatrix")]
+                            summed = _gradient_buffer(
+                                (nelem, len(parameters), ngll), buffer_file,
+                                dtype)
+                        sim_data = sim.read(parameters=parameters)
+
+                    block_size = max(1, block_bytes //
+                                     (itemsize * len(parameters) * ngll))
+                    for start, stop, values in operator.apply_blocks(
+                            sim_data, block_size, dtype):
+                        summed[start:stop] += values
+                    del sim_data
+                del operator
+
+            if not first:
+                for i, param in enumerate(parameters):
+                    if param in master_model.parameters:
+                        summed[:, i, :] += master_model.read(
+                            parameters=[param])[:, 0, :]
+
+            print("Writing the summed gradient to the master model")
+            with stats.phase(stats.WRITE):
+                del master_model.file[model_path]
+                dataset = master_model.file.create_dataset(
+                    model_path, shape=(1, nelem, len(parameters), ngll),
+                    dtype="f4")
+                block_size = max(1, block_bytes // (dataset.dtype.itemsize *
+                                                    len(parameters) * ngll))
+                for start in range(0, nelem, block_size):
+                    dataset[0, start:start + block_size] = \
+                        summed[start:start + block_size]
+                dataset.dims[0].label = "time"
+                dataset.dims[1].label = "element"
+                dataset.dims[2].label = parameter_label(parameters)
+                dataset.dims[3].label = "point"
+    finally:
+        del summed
+        if buffer_file is not None and os.path.exists(buffer_file):
+            os.remove(buffer_file)
+
+
+def _update_changed_elements(model, operator, values, elements,
+                             parameters, dtype, solid_elements=None,
+                             block_bytes=256 * 1024 ** 2):
+    """
+    Interpolate onto some of the target elements and write them into the
+    existing model, one contiguous run of elements at a time.
+    :param model: Target GLLModel, opened with mode "r+"
+    :param operator: Interpolation operator onto the target model
+    :param values: Source values
+    :param elements: Boolean mask of the target elements to update
+    :param parameters: Parameters of the values, the model has to have
+    the same ones
+    :param dtype: dtype to interpolate in
+    :param solid_elements: If given, fluid elements and solid elements
+    which would get fluid values keep their current values
+    :param block_bytes: Largest size of a block of elements
+    """
+    if model.parameters != list(parameters):
+        raise ValueError(f"The target model has the parameters "
+                         f"{model.parameters}, can only update it in place "
+                         f"with the same parameters {list(parameters)}")
+    nupdate = int(np.count_nonzero(elements))
+    print(f"Updating the {nupdate} of {model.nelem} elements which "
+          f"depend on the changed region")
+    stats.count("elements_updated", nupdate)
+
+    block_size = max(1, block_bytes // (np.dtype(dtype).itemsize *
+                                        model.nparams * model.ngll))
+    for start, stop, block in operator.apply_blocks(values, block_size,
+                                                    dtype, elements):
+        if solid_elements is not None:
+            with stats.phase(stats.READ):
+                current = model.read(slice(start, stop), dtype=dtype)
+            _keep_fluid_values(block, current, solid_elements[start:stop],
+                               parameters.index("VS"))
+        with stats.phase(stats.WRITE):
+            model.write(block, slice(start, stop), buffer_bytes=block_bytes)
+
+
+def _keep_fluid_values(values, current_values, solid, vs_index):
+    """
+    Fluid elements keep their current values, and so do solid elements
+    which got a zero VS from a fluid element nearby.
+    :param values: Interpolated values of some elements, changed in place
+    :param current_values: Current values of the same elements
+    :param solid: Which of the elements are solid
+    :param vs_index: Index of VS in the parameters
+    """
+    values[~solid] = current_values[~solid]
+    # look at fake fluid values
+    zero_vs = np.any(values[:, vs_index, :] == 0.0, axis=1)
+    values[zero_vs & solid] = current_values[zero_vs & solid]
+
+
+def _gradient_buffer(shape, buffer_file=None, dtype=np.float64):
+    """
+    A zeroed buffer to sum gradients in, memory mapped to buffer_file if
+    given.
+    """
+    if buffer_file is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(buffer_file, dtype=dtype, mode="w+", shape=shape)
+
+
+def _read_elements(view, elements, max_bytes):
     """
+    Read a sorted selection of elements from a DatasetView. If the
+    elements are close together the whole range is read, which is much
+    faster than a scattered selection, otherwise only the elements.
+    :param view: DatasetView with the elements along the first axis
+    :param elements: Sorted unique element indices
+    :param max_bytes: The range is only read if it is smaller than this
+    :return: Array with one row per element
+    """
+    first, last = elements[0], elements[-1] + 1
+    row_bytes = int(np.prod(view.shape[1:])) * view.dtype.itemsize
+    if (last - first) * row_bytes <= max_bytes:
+        return view[first:last][elements - first]
+    return view[elements]
+
+
+def _get_operator(build, operator_file=None, cache_dir=None, hashes=None,
+                  settings=None, kind=None, **info):
+    """
+    Get an interpolation operator from the operator file, from the cache or
+    by computing it, in that order. An operator file computed for other
+    meshes is an error.
+    :param build: Function which computes the operator
+    :param operator_file: Operator file, written if it does not exist
+    :param cache_dir: Operator cache directory, if None the
+    MULTI_MESH_CACHE_DIR environment variable is used if set
+    :param hashes: Function which computes the geometry hashes of the
+    source and the target mesh
+    :param settings: Settings the operator depends on, part of the cache key
+    :param kind: Kind of interpolation, part of the cache key
+    :param info: Description of the operator stored in the cache
+    """
+    use_cache = cache_dir is not None or \
+        cache.default_cache_dir() is not None
+    source_hash, target_hash = None, None
+    if operator_file is not None or use_cache:
+        source_hash, target_hash = hashes()
+
+    with stats.phase(stats.OPERATOR_IO):
+        operator = read_operator(operator_file, source_hash, target_hash)
+    if operator is not None:
+        stats.count("operator_file_hits")
+        return operator
+
+    operator_cache = None
+    if use_cache:
+        operator_cache = cache.OperatorCache(cache_dir)
+        key = cache.operator_key(kind, source_hash, target_hash,
+                                 **(settings or {}))
+        with stats.phase(stats.OPERATOR_IO):
+            operator = operator_cache.get(key)
+        if operator is not None:
+            stats.count("operator_cache_hits")
+    built = operator is None
+    if built:
+        operator = build()
+        stats.count("operators_built")
+    operator.source_hash, operator.target_hash = source_hash, target_hash
+    if built and operator_cache is not None:
+        with stats.phase(stats.OPERATOR_IO):
+            operator_cache.put(key, operator, kind=kind, **info)
+    if operator_file is not None:
+        with stats.phase(stats.OPERATOR_IO):
+            operator.write(operator_file)
+    return operator
+
 
-    gll_points = new[to_coordinates_path].shape[1]
-    # Prepare all the points in order to loop through it faster.
-    # Points are prepared in a way thet we find unique gll points
-    # and loop through those to save time.
-    all_new_points = new_points.reshape(
-        (new_points.shape[0]*new_points.shape[1], new_points.shape[2]))
-    unique_new_points, recon = np.unique(
-        all_new_points, return_inverse=True, axis=0)
+def gll_2_exodus_operator(gll_points, exodus_points, dimensions=3,
+                          nelem_to_search=20):
+    """
+    Compute the operator which interpolates the values of a gll model onto
+    the nodes of an exodus mesh.
+    :param gll_points: Coordinates of the gll model [nelem, ngll, dimensions]
+    :param exodus_points: Coordinates of the exodus nodes
+    :param dimensions: Spatial dimension of the meshes
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
+    :return: InterpolationOperator
+    """
+    exodus_points = np.ascontiguousarray(exodus_points[:, :dimensions],
+                                         dtype=np.float64)
+    with stats.phase(stats.TREE_BUILD):
+        grid = StructuredGrid.from_elements(gll_points[:, :, :dimensions])
+    if grid is not None:
+        print("The gll model is a structured grid, locating points directly")
+        with stats.phase(stats.POINT_LOCATION):
+            elements, ref_coords, _ = grid.locate(exodus_points)
+    else:
+        print("Building the element box index")
+        with stats.phase(stats.TREE_BUILD):
+            boxes = element_bounding_boxes(gll_points[:, :, :dimensions])
+            box_index = ElementBoxIndex(*boxes)
+
+        print("Querying the element box index")
+        with stats.phase(stats.CANDIDATE_QUERY):
+            candidates = box_index.query(exodus_points, fallback=0)
 
-    nearest_element_indices = np.zeros(
-        shape=[unique_new_points.shape[0], nelem_to_search], dtype=np.int)
+        print("Locating the points")
+        with stats.phase(stats.POINT_LOCATION):
+            elements, ref_coords, _ = locate_points(
+                exodus_points, candidates, gll_points, dimensions,
+                inverse=inverse_transform_batch, boxes=boxes,
+                nearest=box_index.nearest, k_max=nelem_to_search)
 
-    _, nearest_element_indices[:, :] = original_tree.query(
-        unique_new_points[:, :], k=nelem_to_search)
-    nearest_element_indices = np.floor(
-        nearest_element_indices/original_points.shape[1]).astype(int)
+    with stats.phase(stats.COEFFICIENTS):
+        coeffs = get_backend().coefficients(
+            tensor_gll.order_from_nodes(gll_points.shape[1], dimensions),
+            ref_coords)
+    with stats.phase(stats.ASSEMBLY):
+        return InterpolationOperator.from_elements(
+            elements, coeffs, source_shape=gll_points.shape[:2],
+            target_shape=(exodus_points.shape[0],))
 
-    nearest_element_indices = np.swapaxes(nearest_element_indices, 0, 1)
-    unique_new_points = np.swapaxes(unique_new_points, 0, 1)
-    coeffs = np.zeros(
-        shape=[len(parameters), original_points.shape[1], unique_new_points.shape[1]])
 
-    element = np.zeros(shape=unique_new_points.shape[1])
+def gll_2_gll_operator(original_points, new_points, nelem_to_search=20,
+                       workers=1, numbering=None):
+    """
+    Compute the operator which interpolates the values of one gll model onto
+    the points of another one. Only the distinct points of the new model
+    are located, every point of the new model refers back to them by its
+    global number.
+    :param original_points: Coordinates of the model to interpolate from,
+    [nelem, ngll, dimensions]
+    :param new_points: Coordinates of the model to interpolate to
+    :param nelem_to_search: Amount of closest elements to consider for
+    points which are not inside any element bounding box
+    :param workers: Amount of processes to locate the points with
+    :param numbering: Global numbering of the new points and the distinct
+    points as returned by global_numbering, computed if not given
+    :return: InterpolationOperator
+    """
+    dimensions = original_points.shape[2]
+    from_gll_order = tensor_gll.order_from_nodes(original_points.shape[1],
+                                                 dimensions)
+
+    # Points shared by neighbouring elements are only located once.
+    if numbering is None:
+        numbering = global_numbering(new_points)
+    recon, unique_new_points = numbering
+    print(f"Locating {unique_new_points.shape[0]} distinct points of "
+          f"{recon.shape[0]} gll points")
+
+    with stats.phase(stats.TREE_BUILD):
+        grid = StructuredGrid.from_elements(original_points)
+    if grid is not None:
+        print("The original model is a structured grid, locating points "
+              "directly")
+        with stats.phase(stats.POINT_LOCATION):
+            element, ref_coords, _ = grid.locate(unique_new_points)
+        with stats.phase(stats.COEFFICIENTS):
+            coeffs = get_backend().coefficients(from_gll_order,
+                                                ref_coords)
+        with stats.phase(stats.ASSEMBLY):
+            return InterpolationOperator.from_elements(
+                element, coeffs, source_shape=original_points.shape[:2],
+                target_shape=new_points.shape[:2], target_index=recon)
+
+    with stats.phase(stats.TREE_BUILD):
+        boxes = element_bounding_boxes(original_points)
+        box_index = ElementBoxIndex(*boxes)
+
+    # The workers get a fixed amount of nearest elements for the points
+    # outside of all the element boxes, instead of searching adaptively.
+    with stats.phase(stats.CANDIDATE_QUERY):
+        nearest_element_indices = box_index.query(
+            unique_new_points, fallback=nelem_to_search if workers > 1 else 0)
 
     print("Now we start interpolating")
-    for i in tqdm(range(unique_new_points.shape[1])):
-        element[i], ref_coord = _check_if_inside_element(
-            original_points, nearest_element_indices[:, i], unique_new_points[:, i], dimensions)
-        if np.any(np.isnan(ref_coord)):
-            print(f"REF_COORD IS NAN!!: {ref_coord}")
-
-        coeffs[0, :, i] = get_coefficients(
-            from_gll_order, from_gll_order, from_gll_order, ref_coord, dimensions)
-    k = np.isnan(element)
-    print(f"NAN DETECTED for elements: {np.where(k)}")
-    k = np.isnan(coeffs)
-    print(f"NAN DETECTED for coeffs: {np.where(k)}")
-    print(f"AMOUNT OF NANS: {np.where(k)[0].shape}")
-    for i in range(len(parameters))[1:]:
-        coeffs[i, :, :] = coeffs[0, :, :]
-    print("Interpolation done, Need to organize the results and write to file")
-    element = element.astype(int)
-
-    resample_data = original_data[element]
-    # Reorder everything to be able to save to file in correct format.
-    coeffs = np.swapaxes(coeffs, 0, 2).swapaxes(1, 2)
-    values = np.sum(resample_data[:, :, :] * coeffs[:, :, :], axis=2)[
-        recon, :].reshape((new_points.shape[0], gll_points, len(parameters))).swapaxes(1, 2)
-    k = np.isnan(values)
-    print(f"NAN DETECTED for values: {np.where(k)}")
-
-    if not gradient:
-        values[~solid_elements] = new_values[~solid_elements]
-
-        vs_index = parameters.index("VS")
-        # look at fake fluid values
-        zero_vs = np.where(values[:, vs_index, :] == 0.0)
-        print("If any fluid values accidentally went to the solid part we fix it")
-        for _i, elem in enumerate(np.unique(zero_vs[0])):
-            if solid_elements[elem]:
-                values[elem, :, :] = new_values[elem, :, :]
-
-    # This needs to be implemented as a sum not gradient.
-    # if gradient:
-    #     # Gradient implementations still need to be looked at.
-    #     existing = new[to_model_path]
-    #     values += existing
-    utils.remove_and_create_empty_dataset(new, parameters, to_model_path,
-                                          to_coordinates_path)
-
-    new[to_model_path][:, :, :] = values
+    if workers > 1:
+        with stats.phase(stats.POINT_LOCATION):
+            element, coeffs = _locate_in_parallel(
+                unique_new_points, nearest_element_indices, original_points,
+                workers)
+    else:
+        with stats.phase(stats.POINT_LOCATION):
+            element, ref_coords, _ = locate_points(
+                unique_new_points, nearest_element_indices, original_points,
+                dimensions, inverse=inverse_transform_batch, boxes=boxes,
+                nearest=box_index.nearest, k_max=nelem_to_search)
+        with stats.phase(stats.COEFFICIENTS):
+            coeffs = get_backend().coefficients(from_gll_order,
+                                                ref_coords)
+    stats.count("nan_coefficients", np.count_nonzero(np.isnan(coeffs)))
 
+    with stats.phase(stats.ASSEMBLY):
+        return InterpolationOperator.from_elements(
+            element, coeffs, source_shape=original_points.shape[:2],
+            target_shape=new_points.shape[:2], target_index=recon)
 
-def get_coefficients(a, b, c, ref_coord, dimension):
 
-    if dimension == 3:
-        if a == 4:
-            return GetInterpolationCoefficients3D_order_4(ref_coord)
-        elif a == 2:
-            return GetInterpolationCoefficients3D_order_2(ref_coord)
-    elif dimension == 2:
-        return GetInterpolationCoefficients2D(ref_coord)
+def _locate_in_parallel(points, candidates, element_nodes, workers,
+                        chunks_per_worker=4):
+    """
+    Locate points and compute their interpolation coefficients in a pool of
+    processes. The points are split into chunks which are processed in
+    parallel. The inputs are shared with the workers through memory mapped
+    files rather than pickled, and the workers write their results straight
+    into memory mapped output files so they are merged in order.
+    :param points: Points to locate [npoints, dimensions]
+    :param candidates: Candidate elements [npoints, ncandidates]
+    :param element_nodes: Coordinates of the elements [nelem, ngll,
+    dimensions]
+    :param workers: Amount of processes
+    :param chunks_per_worker: More chunks than workers balance the load
+    :return: elements [npoints] and coefficients [npoints, ngll]
+    """
+    npoints, dimensions = points.shape
+    ngll = element_nodes.shape[1]
+    lower, upper = element_bounding_boxes(element_nodes)
+
+    with tempfile.TemporaryDirectory(prefix="multi_mesh_") as tmp:
+        files = {name: os.path.join(tmp, name + ".npy") for name in
+                 ["points", "candidates", "element_nodes", "lower", "upper",
+                  "elements", "coeffs"]}
+        for name, array in [("points", points), ("candidates", candidates),
+                            ("element_nodes", element_nodes),
+                            ("lower", lower), ("upper", upper)]:
+            np.save(files[name], array)
+        np.lib.format.open_memmap(files["elements"], mode="w+",
+                                  dtype=np.int64, shape=(npoints,))
+        np.lib.format.open_memmap(files["coeffs"], mode="w+",
+                                  dtype=np.float64, shape=(npoints, ngll))
+
+        bounds = np.linspace(0, npoints, workers * chunks_per_worker + 1)
+        bounds = np.unique(bounds.astype(np.int64))
+        jobs = [(files, start, stop, dimensions)
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+        print(f"Locating {npoints} points in {len(jobs)} chunks on "
+              f"{workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            nmissing = 0
+            for chunk_missing, counters in pool.map(_locate_chunk, jobs):
+                nmissing += chunk_missing
+                stats.add_counters(counters)
+        if nmissing > 0:
+            print(f"{nmissing} points did not fit into any searched element")
+
+        elements = np.array(np.load(files["elements"], mmap_mode="r"))
+        coeffs = np.array(np.load(files["coeffs"], mmap_mode="r"))
+    return elements, coeffs
+
+
+def _locate_chunk(job):
+    """
+    Worker of _locate_in_parallel. Locates one chunk of points and writes
+    the elements and coefficients into the shared output files. Returns the
+    amount of points which were not found and the counters of the chunk.
+    """
+    files, start, stop, dimensions = job
+    element_nodes = np.load(files["element_nodes"], mmap_mode="r")
+    boxes = (np.load(files["lower"], mmap_mode="r"),
+             np.load(files["upper"], mmap_mode="r"))
+    points = np.load(files["points"], mmap_mode="r")[start:stop]
+    candidates = np.load(files["candidates"], mmap_mode="r")[start:stop]
+
+    with stats.collect() as collected:
+        elements, ref_coords, found = locate_points(
+            points, candidates, element_nodes, dimensions,
+            inverse=inverse_transform_batch, boxes=boxes)
+    order = tensor_gll.order_from_nodes(element_nodes.shape[1], dimensions)
+
+    elements_out = np.load(files["elements"], mmap_mode="r+")
+    coeffs_out = np.load(files["coeffs"], mmap_mode="r+")
+    elements_out[start:stop] = elements
+    coeffs_out[start:stop] = get_backend().coefficients(order,
+                                                        ref_coords)
+    elements_out.flush()
+    coeffs_out.flush()
+    return int(np.count_nonzero(~found)), collected.counters
+
+
+def get_coefficients(a, b, c, ref_coord, dimension):
+    """
+    Interpolation coefficients of an element of order a at a single point
+    of reference coordinates, from the current basis backend.
+    """
+    return get_backend().coefficients(
+        a, np.reshape(ref_coord, (1, dimension)))[0]
 
 
 def boundary_box_check(point, gll_points) -> bool:
@@ -354,17 +1051,32 @@ def boundary_box_check(point, gll_points) -> bool:
 
 
 def inverse_transform(point, gll_points, dimension):
+    """
+    Reference coordinates of a single point in an element, from the current
+    basis backend.
+    """
+    ref_coords, _ = get_backend().inverse_transform(
+        np.reshape(point, (1, -1))[:, :dimension],
+        np.asarray(gll_points)[np.newaxis, :, :dimension])
+    return ref_coords[0]
 
-    if dimension == 3:
-        if len(gll_points) == 125:
-            # return InverseCoordinateTransformWrapper3D_4(pnt=point, ctrlNodes=gll_points)
-            # print(f"gll_points: {gll_points.shape}")
-            return salvus_fem.hypercube.InverseCoordinateTransformWrapper(n=4, d=3, pnt=point, ctrlNodes=gll_points)
-        if len(gll_points) == 27:
-            return InverseCoordinateTransformWrapper3D_2(pnt=point, ctrlNodes=gll_points)
-    elif dimension == 2:
-        return InverseCoordinateTransformWrapper2D(pnt=point,
-                                                   ctrlNodes=gll_points)
+
+def inverse_transform_batch(points, gll_points, dimension):
+    """
+    Run the inverse coordinate transform for a stack of points, each one
+    with the control nodes of its own element. This uses the vectorized
+    Newton solver so it does not go back to Python for every point.
+
+    :param points: Points, shape [npoints, dimension]
+    :param gll_points: Control nodes, shape [npoints, nnodes, dimension]
+    :param dimension: Spatial dimension
+    :return: Reference coordinates, shape [npoints, dimension]. NaN for
+        points where the Newton iteration did not converge.
+    """
+    ref_coords, converged = get_backend().inverse_transform(
+        points[:, :dimension], gll_points[:, :, :dimension])
+    ref_coords[~converged] = np.nan
+    return ref_coords
 
 
 def _find_gll_centroids(gll_coordinates, dimensions=3):
@@ -386,45 +1098,3 @@ def _find_gll_centroids(gll_coordinates, dimensions=3):
                                   dtype=np.float64)
 
     return centroids
-
-
-def _check_if_inside_element(gll_model, nearest_elements, point, dimension):
-    """
-    A function to figure out inside which element the point to be interpolated
-    is.
-    :param gll: gll model
-    :param nearest_elements: nearest elements of the point
-    :param point: The actual point
-    :return: the Index of the element which point is inside
-    """
-    import warnings
-    point = np.asfortranarray(point, dtype=np.float64)
-    dist = np.zeros(len(nearest_elements))
-    for _i, element in enumerate(nearest_elements):
-        gll_points = gll_model[element, :, :]
-        gll_points = np.asfortranarray(gll_points)
-        inside, dist[_i] = boundary_box_check(point, gll_points)
-        if inside:
-            ref_coord = inverse_transform(point=point, gll_points=gll_points,
-                                          dimension=dimension)
-            if np.any(np.isnan(ref_coord)):
-                # print("Cought a nan ref")
-                dist[_i] = np.max(dist) + 14.0
-                continue
-
-            return element, ref_coord
-
-    warnings.warn("Could not find an element which this points fits into."
-                  " Maybe you should add some tolerance."
-                  " Will return the best searched element")
-    ind = np.where(dist == np.min(dist))[0][0]
-    # # ind = ref_coords.index(ref_coords == np.min(ref_coords))
-    element = nearest_elements[ind]
-    ref_coord = inverse_transform(point=point, gll_points=np.asfortranarray(gll_model[element, :, :],
-                                                                            dtype=np.float64),
-                                  dimension=dimension)
-    print("ended up in shit")
-    if np.any(np.isnan(ref_coord)):
-        ref_coord = np.array([0.645, -0.5, 0.0])
-
-    return element, ref_coord
@@ -0,0 +1,212 @@
+"""
+Batched point location for GLL meshes.
+
+Instead of looping over every target point and every candidate element in
+Python, the whole array of target points is processed at once. Candidates
+are rejected with array-wide bounding box tests and the inverse coordinate
+transform is run in batches over all surviving (point, element) pairs.
+"""
+import warnings
+
+import numpy as np
+
+from multi_mesh.components import stats
+
+
+def element_bounding_boxes(element_nodes, padding=0.01):
+    """
+    Compute the axis aligned bounding boxes of all the elements.
+
+    :param element_nodes: Control nodes of the elements,
+        shape [nelem, nnodes, ndim]
+    :param padding: The boxes are grown by this fraction of their extent
+        in every direction, to be robust to round-off and curved faces.
+    :return: Lower and upper corners of the boxes, each [nelem, ndim]
+    """
+    lower = element_nodes.min(axis=1)
+    upper = element_nodes.max(axis=1)
+    pad = padding * (upper - lower)
+    return lower - pad, upper + pad
+
+
+def locate_points(points, candidates, element_nodes, dimension, inverse,
+                  tolerance=1e-2, chunk_size=100000, boxes=None,
+                  nearest=None, k_start=4, k_max=20):
+    """
+    Find the enclosing element and the reference coordinates of a whole
+    array of points.
+
+    The candidates of each point are tested in the order given, which for
+    the nearest elements means nearest first. A point is located in the
+    first candidate whose bounding box contains it and whose reference
+    coordinates are within [-1 - tolerance, 1 + tolerance].
+
+    If nearest is given, the points which do not fit into any of their
+    candidates are searched adaptively: the k_start nearest elements are
+    tested, then twice as many and so on up to k_max, every round only for
+    the points which are still missing and only testing the elements which
+    are new in that round. Candidates can then also be None, to search
+    adaptively from the start.
+
+    Points which do not fit into any element get the tested element with
+    the smallest reference coordinate error, or the first candidate if none
+    could be tested, with the reference coordinates clipped to the element.
+
+    :param points: Points to locate, shape [npoints, dimension]
+    :param candidates: Candidate element indices, [npoints, ncandidates].
+        Negative entries are ignored.
+    :param element_nodes: Control nodes of the elements,
+        shape [nelem, nnodes, dimension]
+    :param dimension: Spatial dimension of the mesh
+    :param inverse: Batched inverse coordinate transform. Called with
+        points [n, dimension], control nodes [n, nnodes, dimension] and the
+        dimension, returns reference coordinates [n, dimension]
+    :param tolerance: How far outside the reference element a point
+        may be and still count as inside
+    :param chunk_size: Number of points to process at a time, bounds the
+        memory used by the bounding box tests
+    :param boxes: Precomputed output of element_bounding_boxes
+    :param nearest: Function returning the k nearest elements of points,
+        called as nearest(points, k) and returning [npoints, k], e.g.
+        ElementBoxIndex.nearest
+    :param k_start: Amount of nearest elements of the first adaptive round
+    :param k_max: Largest amount of nearest elements to search
+    :return: elements [npoints], reference coordinates [npoints, dimension]
+        and a boolean mask of the points which were found inside an element
+    """
+    points = np.asarray(points, dtype=np.float64)[:, :dimension]
+    if candidates is None:
+        if nearest is None:
+            raise ValueError("Either candidates or nearest are needed")
+        candidates = np.full((points.shape[0], 0), -1, dtype=np.int64)
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if candidates.ndim == 1:
+        candidates = candidates[:, np.newaxis]
+    if boxes is None:
+        boxes = element_bounding_boxes(element_nodes[:, :, :dimension])
+
+    npoints = points.shape[0]
+    elements = np.zeros(npoints, dtype=np.int64)
+    ref_coords = np.zeros((npoints, dimension))
+    found = np.zeros(npoints, dtype=bool)
+
+    for start in range(0, npoints, chunk_size):
+        stop = min(start + chunk_size, npoints)
+        pnts = points[start:stop]
+        cands = candidates[start:stop]
+
+        n = stop - start
+        state = {"element": elements[start:stop],
+                 "ref": ref_coords[start:stop],
+                 "unresolved": np.ones(n, dtype=bool),
+                 "best_error": np.full(n, np.inf),
+                 "best_element": np.full(n, -1, dtype=np.int64),
+                 "best_ref": np.zeros((n, dimension))}
+        _test_candidates(pnts, np.arange(n), cands, element_nodes,
+                         dimension, inverse, tolerance, boxes, state)
+        # The first candidate of every point, used if nothing fits
+        valid = cands >= 0
+        first = np.full(n, -1, dtype=np.int64)
+        has_valid = np.any(valid, axis=1)
+        first[has_valid] = cands[has_valid, np.argmax(valid[has_valid],
+                                                      axis=1)]
+
+        k_tested = 0
+        k = k_start
+        while nearest is not None and k_tested < k_max:
+            missing = np.where(state["unresolved"])[0]
+            if missing.size == 0:
+                break
+            if k_tested == 0:
+                stats.count("fallback_points", missing.size)
+            k = min(k, k_max)
+            new = np.asarray(nearest(pnts[missing], k),
+                             dtype=np.int64).reshape(missing.size, -1)
+            _test_candidates(pnts, missing, new[:, k_tested:],
+                             element_nodes, dimension, inverse, tolerance,
+                             boxes, state)
+            no_first = first[missing] < 0
+            first[missing[no_first]] = new[no_first, 0]
+            k_tested = k
+            k *= 2
+
+        unresolved = state["unresolved"]
+        found[start:stop] = ~unresolved
+        missing = np.where(unresolved)[0]
+        if missing.size == 0:
+            continue
+
+        best_element = state["best_element"]
+        best_ref = state["best_ref"]
+        untested = missing[best_element[missing] < 0]
+        if untested.size > 0:
+            elems = first[untested]
+            if np.any(elems < 0):
+                raise ValueError("Some points have no candidate elements")
+            ref = np.asarray(inverse(pnts[untested],
+                                     element_nodes[elems, :, :dimension],
+                                     dimension), dtype=np.float64)
+            best_element[untested] = elems
+            best_ref[untested] = np.nan_to_num(ref)
+
+        elements[start + missing] = best_element[missing]
+        ref_coords[start + missing] = np.clip(best_ref[missing], -1.0, 1.0)
+
+    nmissing = npoints - np.count_nonzero(found)
+    stats.count("points_located", npoints)
+    stats.count("points_not_found", nmissing)
+    if nmissing > 0:
+        warnings.warn(f"Could not find an element which {nmissing} points "
+                      f"fit into. Maybe you should add some tolerance or "
+                      f"search more elements. Will use the best searched "
+                      f"elements for those points.")
+
+    return elements, ref_coords, found
+
+
+def _test_candidates(points, rows, candidates, element_nodes, dimension,
+                     inverse, tolerance, boxes, state):
+    """
+    Test candidate elements of some of the points of a chunk, rank by rank,
+    skipping points which are resolved already. The results are written
+    into state, a dictionary of the per point arrays of locate_points.
+
+    :param points: Points of the chunk
+    :param rows: Rows of the points the candidates belong to
+    :param candidates: Candidates of those points, [nrows, ncandidates]
+    """
+    lower, upper = boxes
+    pnts = points[rows]
+    valid = candidates >= 0
+    safe_cands = np.where(valid, candidates, 0)
+    inside = valid & np.all(
+        (pnts[:, np.newaxis, :] >= lower[safe_cands]) &
+        (pnts[:, np.newaxis, :] <= upper[safe_cands]), axis=2)
+    stats.count("candidates_tested", np.count_nonzero(valid))
+
+    for j in range(candidates.shape[1]):
+        sel = np.where(state["unresolved"][rows] & inside[:, j])[0]
+        if sel.size == 0:
+            continue
+        elems = candidates[sel, j]
+        ref = np.asarray(inverse(pnts[sel],
+                                 element_nodes[elems, :, :dimension],
+                                 dimension), dtype=np.float64)
+        stats.count("inverse_transform_calls")
+        stats.count("inverse_transform_points", sel.size)
+        error = np.max(np.abs(ref), axis=1)
+        nan = np.isnan(error)
+        stats.count("nan_reference_coordinates", np.count_nonzero(nan))
+        error[nan] = np.inf
+        hit = error <= 1.0 + tolerance
+
+        idx = rows[sel[hit]]
+        state["element"][idx] = elems[hit]
+        state["ref"][idx] = ref[hit]
+        state["unresolved"][idx] = False
+
+        better = ~hit & (error < state["best_error"][rows[sel]])
+        idx = rows[sel[better]]
+        state["best_error"][idx] = error[better]
+        state["best_element"][idx] = elems[better]
+        state["best_ref"][idx] = ref[better]
@@ -0,0 +1,142 @@
+"""
+Global numbering of the GLL points of a mesh.
+
+Neighbouring elements share the GLL points on their faces, edges and
+corners, so on an order 4 mesh only about half of the points are distinct.
+Interpolating onto the distinct points only and scattering the results
+back by index halves the work. Shared points do not always have bitwise
+identical coordinates, so they are matched with a tolerance.
+
+The numbering only depends on the coordinates, so it is computed once and
+stored in the gll file next to the model.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.spatial import cKDTree
+
+from multi_mesh.components import cache, stats
+
+NUMBERING_PATH = "MULTI_MESH/global_numbering"
+
+
+def default_tolerance(coordinates):
+    """
+    A tolerance far below the distance of the GLL points of an element but
+    far above round-off: a millionth of the median element size.
+
+    :param coordinates: GLL point coordinates [nelem, ngll, dimension]
+    """
+    sample = coordinates[::max(1, coordinates.shape[0] // 10000)]
+    size = np.max(sample.max(axis=1) - sample.min(axis=1), axis=1)
+    return 1e-6 * float(np.median(size))
+
+
+@stats.phase(stats.NUMBERING)
+def global_numbering(coordinates, tolerance=None):
+    """
+    Number the distinct GLL points of a mesh. Points closer than the
+    tolerance in every coordinate get the same number.
+
+    The points are hashed into a grid with cells much bigger than the
+    tolerance, points in the same cell are the same point. Only points
+    which are within the tolerance of a cell boundary can have a twin in
+    the neighbouring cell, those few are matched with a KDTree.
+
+    :param coordinates: GLL point coordinates [nelem, ngll, dimension]
+    :param tolerance: Absolute tolerance, see default_tolerance if None
+    :return: Number of every point [nelem * ngll] and the coordinates of
+        the distinct points [nunique, dimension]
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    if tolerance is None:
+        tolerance = default_tolerance(coordinates)
+    points = coordinates.reshape(-1, coordinates.shape[-1])
+    npoints = points.shape[0]
+
+    cell_size = 64.0 * tolerance
+    origin = points.min(axis=0)
+    scaled = (points - origin) / cell_size
+    cells = np.floor(scaled).astype(np.int64)
+    shape = cells.max(axis=0) + 1
+    if np.prod(shape.astype(np.float64)) < 2.0 ** 62:
+        keys = np.ravel_multi_index(cells.T, tuple(shape))
+        _, cell_number = np.unique(keys, return_inverse=True)
+    else:
+        _, cell_number = np.unique(cells, axis=0, return_inverse=True)
+    cell_number = cell_number.ravel()
+    del cells
+
+    # Twins in different cells are both within the tolerance of the cell
+    # boundary between them.
+    fraction = scaled - np.floor(scaled)
+    limit = tolerance / cell_size
+    border = np.where(np.any((fraction < limit) | (fraction > 1.0 - limit),
+                             axis=1))[0]
+    del scaled, fraction
+    if border.size == 0:
+        number = cell_number
+    else:
+        pairs = cKDTree(points[border]).query_pairs(
+            tolerance, p=np.inf, output_type="ndarray")
+        ncells = int(cell_number.max()) + 1
+        # Join the cells of the matched points.
+        rows = cell_number[border[pairs[:, 0]]]
+        cols = cell_number[border[pairs[:, 1]]]
+        graph = sparse.coo_matrix(
+            (np.ones(rows.size, dtype=np.int8), (rows, cols)),
+            shape=(ncells, ncells))
+        _, joined = csgraph.connected_components(graph, directed=False)
+        number = joined[cell_number]
+
+    nunique = int(number.max()) + 1 if npoints > 0 else 0
+    unique_points = np.empty((nunique, points.shape[1]))
+    unique_points[number] = points
+    return number.astype(np.int64), unique_points
+
+
+def cached_global_numbering(gll, coordinates_path="MODEL/coordinates",
+                            tolerance=None):
+    """
+    The global numbering of a gll file. It is read from the file if it was
+    stored for the same coordinates and tolerance before, otherwise it is
+    computed and stored if the file is writable.
+
+    :param gll: An open h5py file
+    :param coordinates_path: Location of the coordinates in the file
+    :param tolerance: Absolute tolerance, see default_tolerance if None
+    :return: Number of every point [nelem * ngll] and the coordinates of
+        the distinct points [nunique, dimension]
+    """
+    coordinates = np.asarray(gll[coordinates_path][:], dtype=np.float64)
+    coordinates_hash = cache.hash_array(coordinates).hexdigest()
+
+    if NUMBERING_PATH in gll:
+        stored = gll[NUMBERING_PATH]
+        if stored.attrs.get("coordinates_hash") == coordinates_hash and \
+                stored.attrs.get("coordinates_path") == coordinates_path \
+                and (tolerance is None or
+                     stored.attrs.get("tolerance") == tolerance):
+            print("Using the stored global numbering of the gll points")
+            number = stored[:].astype(np.int64)
+            points = coordinates.reshape(-1, coordinates.shape[-1])
+            unique_points = np.empty((int(number.max()) + 1,
+                                      points.shape[1]))
+            unique_points[number] = points
+            return number, unique_points
+
+    print("Computing the global numbering of the gll points")
+    if tolerance is None:
+        tolerance = default_tolerance(coordinates)
+    number, unique_points = global_numbering(coordinates, tolerance)
+
+    if gll.mode == "r+":
+        if NUMBERING_PATH in gll:
+            del gll[NUMBERING_PATH]
+        dtype = np.int32 if unique_points.shape[0] < 2 ** 31 else np.int64
+        stored = gll.create_dataset(NUMBERING_PATH,
+                                    data=number.astype(dtype))
+        stored.attrs["coordinates_hash"] = coordinates_hash
+        stored.attrs["coordinates_path"] = coordinates_path
+        stored.attrs["tolerance"] = tolerance
+    return number, unique_points
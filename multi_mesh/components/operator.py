@@ -0,0 +1,303 @@
+"""
+Interpolation operators which can be computed once, saved, and applied to
+any field living on the same pair of meshes.
+
+Every interpolation in this package ends up as a weighted sum of source
+values for every target point. The weights only depend on the geometry of
+the two meshes, so they are stored as a sparse matrix. Applying the
+operator to a new model or gradient is then a single sparse matrix product.
+"""
+import os
+import warnings
+
+import h5py
+import numpy as np
+from scipy import sparse
+
+from multi_mesh.components import stats
+
+
+class InterpolationOperator(object):
+    """
+    A sparse linear map from the values on a source mesh to the values on
+    a target mesh.
+
+    Meshes are described by their shape. A gll mesh has the shape
+    (nelem, ngll) and its values are stored as [nelem, nparams, ngll], a
+    nodal (exodus) mesh has the shape (nnodes,) and its values are stored
+    as [nparams, nnodes].
+    """
+    def __init__(self, matrix, source_shape, target_shape,
+                 target_index=None, source_hash=None, target_hash=None):
+        """
+        :param matrix: Sparse matrix with one row per interpolated point and
+            one column per source value
+        :param source_shape: Shape of the source mesh
+        :param target_shape: Shape of the target mesh
+        :param target_index: Optional row of the matrix for every target
+            point, used when several target points share a location
+        :param source_hash: Geometry hash of the source mesh, see
+            multi_mesh.components.cache, stored with the operator to check
+            it is applied to the meshes it was computed for
+        :param target_hash: Geometry hash of the target mesh
+        """
+        self.matrix = sparse.csr_matrix(matrix)
+        self.source_shape = tuple(int(i) for i in source_shape)
+        self.target_shape = tuple(int(i) for i in target_shape)
+        self.target_index = None if target_index is None else \
+            np.asarray(target_index, dtype=np.int64).ravel()
+        self.source_hash = source_hash
+        self.target_hash = target_hash
+
+        if self.matrix.shape[1] != np.prod(self.source_shape):
+            raise ValueError("The operator does not match the source shape")
+        ntarget = self.matrix.shape[0] if self.target_index is None else \
+            self.target_index.shape[0]
+        if ntarget != np.prod(self.target_shape):
+            raise ValueError("The operator does not match the target shape")
+        self._matrices = {}
+
+    @classmethod
+    def from_stencils(cls, columns, weights, source_shape, target_shape,
+                      target_index=None):
+        """
+        Build an operator where every row has the same amount of entries.
+
+        :param columns: Source value indices, shape [nrows, nstencil]
+        :param weights: Weights of those values, shape [nrows, nstencil]
+        :param source_shape: Shape of the source mesh
+        :param target_shape: Shape of the target mesh
+        :param target_index: Optional row for every target point
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        nrows, nstencil = columns.shape
+        indptr = np.arange(0, nrows * nstencil + 1, nstencil, dtype=np.int64)
+        matrix = sparse.csr_matrix(
+            (np.asarray(weights, dtype=np.float64).ravel(), columns.ravel(),
+             indptr), shape=(nrows, int(np.prod(source_shape))))
+        return cls(matrix, source_shape, target_shape, target_index)
+
+    @classmethod
+    def from_elements(cls, elements, coeffs, source_shape, target_shape,
+                      target_index=None):
+        """
+        Build an operator from located points in a gll source mesh.
+
+        :param elements: Enclosing source element of every row, [nrows]
+        :param coeffs: Interpolation coefficients, shape [nrows, ngll]
+        :param source_shape: Shape of the source gll mesh (nelem, ngll)
+        :param target_shape: Shape of the target mesh
+        :param target_index: Optional row for every target point
+        """
+        ngll = source_shape[1]
+        columns = np.asarray(elements, dtype=np.int64)[:, np.newaxis] * \
+            ngll + np.arange(ngll)
+        return cls.from_stencils(columns, coeffs, source_shape, target_shape,
+                                 target_index)
+
+    def apply(self, values, dtype=None):
+        """
+        Interpolate values from the source mesh onto the target mesh.
+
+        :param values: Source values, [nelem, nparams, ngll] for a gll
+            source and [nparams, nnodes] or [nnodes] for a nodal source
+        :param dtype: Compute and return the values in this dtype, e.g.
+            np.float32 to halve the memory. The weights are rounded to it as
+            well. Double precision if None.
+        :return: Target values in the layout of the target mesh
+        """
+        single = np.asarray(values).ndim == 1
+        with stats.phase(stats.GATHER):
+            source = self._source_values(values, dtype)
+            result = self._matrix(dtype) @ source
+            if self.target_index is not None:
+                result = result[self.target_index]
+
+        if len(self.target_shape) == 2:
+            return result.reshape(self.target_shape + (-1,)).transpose(
+                0, 2, 1)
+        return result[:, 0] if single else result.T
+
+    def apply_blocks(self, values, block_size, dtype=None, elements=None):
+        """
+        Interpolate values onto a gll target mesh one block of elements at a
+        time, so the result can be written to file in large contiguous
+        pieces without holding all of it in memory.
+
+        :param values: Source values, see apply
+        :param block_size: Amount of target elements in a block
+        :param dtype: Compute the values in this dtype, see apply
+        :param elements: Only interpolate onto these target elements, a
+            boolean mask or indices. The blocks are then the contiguous runs
+            of them, split to block_size.
+        :return: Generator of (start, stop, block), block being the values
+            of the target elements start:stop, [nelements, nparams, ngll]
+        """
+        if len(self.target_shape) != 2:
+            raise ValueError("Blocks are only supported for gll targets")
+        source = self._source_values(values, dtype)
+        matrix = self._matrix(dtype)
+        nelem, ngll = self.target_shape
+        for start, stop in _blocks(nelem, block_size, elements):
+            with stats.phase(stats.GATHER):
+                rows = np.arange(start * ngll, stop * ngll)
+                if self.target_index is not None:
+                    rows = self.target_index[rows]
+                block = matrix[rows] @ source
+            yield start, stop, block.reshape(stop - start, ngll,
+                                             -1).transpose(0, 2, 1)
+
+    def changed_targets(self, changed):
+        """
+        Find the target elements or nodes whose interpolated values depend
+        on changed source values, only those change when the operator is
+        applied to the new source values.
+
+        :param changed: Boolean mask of the changed source elements (gll
+            source) or nodes (nodal source)
+        :return: Boolean mask of the target elements (gll target) or nodes
+            (nodal target) which are affected
+        """
+        changed = np.asarray(changed, dtype=bool)
+        if changed.shape != self.source_shape[:1]:
+            raise ValueError("The mask does not match the source mesh")
+        if len(self.source_shape) == 2:
+            changed = np.repeat(changed, self.source_shape[1])
+        # Any stored weight counts, even one which happens to be zero.
+        pattern = sparse.csr_matrix(
+            (np.ones(self.matrix.nnz, dtype=np.int32), self.matrix.indices,
+             self.matrix.indptr), shape=self.matrix.shape)
+        affected = pattern @ changed.astype(np.int32) > 0
+        if self.target_index is not None:
+            affected = affected[self.target_index]
+        if len(self.target_shape) == 2:
+            return affected.reshape(self.target_shape).any(axis=1)
+        return affected
+
+    def _matrix(self, dtype=None):
+        """
+        The matrix with its weights in dtype, the cast is kept for the next
+        application.
+        """
+        dtype = np.dtype(np.float64 if dtype is None else dtype)
+        if dtype == self.matrix.dtype:
+            return self.matrix
+        if dtype not in self._matrices:
+            self._matrices[dtype] = self.matrix.astype(dtype)
+        return self._matrices[dtype]
+
+    def _source_values(self, values, dtype=None):
+        """
+        Arrange source values as a matrix with one row per source value and
+        one column per parameter.
+        """
+        values = np.asarray(values, dtype=np.float64 if dtype is None else
+                            dtype)
+        if len(self.source_shape) == 2:
+            return values.transpose(0, 2, 1).reshape(-1, values.shape[1])
+        return np.atleast_2d(values).T
+
+    def write(self, filename):
+        """
+        Save the operator. Files ending in .npz are written with numpy,
+        everything else as HDF5.
+
+        :param filename: Where to save the operator
+        """
+        arrays = {
+            "data": self.matrix.data,
+            "indices": self.matrix.indices,
+            "indptr": self.matrix.indptr,
+            "matrix_shape": np.array(self.matrix.shape, dtype=np.int64),
+            "source_shape": np.array(self.source_shape, dtype=np.int64),
+            "target_shape": np.array(self.target_shape, dtype=np.int64)}
+        if self.target_index is not None:
+            arrays["target_index"] = self.target_index
+        hashes = {name: value for name, value in
+                  [("source_hash", self.source_hash),
+                   ("target_hash", self.target_hash)] if value is not None}
+
+        if filename.endswith(".npz"):
+            np.savez(filename, **arrays,
+                     **{name: np.array(value)
+                        for name, value in hashes.items()})
+            return
+        with h5py.File(filename, "w") as f:
+            for name, array in arrays.items():
+                f.create_dataset(name, data=array)
+            f.attrs.update(hashes)
+
+    @classmethod
+    def read(cls, filename):
+        """
+        Load an operator saved with write.
+
+        :param filename: The operator file
+        """
+        if filename.endswith(".npz"):
+            f = np.load(filename)
+            arrays = {name: f[name] for name in f.files}
+            hashes = {name: str(arrays.pop(name))
+                      for name in ["source_hash", "target_hash"]
+                      if name in arrays}
+        else:
+            with h5py.File(filename, "r") as f:
+                arrays = {name: f[name][:] for name in f.keys()}
+                hashes = {name: str(value) for name, value in f.attrs.items()}
+
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["matrix_shape"]))
+        return cls(matrix, arrays["source_shape"], arrays["target_shape"],
+                   arrays.get("target_index"), **hashes)
+
+
+def _blocks(nelem, block_size, elements=None):
+    """
+    Split all elements, or the contiguous runs of the selected ones, into
+    (start, stop) blocks of at most block_size elements.
+    """
+    if elements is None:
+        runs = [(0, nelem)]
+    else:
+        elements = np.asarray(elements)
+        if elements.dtype == bool:
+            elements = np.flatnonzero(elements)
+        elements = np.unique(elements)
+        breaks = np.flatnonzero(np.diff(elements) != 1) + 1
+        runs = [(int(run[0]), int(run[-1]) + 1)
+                for run in np.split(elements, breaks) if run.size > 0]
+    return [(start, min(start + block_size, stop))
+            for run_start, stop in runs
+            for start in range(run_start, stop, block_size)]
+
+
+def read_operator(filename, source_hash=None, target_hash=None):
+    """
+    Load an operator if the file exists. If geometry hashes are given, the
+    operator has to have been computed for the same meshes.
+
+    :param filename: The operator file, can be None
+    :param source_hash: Geometry hash of the current source mesh
+    :param target_hash: Geometry hash of the current target mesh
+    :return: The operator or None
+    """
+    if filename is None or not os.path.exists(filename):
+        return None
+    print(f"Using interpolation operator {filename}")
+    operator = InterpolationOperator.read(filename)
+    for mesh, stored, current in [("source", operator.source_hash,
+                                   source_hash),
+                                  ("target", operator.target_hash,
+                                   target_hash)]:
+        if current is None:
+            continue
+        if stored is None:
+            warnings.warn(f"The operator in {filename} does not record the "
+                          f"geometry of its {mesh} mesh, it can not be "
+                          f"checked against the current one")
+        elif stored != current:
+            raise ValueError(f"The operator in {filename} was computed for "
+                             f"a different {mesh} mesh, remove it to "
+                             f"compute a new one")
+    return operator
@@ -0,0 +1,118 @@
+"""
+The changed part of a source model, for incremental interpolation.
+
+In regional inversions only a part of the model changes from one iteration
+to the next. Only the target elements whose values depend on changed
+source elements or nodes have to be interpolated and written again, see
+InterpolationOperator.changed_targets. The changed part is given as a
+bounding box, as a mask of the source elements or nodes, or by the source
+values of the previous iteration.
+"""
+import numpy as np
+
+
+class Region(object):
+    """
+    Describes which part of a source model changed. Use one of box,
+    from_mask or from_previous.
+    """
+    def __init__(self, lower=None, upper=None, mask=None, previous=None,
+                 tolerance=0.0):
+        """
+        :param lower: Lower corner of the box which contains the changes
+        :param upper: Upper corner of the box which contains the changes
+        :param mask: Boolean mask of the changed source elements or nodes
+        :param previous: Source values before the change, or a file to
+            read them from
+        :param tolerance: Values which differ by no more than this from
+            the previous ones did not change
+        """
+        given = [lower is not None or upper is not None, mask is not None,
+                 previous is not None]
+        if sum(given) != 1:
+            raise ValueError("Give either a box, a mask or the previous "
+                             "values")
+        if given[0] and (lower is None or upper is None):
+            raise ValueError("The box needs a lower and an upper corner")
+        self.lower = None if lower is None else np.asarray(lower, dtype=float)
+        self.upper = None if upper is None else np.asarray(upper, dtype=float)
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self.previous = previous
+        self.tolerance = tolerance
+
+    @classmethod
+    def box(cls, lower, upper):
+        """
+        Everything within an axis aligned box changed.
+
+        :param lower: Lower corner [dimension]
+        :param upper: Upper corner [dimension]
+        """
+        return cls(lower=lower, upper=upper)
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        The masked source elements (gll source) or nodes (exodus source)
+        changed.
+
+        :param mask: Boolean mask [nelem] or [nnodes]
+        """
+        return cls(mask=mask)
+
+    @classmethod
+    def from_previous(cls, previous, tolerance=0.0):
+        """
+        Whatever differs from the previous source values changed.
+
+        :param previous: Previous source values in the layout of the
+            current ones, or the path of the previous source model
+        :param tolerance: Largest difference which is not a change
+        """
+        return cls(previous=previous, tolerance=tolerance)
+
+    def changed(self, points, values, read_previous=None):
+        """
+        The changed source elements or nodes.
+
+        :param points: Source coordinates, [nelem, ngll, dimension] for a
+            gll source and [nnodes, dimension] for a nodal source
+        :param values: Current source values, [nelem, nparams, ngll] for a
+            gll source and [nparams, nnodes] for a nodal source
+        :param read_previous: Reads the previous values from a file, needed
+            if previous is a path
+        :return: Boolean mask [nelem] or [nnodes]
+        """
+        gll = np.ndim(points) == 3
+        nsource = points.shape[0]
+        if self.mask is not None:
+            if self.mask.shape != (nsource,):
+                raise ValueError(f"The mask has {self.mask.size} entries "
+                                 f"but the source has {nsource}")
+            return self.mask
+
+        if self.lower is not None:
+            dimension = points.shape[-1]
+            lower, upper = self.lower[:dimension], self.upper[:dimension]
+            if gll:
+                # Elements whose bounding box overlaps the region
+                return np.all((points.min(axis=1) <= upper) &
+                              (points.max(axis=1) >= lower), axis=1)
+            return np.all((points >= lower) & (points <= upper), axis=1)
+
+        previous = self.previous
+        if isinstance(previous, str):
+            if read_previous is None:
+                raise ValueError("Can not read the previous values")
+            previous = read_previous(previous)
+        previous = np.asarray(previous)
+        values = np.asarray(values)
+        if previous.shape != values.shape:
+            raise ValueError(f"The previous values have the shape "
+                             f"{previous.shape} but the current ones "
+                             f"{values.shape}")
+        difference = np.abs(values - previous) > self.tolerance
+        difference |= np.isnan(values) != np.isnan(previous)
+        if gll:
+            return difference.any(axis=(1, 2))
+        return difference.any(axis=0)
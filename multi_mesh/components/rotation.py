@@ -0,0 +1,192 @@
+"""
+Rotation of the coordinates of meshes, in place.
+
+Source centred workflows rotate every mesh so the event sits below the North
+Pole and rotate the results back afterwards. The coordinates are rotated in
+chunks, one matrix product per chunk, so the memory use does not depend on
+the size of the mesh. Several rotations can be composed into one matrix and
+applied in a single pass:
+
+    matrix = rotation.compose(rotation.event_rotation(event_1, True),
+                              rotation.event_rotation(event_2))
+    rotation.rotate_mesh("mesh.e", matrix)
+
+Exodus files are netCDF4 and therefore HDF5 files, their coordinates are
+read and written directly with h5py. Older netCDF3 exodus files are read
+whole through pyexodus.
+"""
+import h5py
+import numpy as np
+
+from multi_mesh.components import stats
+
+EXODUS_COORDINATES = ("coordx", "coordy", "coordz")
+
+
+def rotation_matrix(angle, axis):
+    """
+    Matrix of a right handed rotation around an axis.
+
+    :param angle: Rotation angle in radians
+    :param axis: Rotation axis [3], does not need to be normalized
+    :return: Rotation matrix [3, 3]
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    cross = np.array([[0.0, -axis[2], axis[1]],
+                      [axis[2], 0.0, -axis[0]],
+                      [-axis[1], axis[0], 0.0]])
+    return (np.cos(angle) * np.eye(3) + np.sin(angle) * cross +
+            (1.0 - np.cos(angle)) * np.outer(axis, axis))
+
+
+def event_rotation(event_loc, backwards=False):
+    """
+    The rotation which moves an event below the North Pole.
+
+    :param event_loc: Location of the event [lat, lon] in radians
+    :param backwards: Rotate the North Pole back to the event instead
+    :return: Rotation matrix [3, 3]
+    """
+    event_vec = np.array([np.cos(event_loc[0]) * np.cos(event_loc[1]),
+                          np.cos(event_loc[0]) * np.sin(event_loc[1]),
+                          np.sin(event_loc[0])])
+    event_vec /= np.linalg.norm(event_vec)
+    north_vec = np.array([0.0, 0.0, 1.0])
+
+    rotate_axis = np.cross(event_vec, north_vec)
+    if np.linalg.norm(rotate_axis) == 0.0:
+        # The event is at one of the poles already
+        matrix = np.eye(3) if event_vec[2] > 0 else \
+            rotation_matrix(np.pi, [1.0, 0.0, 0.0])
+    else:
+        rot_angle = np.arccos(np.clip(np.dot(event_vec, north_vec), -1, 1))
+        matrix = rotation_matrix(rot_angle, rotate_axis)
+    return matrix.T if backwards else matrix
+
+
+def compose(*matrices):
+    """
+    Compose rotations into one matrix.
+
+    :param matrices: Rotation matrices in the order they are applied
+    :return: Rotation matrix [3, 3] which applies all of them at once
+    """
+    composed = np.eye(3)
+    for matrix in matrices:
+        composed = np.asarray(matrix, dtype=np.float64) @ composed
+    return composed
+
+
+def rotate_points(points, matrix, out=None):
+    """
+    Rotate points.
+
+    :param points: Points [..., 3]
+    :param matrix: Rotation matrix [3, 3]
+    :param out: Where to write the result, may be points itself
+    :return: Rotated points [..., 3]
+    """
+    points = np.asarray(points)
+    shape = points.shape
+    rotated = points.reshape(-1, 3) @ np.asarray(matrix).T
+    if out is None:
+        return rotated.reshape(shape)
+    out[...] = rotated.reshape(shape)
+    return out
+
+
+def rotate_gll(gll_model, matrix, coordinates="MODEL/coordinates",
+               chunk_size=10000):
+    """
+    Rotate the coordinates of a gll model in place.
+
+    :param gll_model: Path of the gll model
+    :param matrix: Rotation matrix [3, 3]
+    :param coordinates: Path of the coordinates in the file
+    :param chunk_size: Elements rotated at once
+    """
+    with h5py.File(gll_model, "r+") as f:
+        dataset = f[coordinates]
+        if dataset.shape[-1] != 3:
+            raise ValueError(f"Can only rotate 3D meshes, {gll_model} has "
+                             f"{dataset.shape[-1]} dimensions")
+        for start in range(0, dataset.shape[0], chunk_size):
+            chunk = slice(start, min(start + chunk_size, dataset.shape[0]))
+            with stats.phase(stats.READ):
+                points = dataset[chunk]
+            rotate_points(points, matrix, out=points)
+            with stats.phase(stats.WRITE):
+                dataset[chunk] = points
+        stats.count("points_rotated", np.prod(dataset.shape[:-1]))
+
+
+def rotate_exodus(mesh, matrix, chunk_size=1000000):
+    """
+    Rotate the node coordinates of an exodus mesh in place.
+
+    :param mesh: Path of the exodus file
+    :param matrix: Rotation matrix [3, 3]
+    :param chunk_size: Nodes rotated at once
+    """
+    if not h5py.is_hdf5(mesh):
+        _rotate_exodus_whole(mesh, matrix)
+        return
+    with h5py.File(mesh, "r+") as f:
+        if not all(name in f for name in EXODUS_COORDINATES):
+            raise ValueError(f"Can only rotate 3D meshes, {mesh} has no "
+                             f"z coordinates")
+        datasets = [f[name] for name in EXODUS_COORDINATES]
+        nnodes = datasets[0].shape[0]
+        points = np.empty((3, min(chunk_size, nnodes)))
+        for start in range(0, nnodes, chunk_size):
+            chunk = slice(start, min(start + chunk_size, nnodes))
+            block = points[:, :chunk.stop - chunk.start]
+            with stats.phase(stats.READ):
+                for i, dataset in enumerate(datasets):
+                    block[i] = dataset[chunk]
+            block[...] = np.asarray(matrix) @ block
+            with stats.phase(stats.WRITE):
+                for i, dataset in enumerate(datasets):
+                    dataset[chunk] = block[i]
+        stats.count("points_rotated", nnodes)
+
+
+def _rotate_exodus_whole(mesh, matrix):
+    """
+    Rotate an exodus file h5py can not open through pyexodus.
+    """
+    from pyexodus import exodus
+
+    e = exodus(mesh, mode="a")
+    try:
+        points = np.stack(e.get_coords(), axis=1)
+        rotate_points(points, matrix, out=points)
+        e.put_coords(points[:, 0], points[:, 1], points[:, 2])
+    finally:
+        e.close()
+    stats.count("points_rotated", points.shape[0])
+
+
+def rotate_mesh(mesh, matrix, coordinates="MODEL/coordinates",
+                chunk_size=None):
+    """
+    Rotate the coordinates of an exodus mesh or a gll model in place. A file
+    with the coordinates dataset is a gll model, anything else is treated
+    as exodus.
+
+    :param mesh: Path of the mesh
+    :param matrix: Rotation matrix [3, 3], see compose for several rotations
+    :param coordinates: Path of the coordinates in a gll model
+    :param chunk_size: Elements (gll) or nodes (exodus) rotated at once,
+        the defaults keep the chunks at a few tens of megabytes
+    """
+    gll = False
+    if h5py.is_hdf5(mesh):
+        with h5py.File(mesh, "r") as f:
+            gll = coordinates in f
+    kwargs = {} if chunk_size is None else {"chunk_size": chunk_size}
+    if gll:
+        rotate_gll(mesh, matrix, coordinates=coordinates, **kwargs)
+    else:
+        rotate_exodus(mesh, matrix, **kwargs)
@@ -0,0 +1,190 @@
+"""
+Timing of the phases of an interpolation and counters of the work done.
+
+The interpolation functions record the time spent in named phases, like
+reading the meshes, building the element index, locating the points or
+writing the results, and count things like the tested candidate elements or
+the Newton iterations of the inverse coordinate transform. Nothing is
+recorded unless a collection is active:
+
+    with stats.collect() as collected:
+        interpolator.gll_2_gll(...)
+    print(collected.report())
+
+Collections can be nested, an inner collection is added to the outer one
+when it ends. Phases can be nested as well, their times are inclusive.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+# Phase names used throughout the package
+READ = "read"
+NUMBERING = "numbering"
+TREE_BUILD = "tree_build"
+CANDIDATE_QUERY = "candidate_query"
+POINT_LOCATION = "point_location"
+COEFFICIENTS = "coefficients"
+ASSEMBLY = "assembly"
+OPERATOR_IO = "operator_io"
+GATHER = "gather"
+WRITE = "write"
+
+
+class Stats(object):
+    """
+    Seconds and calls per phase, counters and the total wall time of an
+    interpolation.
+    """
+    def __init__(self):
+        self.total = 0.0
+        self.phases = {}
+        self.calls = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds, calls=1):
+        """
+        Add time to a phase.
+
+        :param name: Name of the phase
+        :param seconds: Time spent in it
+        :param calls: Amount of times the phase was entered
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter.
+
+        :param name: Name of the counter
+        :param amount: How much to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def merge(self, other):
+        """
+        Add the phases and counters of other stats to these ones, the total
+        time is left alone.
+
+        :param other: Stats or their dictionary from to_dict
+        """
+        if isinstance(other, dict):
+            other = Stats.from_dict(other)
+        for name, seconds in other.phases.items():
+            self.add_time(name, seconds, other.calls.get(name, 0))
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+
+    def to_dict(self):
+        return {"total": self.total,
+                "phases": {name: {"seconds": seconds,
+                                  "calls": self.calls.get(name, 0)}
+                           for name, seconds in self.phases.items()},
+                "counters": dict(self.counters)}
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        stats = cls()
+        stats.total = dictionary.get("total", 0.0)
+        for name, phase in dictionary.get("phases", {}).items():
+            stats.add_time(name, phase["seconds"], phase["calls"])
+        for name, amount in dictionary.get("counters", {}).items():
+            stats.count(name, amount)
+        return stats
+
+    def write_json(self, filename):
+        """
+        Write the stats to a JSON file.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def report(self):
+        """
+        The stats as a human readable table.
+        """
+        lines = [f"Total time: {self.total:.3f} s"]
+        if self.phases:
+            lines.append(f"{'phase':<20} {'seconds':>10} {'share':>7} "
+                         f"{'calls':>8}")
+            for name, seconds in sorted(self.phases.items(),
+                                        key=lambda item: -item[1]):
+                share = 100.0 * seconds / self.total if self.total else 0.0
+                lines.append(f"{name:<20} {seconds:>10.3f} {share:>6.1f}% "
+                             f"{self.calls[name]:>8}")
+        if self.counters:
+            lines.append(f"{'counter':<30} {'value':>12}")
+            for name, amount in sorted(self.counters.items()):
+                lines.append(f"{name:<30} {amount:>12}")
+        return "\n".join(lines)
+
+
+_active = []
+
+
+@contextmanager
+def collect(stats=None):
+    """
+    Record phases and counters into stats while the context is active.
+
+    :param stats: Stats to record into, new ones if None
+    :return: The stats, their total is the time the context was active
+    """
+    stats = Stats() if stats is None else stats
+    _active.append(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.total += time.perf_counter() - start
+        _active.pop()
+        if _active:
+            _active[-1].merge(stats)
+
+
+def active():
+    """
+    The stats which are recorded into at the moment, None if none are.
+    """
+    return _active[-1] if _active else None
+
+
+@contextmanager
+def phase(name):
+    """
+    Time the code in the context as a phase of the active stats.
+
+    :param name: Name of the phase
+    """
+    if not _active:
+        yield
+        return
+    stats = _active[-1]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+
+def count(name, amount=1):
+    """
+    Add to a counter of the active stats.
+
+    :param name: Name of the counter
+    :param amount: How much to add
+    """
+    if _active:
+        _active[-1].count(name, amount)
+
+
+def add_counters(counters):
+    """
+    Add counters recorded elsewhere, e.g. in a worker process, to the
+    active stats.
+
+    :param counters: Dictionary of counter names and amounts
+    """
+    for name, amount in counters.items():
+        count(name, amount)
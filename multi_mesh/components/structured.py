@@ -0,0 +1,259 @@
+"""
+Point location in axis aligned structured meshes.
+
+The Cartesian meshes used for smoothing gradients consist of box shaped
+elements on a tensor product grid. There the element of a point and its
+reference coordinates follow from the grid lines along every axis with a
+little arithmetic, so neither an element index nor the iterative inverse
+coordinate transform is needed.
+"""
+import warnings
+
+import numpy as np
+
+from multi_mesh.components import tensor_gll
+from multi_mesh.components.locator import element_bounding_boxes
+
+
+class StructuredGrid(object):
+    """
+    The elements of a mesh whose elements are the cells of an axis aligned
+    tensor product grid, possibly with a different spacing in every cell.
+    """
+    def __init__(self, edges, cell_elements, connectivity=None, sides=None,
+                 tolerance=0.0):
+        """
+        Use from_connectivity or from_elements, they check whether a mesh
+        actually is a structured grid.
+
+        :param edges: Grid lines along every axis, None for axes on which
+            the mesh is flat
+        :param cell_elements: Element of every cell, the cells numbered
+            with the first axis varying fastest
+        :param connectivity: Nodes of every element [nelem, nnodes], for
+            nodal meshes
+        :param sides: For every node of every element whether it is on the
+            upper side of the element along the non flat axes,
+            [nelem, nnodes, naxes]
+        :param tolerance: Absolute tolerance the grid was detected with
+        """
+        self.edges = edges
+        self.axes = [d for d, e in enumerate(edges) if e is not None]
+        self.shape = tuple(edges[d].size - 1 for d in self.axes)
+        self.cell_elements = cell_elements
+        self.connectivity = connectivity
+        self.sides = sides
+        self.tolerance = tolerance
+        # Uniform axes are located by a division instead of a search.
+        self.spacing = []
+        for d in self.axes:
+            step = np.diff(edges[d])
+            uniform = np.all(np.abs(step - step.mean()) <= tolerance)
+            self.spacing.append(step.mean() if uniform else None)
+
+    @staticmethod
+    def _detect(lower, upper, tolerance, allow_flat):
+        """
+        Find the grid lines and the element of every cell from the element
+        boxes, or None if the boxes do not tile a grid.
+        """
+        nelem, dimension = lower.shape
+        size = upper - lower
+        atol = tolerance * float(np.median(np.max(size, axis=1)))
+        domain = upper.max(axis=0) - lower.min(axis=0)
+
+        edges = []
+        cells = []
+        for d in range(dimension):
+            if domain[d] <= atol:
+                if not allow_flat:
+                    return None
+                edges.append(None)
+                continue
+            values = np.sort(np.concatenate((lower[:, d], upper[:, d])))
+            keep = np.concatenate(([True], np.diff(values) > atol))
+            axis_edges = values[keep]
+            first = np.searchsorted(axis_edges, lower[:, d] + atol) - 1
+            last = np.searchsorted(axis_edges, upper[:, d] + atol) - 1
+            if np.any(first < 0) or \
+                    np.any(np.abs(axis_edges[first] - lower[:, d]) > atol) or \
+                    np.any(last != first + 1) or \
+                    np.any(np.abs(axis_edges[last] - upper[:, d]) > atol):
+                return None
+            edges.append(axis_edges)
+            cells.append(first)
+
+        if not cells:
+            return None
+        shape = tuple(edges[d].size - 1 for d in range(dimension)
+                      if edges[d] is not None)
+        if int(np.prod(shape)) != nelem:
+            return None
+        cell = np.ravel_multi_index(tuple(cells), shape, order="F")
+        cell_elements = np.full(nelem, -1, dtype=np.int64)
+        cell_elements[cell] = np.arange(nelem)
+        if np.any(cell_elements < 0):
+            return None
+        return edges, cell_elements, atol
+
+    @classmethod
+    def from_connectivity(cls, points, connectivity, tolerance=1e-6,
+                          chunk_size=1000000):
+        """
+        The grid of a nodal mesh, e.g. an exodus mesh, if its elements are
+        axis aligned boxes on a grid with their nodes at the corners.
+
+        :param points: Coordinates of the nodes [nnodes, dimension]
+        :param connectivity: Nodes of every element [nelem, nnodes]
+        :param tolerance: Tolerance relative to the element size
+        :param chunk_size: Elements to process at a time
+        :return: StructuredGrid or None if the mesh is not structured
+        """
+        nelem, nnodes = connectivity.shape
+        lower = np.empty((nelem, points.shape[1]))
+        upper = np.empty((nelem, points.shape[1]))
+        for start in range(0, nelem, chunk_size):
+            rows = slice(start, start + chunk_size)
+            lower[rows], upper[rows] = element_bounding_boxes(
+                points[connectivity[rows]], padding=0.0)
+        detected = cls._detect(lower, upper, tolerance, allow_flat=True)
+        if detected is None:
+            return None
+        edges, cell_elements, atol = detected
+        axes = [d for d, e in enumerate(edges) if e is not None]
+        if nnodes != 2 ** len(axes):
+            return None
+
+        # Every node has to sit on its own corner of the element box.
+        sides = np.empty((nelem, nnodes, len(axes)), dtype=bool)
+        corners = np.arange(nnodes)
+        for start in range(0, nelem, chunk_size):
+            rows = slice(start, start + chunk_size)
+            nodes = points[connectivity[rows]][:, :, axes]
+            on_upper = np.abs(nodes - upper[rows, np.newaxis][:, :, axes]) \
+                <= atol
+            on_lower = np.abs(nodes - lower[rows, np.newaxis][:, :, axes]) \
+                <= atol
+            if not np.all(on_upper | on_lower):
+                return None
+            corner = np.sum(on_upper * (2 ** np.arange(len(axes))), axis=2)
+            if np.any(np.sort(corner, axis=1) != corners):
+                return None
+            sides[rows] = on_upper
+        return cls(edges, cell_elements, connectivity=connectivity,
+                   sides=sides, tolerance=atol)
+
+    @classmethod
+    def from_elements(cls, element_nodes, tolerance=1e-6,
+                      chunk_size=100000):
+        """
+        The grid of a gll mesh if its elements are axis aligned boxes on a
+        grid, with the reference axes of every element along the
+        coordinate axes.
+
+        :param element_nodes: Coordinates of the elements,
+            [nelem, nnodes, dimension]
+        :param tolerance: Tolerance relative to the element size
+        :param chunk_size: Elements to process at a time
+        :return: StructuredGrid or None if the mesh is not structured
+        """
+        nelem, nnodes, dimension = element_nodes.shape
+        try:
+            order = tensor_gll.order_from_nodes(nnodes, dimension)
+        except ValueError:
+            return None
+        lower, upper = element_bounding_boxes(element_nodes, padding=0.0)
+        detected = cls._detect(lower, upper, tolerance, allow_flat=False)
+        if detected is None:
+            return None
+        edges, cell_elements, atol = detected
+
+        # Position of every node in the element relative to the box.
+        xi = (tensor_gll.gll_points(order) + 1.0) / 2.0
+        index = np.arange(nnodes)
+        relative = np.stack([xi[(index // (order + 1) ** d) % (order + 1)]
+                             for d in range(dimension)], axis=1)
+        for start in range(0, nelem, chunk_size):
+            rows = slice(start, start + chunk_size)
+            expected = lower[rows, np.newaxis] + relative * \
+                (upper[rows] - lower[rows])[:, np.newaxis]
+            if np.any(np.abs(element_nodes[rows] - expected) > atol):
+                return None
+        return cls(edges, cell_elements, tolerance=atol)
+
+    def _cells(self, points):
+        """
+        Element of every point and its relative position within the cell
+        along every non flat axis, zero and one at the cell boundaries.
+        Points outside of the grid get the closest cell.
+        """
+        npoints = points.shape[0]
+        cells = np.empty((len(self.axes), npoints), dtype=np.int64)
+        position = np.empty((npoints, len(self.axes)))
+        for i, d in enumerate(self.axes):
+            edges = self.edges[d]
+            x = points[:, d]
+            if self.spacing[i] is not None:
+                cell = np.floor((x - edges[0]) / self.spacing[i])
+                cell = np.clip(cell, 0, edges.size - 2).astype(np.int64)
+            else:
+                cell = np.clip(np.searchsorted(edges, x, side="right") - 1,
+                               0, edges.size - 2)
+            position[:, i] = (x - edges[cell]) / \
+                (edges[cell + 1] - edges[cell])
+            cells[i] = cell
+        elements = self.cell_elements[
+            np.ravel_multi_index(tuple(cells), self.shape, order="F")]
+        return elements, position
+
+    def locate(self, points, tolerance=1e-2):
+        """
+        Find the enclosing element and the reference coordinates of points,
+        the same as locator.locate_points does for any mesh. Points outside
+        of the grid get the closest element with the reference coordinates
+        clipped to it.
+
+        :param points: Points to locate [npoints, dimension]
+        :param tolerance: How far outside the reference element a point
+            may be and still count as inside
+        :return: elements [npoints], reference coordinates
+            [npoints, dimension] and a boolean mask of the points which
+            were found inside an element
+        """
+        points = np.asarray(points, dtype=np.float64)
+        elements, position = self._cells(points)
+        ref_coords = np.zeros((points.shape[0], len(self.edges)))
+        ref_coords[:, self.axes] = 2.0 * position - 1.0
+        found = np.all(np.abs(ref_coords) <= 1.0 + tolerance, axis=1)
+        nmissing = points.shape[0] - np.count_nonzero(found)
+        if nmissing > 0:
+            warnings.warn(f"{nmissing} points are outside of the structured "
+                          f"grid. Will use the closest elements for those "
+                          f"points.")
+        return elements, np.clip(ref_coords, -1.0, 1.0), found
+
+    def trilinear_weights(self, points, extrapolate=0.25):
+        """
+        The multilinear interpolation weights of points from the nodes of
+        the enclosing elements, the same as the trilinear interpolator
+        computes for any hexahedral mesh.
+
+        :param points: Points to interpolate onto [npoints, dimension]
+        :param extrapolate: Points up to this fraction of an element
+            outside of the grid are extrapolated to, the ones further out
+            fail and get zero weights
+        :return: Nodes of the enclosing elements [npoints, nnodes], their
+            weights [npoints, nnodes] and the amount of points which could
+            not be interpolated
+        """
+        points = np.asarray(points, dtype=np.float64)
+        elements, position = self._cells(points)
+        inside = np.all((position >= -extrapolate) &
+                        (position <= 1.0 + extrapolate), axis=1)
+        weights = np.prod(np.where(self.sides[elements],
+                                   position[:, np.newaxis, :],
+                                   1.0 - position[:, np.newaxis, :]), axis=2)
+        weights[~inside] = 0.0
+        node_indices = np.asarray(self.connectivity[elements],
+                                  dtype=np.int64)
+        return node_indices, weights, int(np.count_nonzero(~inside))
@@ -0,0 +1,244 @@
+"""
+Tensor product GLL elements in pure NumPy.
+
+Everything in here works on stacks of points and elements at once, so
+there is no need to go back to Python for every point and the salvus_fem
+library is not needed.
+
+The control nodes of an element of order n are expected in tensor product
+order with the first reference coordinate varying fastest, i.e. node
+i + (n + 1) * j + (n + 1) ** 2 * k sits at the reference coordinates
+(x_i, x_j, x_k) where x are the GLL points of order n.
+"""
+import functools
+
+import numpy as np
+
+from multi_mesh.components import stats
+
+
+def gll_points(order):
+    """
+    The Gauss-Lobatto-Legendre points on [-1, 1].
+
+    :param order: Polynomial order, the amount of points is order + 1
+    :return: The points in ascending order
+    """
+    if order < 1:
+        raise ValueError("The order of a GLL basis has to be at least 1")
+    interior = np.polynomial.legendre.Legendre.basis(order).deriv().roots()
+    points = np.concatenate(([-1.0], np.sort(interior.real), [1.0]))
+    # Make the points exactly symmetric around zero.
+    return (points - points[::-1]) / 2.0
+
+
+def order_from_nodes(nnodes, dimension):
+    """
+    Find the polynomial order of an element from its amount of nodes.
+
+    :param nnodes: Amount of nodes per element
+    :param dimension: Spatial dimension
+    :return: Polynomial order
+    """
+    order = int(round(nnodes ** (1.0 / dimension))) - 1
+    if order < 1 or (order + 1) ** dimension != nnodes:
+        raise ValueError(f"{nnodes} nodes do not make up a tensor product "
+                         f"element in {dimension} dimensions")
+    return order
+
+
+@functools.lru_cache(maxsize=None)
+def barycentric_tables(order):
+    """
+    The 1D GLL points of an order with their barycentric weights and the
+    nodal differentiation matrix. These are computed once per order and
+    cached, so they should be treated as read-only.
+
+    :param order: Polynomial order
+    :return: points [order + 1], weights [order + 1] and the
+        differentiation matrix [order + 1, order + 1] with entry (i, j)
+        being the derivative of the j-th Lagrange polynomial at point i
+    """
+    points = gll_points(order)
+    distances = points[:, np.newaxis] - points[np.newaxis, :]
+    np.fill_diagonal(distances, 1.0)
+    weights = 1.0 / np.prod(distances, axis=1)
+
+    differentiation = (weights[np.newaxis, :] / weights[:, np.newaxis]) / \
+        distances
+    np.fill_diagonal(differentiation, 0.0)
+    np.fill_diagonal(differentiation, -differentiation.sum(axis=1))
+
+    for table in (points, weights, differentiation):
+        table.flags.writeable = False
+    return points, weights, differentiation
+
+
+def lagrange_1d(order, x, derivatives=True):
+    """
+    Evaluate the 1D Lagrange polynomials through the GLL points, and
+    optionally their derivatives, with the barycentric formula.
+
+    :param order: Polynomial order
+    :param x: Points to evaluate at, shape [npoints]
+    :param derivatives: Whether to compute the derivatives as well
+    :return: Values [npoints, order + 1], and the derivatives of the same
+        shape if asked for
+    """
+    points, weights, differentiation = barycentric_tables(order)
+    diff = np.asarray(x, dtype=np.float64)[:, np.newaxis] - points
+    exact = diff == 0.0
+    diff[exact] = 1.0
+
+    terms = weights / diff
+    values = terms / terms.sum(axis=1, keepdims=True)
+    on_node = exact.any(axis=1)
+    values[on_node] = exact[on_node]
+
+    if not derivatives:
+        return values
+    # The derivative of a Lagrange polynomial is itself interpolated
+    # exactly by the Lagrange polynomials.
+    return values, values @ differentiation
+
+
+def _tensor(factors):
+    """
+    Tensor product of the 1D factors [npoints, order + 1] of every
+    reference coordinate, with the first factor varying fastest.
+    """
+    if len(factors) == 2:
+        product = np.einsum("nj,ni->nji", factors[1], factors[0])
+    else:
+        product = np.einsum("nk,nj,ni->nkji", factors[2], factors[1],
+                            factors[0])
+    return product.reshape(product.shape[0], -1)
+
+
+def get_coefficients_batch(order, ref_coords):
+    """
+    Compute the interpolation coefficients of many reference coordinates
+    at once. The interpolated value of point n is the dot product of row n
+    with the nodal values of its element.
+
+    :param order: Polynomial order
+    :param ref_coords: Reference coordinates, shape [npoints, dimension]
+    :return: Coefficients, shape [npoints, nnodes]
+    """
+    ref_coords = np.asarray(ref_coords, dtype=np.float64)
+    return _tensor([lagrange_1d(order, ref_coords[:, d], derivatives=False)
+                    for d in range(ref_coords.shape[1])])
+
+
+def shape_functions(order, ref_coords):
+    """
+    Evaluate the tensor product shape functions and their derivatives.
+
+    :param order: Polynomial order
+    :param ref_coords: Reference coordinates, shape [npoints, dimension]
+    :return: Values [npoints, nnodes] and derivatives with respect to the
+        reference coordinates [npoints, nnodes, dimension]
+    """
+    ref_coords = np.asarray(ref_coords, dtype=np.float64)
+    dimension = ref_coords.shape[1]
+    values, derivatives = zip(*[lagrange_1d(order, ref_coords[:, d])
+                                for d in range(dimension)])
+
+    shape = _tensor(values)
+    dshape = np.empty(shape.shape + (dimension,))
+    for d in range(dimension):
+        factors = list(values)
+        factors[d] = derivatives[d]
+        dshape[:, :, d] = _tensor(factors)
+    return shape, dshape
+
+
+def coordinate_transform(ref_coords, ctrl_nodes):
+    """
+    Map reference coordinates to physical coordinates.
+
+    :param ref_coords: Reference coordinates, shape [npoints, dimension]
+    :param ctrl_nodes: Control nodes of the element of every point,
+        shape [npoints, nnodes, dimension]
+    :return: Physical coordinates, shape [npoints, dimension]
+    """
+    order = order_from_nodes(ctrl_nodes.shape[1], ctrl_nodes.shape[2])
+    shape = get_coefficients_batch(order, ref_coords)
+    return np.einsum("na,nad->nd", shape, ctrl_nodes)
+
+
+def _solve(matrix, rhs):
+    """
+    Solve a stack of 2x2 or 3x3 linear systems with the adjugate. Singular
+    systems give NaN instead of raising for the whole stack.
+    """
+    m = matrix
+    if m.shape[1] == 2:
+        det = m[:, 0, 0] * m[:, 1, 1] - m[:, 0, 1] * m[:, 1, 0]
+        adj = np.empty_like(m)
+        adj[:, 0, 0] = m[:, 1, 1]
+        adj[:, 0, 1] = -m[:, 0, 1]
+        adj[:, 1, 0] = -m[:, 1, 0]
+        adj[:, 1, 1] = m[:, 0, 0]
+    else:
+        adj = np.empty_like(m)
+        adj[:, 0, 0] = m[:, 1, 1] * m[:, 2, 2] - m[:, 1, 2] * m[:, 2, 1]
+        adj[:, 0, 1] = m[:, 0, 2] * m[:, 2, 1] - m[:, 0, 1] * m[:, 2, 2]
+        adj[:, 0, 2] = m[:, 0, 1] * m[:, 1, 2] - m[:, 0, 2] * m[:, 1, 1]
+        adj[:, 1, 0] = m[:, 1, 2] * m[:, 2, 0] - m[:, 1, 0] * m[:, 2, 2]
+        adj[:, 1, 1] = m[:, 0, 0] * m[:, 2, 2] - m[:, 0, 2] * m[:, 2, 0]
+        adj[:, 1, 2] = m[:, 0, 2] * m[:, 1, 0] - m[:, 0, 0] * m[:, 1, 2]
+        adj[:, 2, 0] = m[:, 1, 0] * m[:, 2, 1] - m[:, 1, 1] * m[:, 2, 0]
+        adj[:, 2, 1] = m[:, 0, 1] * m[:, 2, 0] - m[:, 0, 0] * m[:, 2, 1]
+        adj[:, 2, 2] = m[:, 0, 0] * m[:, 1, 1] - m[:, 0, 1] * m[:, 1, 0]
+        det = np.einsum("nj,nj->n", m[:, 0, :], adj[:, :, 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.einsum("nij,nj->ni", adj, rhs) / det[:, np.newaxis]
+
+
+def inverse_transform(points, ctrl_nodes, max_iter=50, tolerance=1e-10,
+                      max_ref=2.0):
+    """
+    Find the reference coordinates of points inside elements with Newton's
+    method, for all points at once.
+
+    :param points: Physical coordinates, shape [npoints, dimension]
+    :param ctrl_nodes: Control nodes of the element of every point,
+        shape [npoints, nnodes, dimension]
+    :param max_iter: Maximum amount of Newton iterations
+    :param tolerance: Convergence tolerance on the physical residual,
+        relative to the size of the element
+    :param max_ref: The iterates are kept within [-max_ref, max_ref] so
+        points far outside their element do not diverge
+    :return: Reference coordinates [npoints, dimension] and a boolean mask
+        of the points for which the iteration converged
+    """
+    points = np.asarray(points, dtype=np.float64)
+    ctrl_nodes = np.asarray(ctrl_nodes, dtype=np.float64)
+    npoints, dimension = points.shape
+    order = order_from_nodes(ctrl_nodes.shape[1], dimension)
+
+    scale = np.max(ctrl_nodes.max(axis=1) - ctrl_nodes.min(axis=1), axis=1)
+    ref_coords = np.zeros((npoints, dimension))
+    converged = np.zeros(npoints, dtype=bool)
+    active = np.arange(npoints)
+
+    for _ in range(max_iter + 1):
+        nodes = ctrl_nodes[active]
+        shape, dshape = shape_functions(order, ref_coords[active])
+        residual = points[active] - np.einsum("na,nad->nd", shape, nodes)
+
+        done = np.max(np.abs(residual), axis=1) <= tolerance * scale[active]
+        converged[active[done]] = True
+        keep = ~done & np.all(np.isfinite(residual), axis=1)
+        active = active[keep]
+        if active.size == 0:
+            break
+        stats.count("newton_iterations", active.size)
+
+        jacobian = np.einsum("nad,nak->ndk", nodes[keep], dshape[keep])
+        update = _solve(jacobian, residual[keep])
+        ref_coords[active] = np.clip(ref_coords[active] + update,
+                                     -max_ref, max_ref)
+
+    return ref_coords, converged
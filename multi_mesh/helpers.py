@@ -15,6 +15,7 @@ import ctypes as C
 import glob
 import inspect
 import os
+import sysconfig
 
 import numpy as np
 
@@ -24,24 +25,41 @@ LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(
 cache = []
 
 
+def find_lib():
+    """
+    Find the compiled MultiMesh library. The MULTI_MESH_LIB environment
+    variable can point to it directly, otherwise it is looked for in the lib
+    directory of the package, preferring a library built for the running
+    python.
+    """
+    if os.environ.get("MULTI_MESH_LIB"):
+        return os.environ["MULTI_MESH_LIB"]
+
+    ext_suffix = sysconfig.get_config_var("EXT_SUFFIX") or ".so"
+    # Enable a couple of different library naming schemes.
+    for pattern in ["multi_mesh" + ext_suffix, "multi_mesh*.so",
+                    "multi_mesh*.dylib", "multi_mesh*.pyd"]:
+        possible_files = sorted(glob.glob(os.path.join(LIB_DIR, pattern)))
+        if possible_files:
+            return possible_files[0]
+    raise ValueError(f"Could not find suitable MultiMesh shared library in "
+                     f"{LIB_DIR}. Build it with 'pip install .' or "
+                     f"'python setup.py build_ext --inplace', or point the "
+                     f"MULTI_MESH_LIB environment variable to it.")
+
+
 def load_lib():
     if cache:  # pragma: no cover
         return cache[0]
     else:
-        # Enable a couple of different library naming schemes.
-        possible_files = glob.glob(os.path.join(LIB_DIR, "multi_mesh*.so"))
-        if not possible_files:  # pragma: no cover
-            raise ValueError("Could not find suitable MultiMesh shared "
-                             "library.")
-        filename = possible_files[0]
-        lib = C.CDLL(filename)
+        lib = C.CDLL(find_lib())
 
         # A couple of definitions.
         lib.centroid.restype = C.c_void_p
         lib.centroid.argtypes = [
-            C.c_int,
-            C.c_int,
-            C.c_int,
+            C.c_longlong,
+            C.c_longlong,
+            C.c_longlong,
             np.ctypeslib.ndpointer(dtype=np.int64, ndim=2,
                                    flags=['C_CONTIGUOUS']),
             np.ctypeslib.ndpointer(dtype=np.float64, ndim=2,
@@ -51,8 +69,8 @@ def load_lib():
 
         lib.triLinearInterpolator.restype = C.c_int64
         lib.triLinearInterpolator.argtypes = [
-            C.c_int,
-            C.c_int,
+            C.c_longlong,
+            C.c_longlong,
             np.ctypeslib.ndpointer(dtype=np.int64, ndim=2,
                                    flags=['C_CONTIGUOUS']),
             np.ctypeslib.ndpointer(dtype=np.int64, ndim=2,
@@ -64,7 +82,8 @@ def load_lib():
             np.ctypeslib.ndpointer(dtype=np.float64, ndim=2,
                                    flags=['C_CONTIGUOUS']),
             np.ctypeslib.ndpointer(dtype=np.float64, ndim=2,
-                                   flags=['C_CONTIGUOUS'])]
+                                   flags=['C_CONTIGUOUS']),
+            C.c_longlong]
 
         cache.append(lib)
         return lib
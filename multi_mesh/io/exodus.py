@@ -1,48 +1,207 @@
+import contextlib
+
 from pyexodus import exodus
+import h5py
 import numpy as np
-# from multi_mesh.helpers import load_lib
+from multi_mesh.helpers import load_lib
+
+# Order of the nodes of a hexahedron expected by the trilinear interpolation
+# kernel, relative to the exodus order.
+TRILINEAR_NODE_ORDER = np.argsort([0, 3, 2, 1, 4, 5, 6, 7])
+
+
+def read_points(filename):
+    """
+    Read the node coordinates of an exodus file stored as HDF5 (netCDF4)
+    straight into one C contiguous float64 array of shape [nnodes, 3], the
+    layout the C kernels expect, without any intermediate copies. The z
+    coordinates of 2D meshes are zero.
+    :param filename: The exodus file
+    """
+    with h5py.File(filename, "r") as f:
+        points = np.zeros((f["coordx"].shape[0], 3))
+        for d, name in enumerate(["coordx", "coordy", "coordz"]):
+            if name in f:
+                f[name].read_direct(points, dest_sel=np.s_[:, d])
+    return points
 
-# lib = load_lib()
+
+def read_connectivity(filename, block=1, node_order=None, chunk_rows=1000000):
+    """
+    Read the connectivity of an element block of an exodus file stored as
+    HDF5 (netCDF4) into one int64 array, 0 based and with the nodes of every
+    element already in node_order. It is read in chunks of rows, so apart
+    from the result only a chunk is ever in memory.
+    :param filename: The exodus file
+    :param block: Id of the element block
+    :param node_order: Order of the nodes of an element, e.g.
+    TRILINEAR_NODE_ORDER. The exodus order if None.
+    :param chunk_rows: Elements to read at a time
+    """
+    with h5py.File(filename, "r") as f:
+        dataset = f[f"connect{block}"]
+        connectivity = np.empty(dataset.shape, dtype=np.int64)
+        for start in range(0, dataset.shape[0], chunk_rows):
+            rows = np.s_[start:start + chunk_rows]
+            if node_order is None:
+                dataset.read_direct(connectivity, source_sel=rows,
+                                    dest_sel=rows)
+                connectivity[rows] -= 1
+            else:
+                connectivity[rows] = dataset[rows][:, node_order] - 1
+    return connectivity
+
+
+def read_nodal_fields(filename, names, step=1):
+    """
+    Read nodal fields of an exodus file without reading the mesh. Files
+    stored as HDF5 (netCDF4) are read directly with h5py, others through
+    pyexodus.
+    :param filename: The exodus file
+    :param names: Names of the fields
+    :param step: Time step, 1 based as in exodus
+    :return: Field values, shape [len(names), nnodes]
+    """
+    if not h5py.is_hdf5(filename):
+        with exodus(filename, "r") as e:
+            return np.array([e.get_node_variable_values(name=name, step=step)
+                             for name in names], dtype=np.float64)
+
+    with h5py.File(filename, "r") as f:
+        nodal_names = [b"".join(name).decode().strip()
+                       for name in f["name_nod_var"][:]] \
+            if "name_nod_var" in f else []
+        values = np.empty((len(names), f["coordx"].shape[0]))
+        for i, name in enumerate(names):
+            if name not in nodal_names:
+                raise ValueError(f"Nodal field {name} does not exist in "
+                                 f"{filename}")
+            dataset = f[f"vals_nod_var{nodal_names.index(name) + 1}"]
+            dataset.read_direct(values, source_sel=np.s_[step - 1],
+                                dest_sel=np.s_[i])
+    return values
 
 
 class Exodus(object):
     """
     This class is a helper to read and write variables from and
     to an exodus file. currently only supports one element block
+
+    Used as a context manager the file is kept open until the end of the
+    with block, otherwise it is opened again for every read or write.
+    Fields are cached in memory once read or written, so asking for the
+    same field twice does not go back to the file.
+
+    The coordinates and the connectivity are read directly into the layout
+    of the C kernels. With node_order the nodes of the elements are stored
+    in that order, e.g. TRILINEAR_NODE_ORDER, so the connectivity can be
+    passed to the kernel without making a reordered copy.
     """
-    def __init__(self, filename, mode='r'):
+    def __init__(self, filename, mode='r', node_order=None):
         self._filename = filename
         assert mode in ['a', 'r'], "Only mode 'a', 'r' is supported"
         self.mode = mode
+        self.node_order = None if node_order is None else \
+            np.asarray(node_order)
         self.connectivity = None
         self.nodes_per_element = None
         self.nelem = None
         self.elem_var_names = None
         self.points = None
         self.nodal_parameters = None
+        self._handle = None
+        self._nodal_cache = {}
+        self._element_cache = {}
 
         # Read File
         self._read()
 
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Open the file and keep it open until close is called.
+        """
+        if self._handle is None:
+            self._handle = exodus(self._filename, self.mode)
+
+    def close(self):
+        """
+        Close the file if it was opened with open.
+        """
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    @contextlib.contextmanager
+    def _file(self):
+        """
+        The open file if there is one, otherwise the file is opened for the
+        duration of the with block.
+        """
+        if self._handle is not None:
+            yield self._handle
+        else:
+            with exodus(self._filename, self.mode) as e:
+                yield e
+
+    def clear_cache(self):
+        """
+        Forget all the fields which were read or written.
+        """
+        self._nodal_cache.clear()
+        self._element_cache.clear()
+
     def _read(self):
         """
         Retrieves basic information from the exodus file
         :return:
         """
-        with exodus(self._filename, self.mode) as e:
+        with self._file() as e:
             self.ndim = e.num_dims
             # assert e.num_dims in [3], "Only '3D' exodus files are supported."
-            self.connectivity, self.nelem, self.nodes_per_element = \
-                e.get_elem_connectivity(id=1)
-
-            # subtract 1 from connectivity
-            # as exodus in 1 based, whereas python is not
-            self.connectivity = np.array(
-                self.connectivity, dtype='int64', ) - 1
-
             self.elem_var_names = e.get_element_variable_names()
-            self.points = np.array((e.get_coords())).T.astype(np.float64)
             self.nodal_parameters = e.get_node_variable_names()
+            if not h5py.is_hdf5(self._filename):
+                self.connectivity, self.nelem, self.nodes_per_element = \
+                    e.get_elem_connectivity(id=1)
+
+                # subtract 1 from connectivity
+                # as exodus in 1 based, whereas python is not
+                self.connectivity = np.array(
+                    self.connectivity, dtype='int64', ) - 1
+                if self.node_order is not None:
+                    self.connectivity = np.ascontiguousarray(
+                        self.connectivity[:, self.node_order])
+                self.points = np.ascontiguousarray(
+                    np.array((e.get_coords())).T, dtype=np.float64)
+                return
+
+        self.points = read_points(self._filename)
+        self.connectivity = read_connectivity(self._filename,
+                                              node_order=self.node_order)
+        self.nelem, self.nodes_per_element = self.connectivity.shape
+
+    def connectivity_in_order(self, node_order):
+        """
+        The connectivity with the nodes of every element in node_order. No
+        copy is made if the mesh was read in that order already.
+        :param node_order: Order of the nodes of an element relative to the
+        exodus order, e.g. TRILINEAR_NODE_ORDER
+        """
+        node_order = np.asarray(node_order)
+        if self.node_order is None:
+            return np.ascontiguousarray(self.connectivity[:, node_order])
+        if np.array_equal(self.node_order, node_order):
+            return self.connectivity
+        # Go back to the exodus order first.
+        return np.ascontiguousarray(
+            self.connectivity[:, np.argsort(self.node_order)][:, node_order])
 
     def get_element_centroid(self):
         """
@@ -50,10 +209,12 @@ class Exodus(object):
         mesh. Useful to determine which domain in a layered medium an element
         belongs to or to compute elemental properties from the model.
         """
+        lib = load_lib()
         centroid = np.zeros((self.nelem, self.ndim))
         lib.centroid(self.ndim, self.nelem, self.nodes_per_element,
                      self.connectivity,
-                     np.ascontiguousarray(self.points), centroid)
+                     np.ascontiguousarray(self.points[:, :self.ndim]),
+                     centroid)
         return centroid
 
     def attach_field(self, name, values):
@@ -63,28 +224,37 @@ class Exodus(object):
         :param values: numpy array of values to be written
         :return:
         """
+        self.attach_fields({name: values})
 
+    def attach_fields(self, fields):
+        """
+        Write several fields to the exodus file at once. Nodal fields have
+        to exist in the file already.
+        :param fields: dictionary of variable names and numpy arrays of
+        values, either one per node or one per element
+        """
         assert self.mode in ['a'], "Attach field option only " \
                                    "available in mode 'a'"
 
-        with exodus(self._filename, self.mode) as e:
-            if values.size == self.nelem:
-                e.put_element_variable_values(blockId=1, name=name,
-                                              step=1, values=values)
-
-            elif values.size == self.npoint:
-                # print(name)
-                idx = e.get_node_variable_names().index(name) + 1
-                # print(idx)
-                # print(name)
-                # print(e.get_node_variable_names())
-                e.put_node_variable_name(name, index=idx)
-                # print(e.get_node_variable_names())
-                e.put_node_variable_values(name, 1, values)
+        with self._file() as e:
+            nodal_names = e.get_node_variable_names()
+            for name, values in fields.items():
+                values = np.asarray(values)
+                if values.size == self.nelem:
+                    e.put_element_variable_values(blockId=1, name=name,
+                                                  step=1, values=values)
+                    self._element_cache[name] = np.array(values)
 
-            else:
-                raise ValueError('Shape matches neither the nodes nor the '
-                                 'elements')
+                elif values.size == self.npoint:
+                    if name not in nodal_names:
+                        raise ValueError(f"Nodal field {name} does not "
+                                         f"exist in {self._filename}")
+                    e.put_node_variable_values(name, 1, values)
+                    self._nodal_cache[name] = np.array(values)
+
+                else:
+                    raise ValueError('Shape matches neither the nodes nor the '
+                                     'elements')
 
     def get_element_field(self, name):
         """
@@ -97,10 +267,12 @@ class Exodus(object):
                                         "available in mode 'r' or 'a'"
         assert name in self.elem_var_names, "Could not find " \
                                             "the requested field"
-        with exodus(self._filename, self.mode) as e:
-            values = e.get_element_variable_values(blockId=1,
-                                                         name=name, step=1)
-        return values
+        if name not in self._element_cache:
+            with self._file() as e:
+                self._element_cache[name] = np.asarray(
+                    e.get_element_variable_values(blockId=1, name=name,
+                                                  step=1))
+        return np.array(self._element_cache[name])
 
     def get_nodal_field(self, name):
         """
@@ -108,15 +280,32 @@ class Exodus(object):
         :param name: name of the variable to be retrieved
         :return nodal field values:
         """
+        return self.get_nodal_fields([name])[0]
+
+    def get_nodal_fields(self, names):
+        """
+        Get the values of several nodal fields, reading all the ones which
+        are not cached in one go.
+        :param names: list of names of the variables to be retrieved
+        :return: nodal field values, shape [len(names), npoint]
+        """
 
         assert self.mode in ['r', 'a'], "Attach field option only " \
                                         "available in mode 'r' or 'a'"
 
-        with exodus(self._filename, self.mode) as e:
-            assert name in e.get_node_variable_names(), \
-                "Could not find the requested field"
+        missing = [name for name in names if name not in self._nodal_cache]
+        if missing:
+            with self._file() as e:
+                nodal_names = e.get_node_variable_names()
+                for name in missing:
+                    assert name in nodal_names, \
+                        "Could not find the requested field"
+                    self._nodal_cache[name] = np.asarray(
+                        e.get_node_variable_values(name=name, step=1))
 
-            values = e.get_node_variable_values(name=name, step=1)
+        values = np.empty((len(names), self.npoint))
+        for i, name in enumerate(names):
+            values[i] = self._nodal_cache[name]
         return values
 
     @property
@@ -1,3 +1,354 @@
 """
-To be implemented
-"""
\ No newline at end of file
+Reading and writing gll models and gradients stored in the HDF5 layout of
+salvus.
+
+Models keep their values in MODEL/data [element, parameter, point] and
+simulation output, like gradients, in ELASTIC/data [time, element,
+parameter, point]. The coordinates of the gll points are next to them in
+coordinates [element, point, dimension]. The parameters are named by the
+label of the parameter dimension, e.g. "[ RHO | VP | VS ]", which older
+files store as bytes and newer ones as str.
+
+GLLModel opens the file once and reads nothing but the labels until it is
+asked for values, so parts of large models can be read cheaply:
+
+    with GLLModel("model.h5") as model:
+        vp = model.read(elements=slice(0, 1000), parameters=["VP"])
+"""
+import posixpath
+
+import h5py
+import numpy as np
+
+GROUPS = ("MODEL", "ELASTIC")
+
+
+def parse_parameters(label, strip_grad=True):
+    """
+    The parameter names in a dimension label.
+
+    :param label: Label like "[ RHO | VP | VS ]", str or bytes
+    :param strip_grad: Remove "grad" from the names of gradients, so
+        "gradVP" becomes "VP"
+    :return: List of parameter names
+    """
+    if isinstance(label, bytes):
+        label = label.decode()
+    label = label.strip()
+    if not (label.startswith("[") and label.endswith("]")):
+        raise ValueError(f"{label} is not a label of parameters")
+    label = label[1:-1].replace(" ", "")
+    if strip_grad:
+        label = label.replace("grad", "")
+    return label.split("|")
+
+
+def parameter_label(parameters):
+    """
+    The dimension label naming parameters, the inverse of parse_parameters.
+    """
+    return "[ " + " | ".join(parameters) + " ]"
+
+
+def label_parameters(dataset, axis=None, strip_grad=True):
+    """
+    The parameters of a dataset, from the label of one of its dimensions.
+
+    :param dataset: The h5py dataset
+    :param axis: Dimension with the parameters, the second to last one if
+        None, as in the model and simulation output layouts
+    :param strip_grad: See parse_parameters
+    """
+    axis = dataset.ndim - 2 if axis is None else axis
+    labels = dataset.attrs.get("DIMENSION_LABELS")
+    if labels is None or len(labels) <= axis:
+        raise ValueError(f"{dataset.name} has no label for dimension {axis}")
+    return parse_parameters(labels[axis], strip_grad)
+
+
+class DatasetView(object):
+    """
+    Lazy view of an HDF5 dataset. Nothing is read until the view is
+    sliced, the slices are converted to dtype while reading and the time
+    axis of simulation output is hidden. Slicing follows h5py, index
+    arrays have to be increasing.
+    """
+    def __init__(self, dataset, dtype=None, prefix=()):
+        """
+        :param dataset: The h5py dataset
+        :param dtype: dtype of the slices, as stored if None
+        :param prefix: Fixed indices of the leading axes, e.g. (0,) for the
+            first time step
+        """
+        self.dataset = dataset
+        self.dtype = dataset.dtype if dtype is None else np.dtype(dtype)
+        self.prefix = tuple(prefix)
+
+    @property
+    def shape(self):
+        return self.dataset.shape[len(self.prefix):]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = self.prefix + key
+        if self.dtype == self.dataset.dtype:
+            return self.dataset[key]
+        return self.dataset.astype(self.dtype)[key]
+
+    def __array__(self, dtype=None):
+        values = self[()]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+
+class GLLModel(object):
+    """
+    A gll model or simulation output in an HDF5 file.
+
+    The file is opened once, until close is called or the with block ends.
+    The parameters are parsed from the labels when the model is opened,
+    the coordinates and the values are only read when they are sliced,
+    see coordinates, data, read and read_coordinates. Writes go through a
+    buffer aligned with the HDF5 chunks of the values.
+    """
+    def __init__(self, filename, mode="r", model_path=None,
+                 coordinates_path=None, dtype=None):
+        """
+        :param filename: The HDF5 file
+        :param mode: "r" to read, "r+" to read and write
+        :param model_path: Path of the values, MODEL/data or ELASTIC/data,
+            whichever exists, if None
+        :param coordinates_path: Path of the coordinates, the coordinates
+            next to the values if None
+        :param dtype: dtype the values are read as, as stored if None. The
+            coordinates are always read in double precision.
+        """
+        assert mode in ["r", "r+"], "Only mode 'r', 'r+' is supported"
+        self._filename = filename
+        self.mode = mode
+        self._file = h5py.File(filename, mode)
+        try:
+            if model_path is None:
+                model_path = self._find_model_path()
+            if coordinates_path is None:
+                coordinates_path = posixpath.join(
+                    posixpath.dirname(model_path), "coordinates")
+            self.model_path = model_path
+            self.coordinates_path = coordinates_path
+            self._data = self._file[model_path]
+            self._coordinates = self._file[coordinates_path]
+            self.parameters = label_parameters(self._data)
+            self.labels = label_parameters(self._data, strip_grad=False)
+        except Exception:
+            self._file.close()
+            raise
+
+        self.nelem, self.ngll, self.dimension = self._coordinates.shape
+        # Simulation output has a time axis in front, only the first step
+        # is used.
+        self._prefix = (0,) * (self._data.ndim - 3)
+        self.coordinates = DatasetView(self._coordinates, np.float64)
+        self.data = DatasetView(self._data, dtype, self._prefix)
+
+    def _find_model_path(self):
+        for group in GROUPS:
+            path = group + "/data"
+            if path in self._file:
+                return path
+        raise ValueError(f"{self._filename} has none of "
+                         f"{[group + '/data' for group in GROUPS]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the file.
+        """
+        if self._file:
+            self._file.close()
+
+    @property
+    def file(self):
+        """
+        The open h5py file, to create or replace datasets next to the
+        model.
+        """
+        return self._file
+
+    @property
+    def nparams(self):
+        return len(self.parameters)
+
+    def parameter_indices(self, parameters):
+        """
+        The positions of parameters in the values.
+
+        :param parameters: Parameter names
+        """
+        missing = [name for name in parameters if name not in self.parameters]
+        if missing:
+            raise ValueError(f"{self._filename} does not have the "
+                             f"parameters {missing}, it has "
+                             f"{self.parameters}")
+        return [self.parameters.index(name) for name in parameters]
+
+    def read_coordinates(self, elements=None):
+        """
+        Read the coordinates of the gll points in double precision.
+
+        :param elements: Slice or increasing indices of the elements, all
+            of them if None
+        :return: Coordinates [elements, ngll, dimension]
+        """
+        return self.coordinates[_elements(elements)]
+
+    def read(self, elements=None, parameters=None, dtype=None):
+        """
+        Read values.
+
+        :param elements: Slice or increasing indices of the elements, all
+            of them if None
+        :param parameters: Names of the parameters, in the order they are
+            returned, all of them if None
+        :param dtype: dtype of the values, the dtype of the model if None
+        :return: Values [elements, parameters, ngll]
+        """
+        view = self.data if dtype is None else \
+            DatasetView(self._data, dtype, self._prefix)
+        elements = _elements(elements)
+        if parameters is None:
+            return view[elements]
+
+        index = np.asarray(self.parameter_indices(parameters))
+        order = np.argsort(index)
+        if isinstance(elements, slice) and \
+                np.all(np.diff(index[order]) > 0):
+            # h5py reads an increasing list of parameters directly
+            values = view[elements, list(index[order])]
+        else:
+            values = view[elements][:, np.sort(index)]
+        return values[:, np.argsort(order)]
+
+    def write(self, values, elements=None, parameters=None,
+              buffer_bytes=64 * 1024 ** 2):
+        """
+        Write values. They are converted to the dtype of the file in a
+        buffer holding whole HDF5 chunks, so every chunk is written in one
+        go.
+
+        :param values: Values [elements, parameters, ngll]
+        :param elements: Slice or increasing indices of the elements, all
+            of them if None
+        :param parameters: Names of the written parameters, in the order of
+            values, all of them if None
+        :param buffer_bytes: Size of the conversion buffer
+        """
+        assert self.mode == "r+", "Writing is only available in mode 'r+'"
+        if parameters is None:
+            index, order = slice(None), slice(None)
+            nparams = self.nparams
+        else:
+            index = np.asarray(self.parameter_indices(parameters))
+            order = np.argsort(index)
+            if np.any(np.diff(index[order]) == 0):
+                raise ValueError(f"The parameters {parameters} are not "
+                                 f"unique")
+            index = list(index[order])
+            nparams = len(index)
+        if values.shape[1:] != (nparams, self.ngll):
+            raise ValueError(f"Values of shape {values.shape} do not fit "
+                             f"{nparams} parameters of {self.ngll} points")
+
+        rows = self._write_rows(buffer_bytes, nparams)
+        buffer = np.empty((rows, nparams, self.ngll), dtype=self._data.dtype)
+        for first, last, offset in _runs(_elements(elements), self.nelem,
+                                         rows):
+            block = buffer[:last - first]
+            block[...] = values[offset:offset + last - first][:, order]
+            self._data[self._prefix + (slice(first, last), index)] = block
+
+    def _write_rows(self, buffer_bytes, nparams):
+        """
+        Elements written at once, a multiple of the elements per HDF5 chunk
+        if the values are chunked.
+        """
+        row_bytes = nparams * self.ngll * self._data.dtype.itemsize
+        rows = max(1, buffer_bytes // row_bytes)
+        chunks = self._data.chunks
+        if chunks is not None:
+            chunk_rows = chunks[len(self._prefix)]
+            rows = max(chunk_rows, rows - rows % chunk_rows)
+        return min(rows, max(1, self.nelem))
+
+    def solid_elements(self):
+        """
+        Which elements are solid, from the fluid flag of the element data.
+        All elements are solid if the model has no element data.
+        """
+        path = posixpath.join(posixpath.dirname(self.model_path),
+                              "element_data")
+        if path not in self._file:
+            return np.ones(self.nelem, dtype=bool)
+        element_data = self._file[path]
+        fluid = label_parameters(element_data, 1).index("fluid")
+        return np.invert(element_data[:, fluid].astype(bool))
+
+
+def _elements(elements):
+    """
+    Elements as a slice or an increasing index array.
+    """
+    if elements is None:
+        return slice(None)
+    if isinstance(elements, slice):
+        return elements
+    return np.asarray(elements)
+
+
+def _runs(elements, nelem, rows):
+    """
+    Split elements into contiguous ranges which do not cross a multiple of
+    rows, so a range never covers more than the HDF5 chunks of one buffer.
+
+    :return: Tuples (first, last, offset), the elements first to last are
+        rows offset to offset + last - first of the values
+    """
+    if isinstance(elements, slice):
+        start, stop, step = elements.indices(nelem)
+        if step != 1:
+            elements = np.arange(start, stop, step)
+        else:
+            starts, stops = np.array([start]), np.array([max(start, stop)])
+    if not isinstance(elements, slice):
+        elements = np.asarray(elements, dtype=np.int64)
+        if elements.size == 0:
+            return
+        if np.any(np.diff(elements) <= 0):
+            raise ValueError("The elements have to be increasing")
+        breaks = np.flatnonzero(np.diff(elements) != 1) + 1
+        starts = elements[np.r_[0, breaks]]
+        stops = elements[np.r_[breaks - 1, elements.size - 1]] + 1
+
+    offset = 0
+    for start, stop in zip(starts, stops):
+        first = int(start)
+        while first < stop:
+            last = min(int(stop), (first // rows + 1) * rows)
+            yield first, last, offset
+            offset += last - first
+            first = last
@@ -1,30 +1,99 @@
+"""
+The multi_mesh command line interface.
+
+Only click is imported when the module is loaded, every command imports
+what it needs when it runs. That keeps --help and small commands fast, they
+do not pay for numpy, h5py, pyexodus and the interpolation machinery.
+"""
 import click
+import sys
+import time
 import warnings
 
-from multi_mesh.io.exodus import Exodus
-
-from scipy.spatial import cKDTree
-import numpy as np
-from multi_mesh.helpers import load_lib
-import h5py
-import time
-from pykdtree.kdtree import KDTree
-from multi_mesh import utils
-
-import salvus_fem
-# Buffer the salvus_fem functions, so accessing becomes much faster
-for name, func in salvus_fem._fcts:
-    if name == "__GetInterpolationCoefficients__int_n0_4__int_n1_4__int_n2_4__Matrix_Derive" \
-               "dA_Eigen::Matrix<double, 3, 1>__Matrix_DerivedB_Eigen::Matrix<double, 125, 1>":
-        GetInterpolationCoefficients = func
-    if name == "__InverseCoordinateTransformWrapper__int_n_4__int_d_3":
-        InverseCoordinateTransformWrapper = func
+_START = time.perf_counter()
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+
+def _profile_imports(ctx):
+    """
+    Time every module imported from now on and print the slowest ones,
+    together with the time it took to get here, when the command is done.
+    """
+    import builtins
+
+    ready = time.perf_counter() - _START
+    original_import = builtins.__import__
+    timings = []
+    depth = [0]
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level > 0 or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        depth[0] += 1
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            depth[0] -= 1
+            timings.append((time.perf_counter() - start, depth[0], name))
+
+    def report():
+        builtins.__import__ = original_import
+        total = sum(t for t, d, _ in timings if d == 0)
+        print(f"\nStartup: {ready * 1000:.1f} ms from loading the cli to "
+              f"parsing the command line, "
+              f"{total * 1000:.1f} ms importing {len(timings)} modules for "
+              f"the command", file=sys.stderr)
+        print(f"{'inclusive ms':>12}  module", file=sys.stderr)
+        for t, d, name in sorted(timings, reverse=True)[:25]:
+            print(f"{t * 1000:12.1f}  {'  ' * d}{name}", file=sys.stderr)
+
+    builtins.__import__ = timed_import
+    ctx.call_on_close(report)
+
+
+def _collect_stats(ctx, print_stats, stats_file):
+    """
+    Record the phases and counters of everything the command does and
+    report them when it is done.
+    """
+    from multi_mesh.components import stats
+
+    def report():
+        if print_stats:
+            print(collected.report(), file=sys.stderr)
+        if stats_file is not None:
+            collected.write_json(stats_file)
+
+    # Callbacks run in reverse, the collection ends before the report.
+    ctx.call_on_close(report)
+    collected = ctx.with_resource(stats.collect())
+
+
 @click.group()
-def cli():
-    pass
+@click.option('--backend', help="Basis function backend, 'numpy' or "
+                                "'salvus'. Defaults to the "
+                                "MULTI_MESH_BACKEND environment variable or "
+                                "numpy.", default=None)
+@click.option('--profile-startup', 'profile_startup', is_flag=True,
+              help="Print how long starting up and importing the modules "
+                   "of the command took.")
+@click.option('--stats', 'print_stats', is_flag=True,
+              help="Print the time spent in every phase of the command and "
+                   "counters of the work done.")
+@click.option('--stats-file', 'stats_file', default=None,
+              help="Write the phase timings and counters to this JSON file.")
+@click.pass_context
+def cli(ctx, backend, profile_startup, print_stats, stats_file):
+    if profile_startup:
+        _profile_imports(ctx)
+    if print_stats or stats_file is not None:
+        _collect_stats(ctx, print_stats, stats_file)
+    if backend is not None:
+        from multi_mesh.components.backends import set_backend
+        set_backend(backend)
+
 
 @cli.command()
 @click.option('--mesh_a', help="Salvus continuous exodus file.", required=True)
@@ -41,57 +110,39 @@ def interpolate_mesh_a_to_b(mesh_a, mesh_b, params=["TTI"]):
     params: List of parameters to interpolate, if none specified, all TTI
             parameters will be used.
     """
-    from multi_mesh.io.exodus import Exodus
-    from scipy.spatial import cKDTree
+    from multi_mesh.io.exodus import Exodus, TRILINEAR_NODE_ORDER
+    from multi_mesh.components.interpolator import (trilinear_index,
+                                                    trilinear_weights)
     import numpy as np
-    from multi_mesh.helpers import load_lib
-    lib = load_lib()
 
     if params[0] == "TTI":
         params = ["VSH", "VSV", "VPV", "VPH", "RHO", "ETA", "QKAPPA", "QMU"]
 
     # Read Mesh A (exodus format)
-    exodus_a = Exodus(mesh_a)
+    exodus_a = Exodus(mesh_a, node_order=TRILINEAR_NODE_ORDER)
 
-    # Create KDTree from mesh a element centroids
-    a_centroids = exodus_a.get_element_centroid()
-    centroid_tree = cKDTree(a_centroids, balanced_tree=False)
+    # Create an index of the elements of mesh a
+    box_index = trilinear_index(exodus_a.points, exodus_a.connectivity)
 
-    # Read Mesh B and search for nearest_element_indices
+    # Read Mesh B
     nelem_to_search = 20
     exodus_b = Exodus(mesh_b, mode="a")
-    _, nearest_element_indices = centroid_tree.query(exodus_b.points,
-                                                     k=nelem_to_search)
-
-    # number of points that require interpolation.
-    npoints = exodus_b.npoint
-    enclosing_elem_node_indices = np.zeros((npoints, 8), dtype=np.int64)
-    weights = np.zeros((npoints, 8))  # initiate interpolation weights
-    permutation = [0, 3, 2, 1, 4, 5, 6, 7]  # indices of nodes.
-    i = np.argsort(permutation)
-    connectivity_reordered = exodus_a.connectivity[:, i]
 
     # if with_topography: Not implemented yet.
 
-    # Find the correct weights for each point.
-    nfailed = lib.triLinearInterpolator(nelem_to_search,
-                                        npoints,
-                                        nearest_element_indices,
-                                        np.ascontiguousarray(
-                                            connectivity_reordered),
-                                        enclosing_elem_node_indices,
-                                        np.ascontiguousarray(exodus_a.points),
-                                        weights,
-                                        np.ascontiguousarray(exodus_b.points))
+    # Find the enclosing elements and the correct weights for each point.
+    enclosing_elem_node_indices, weights, nfailed = trilinear_weights(
+        box_index, exodus_a.connectivity, exodus_a.points, exodus_b.points,
+        nelem_to_search)
 
     # interpolate the correct parameters to the new mesh.
-    for param in params:
-        param_a = exodus_a.get_nodal_field(param)
-        values = np.sum(param_a[enclosing_elem_node_indices] * weights, axis=1)
-        exodus_b.attach_field(param, np.zeros_like(values))
-        exodus_b.attach_field(param, values)
+    params_a = exodus_a.get_nodal_fields(params)
+    exodus_b.attach_fields({
+        param: np.sum(params_a[j][enclosing_elem_node_indices] * weights,
+                      axis=1)
+        for j, param in enumerate(params)})
 
-    assert nfailed is 0, f"{nfailed} points could not be interpolated."
+    assert nfailed == 0, f"{nfailed} points could not be interpolated."
 
 
 @cli.command()
@@ -116,13 +167,17 @@ def interpolate_mesh_to_gll(mesh, gll_model, gll_order, params=["TTI"]):
     order.
     :param params: A list of parameters to interpolate. Default: ["TTI"]
     """
+    from multi_mesh.io.exodus import Exodus, TRILINEAR_NODE_ORDER
+    from multi_mesh.components.interpolator import (trilinear_index,
+                                                    trilinear_weights)
+    from multi_mesh.io.gll_model import label_parameters
+    import h5py
+    import numpy as np
 
-    lib = load_lib()
     start = time.time()
     # Read in exodus mesh
-    exodus = Exodus(mesh)
-    centroids = exodus.get_element_centroid()
-    centroid_tree = KDTree(centroids)
+    exodus = Exodus(mesh, node_order=TRILINEAR_NODE_ORDER)
+    box_index = trilinear_index(exodus.points, exodus.connectivity)
 
     # Read in gll model
     gll = h5py.File(gll_model, 'r+')
@@ -136,55 +191,24 @@ def interpolate_mesh_to_gll(mesh, gll_model, gll_order, params=["TTI"]):
 
     nelem_to_search = 20
     npoints = len(gll_coords)
-    nearest_element_indices = np.zeros(shape=[npoints,
-                                              gll_points, nelem_to_search],
-                                       dtype=np.int64)
-
-
-    for i in range(gll_points):
-        if (i+1) % 10 == 0 or i == 124 or i == 0:
-            print(f"Finding element indices for gll point: {i+1}/{gll_points}")
-        _, nearest_element_indices[:, i, :] = \
-            centroid_tree.query(gll_coords[:, i, :], k=nelem_to_search)
-
-    # We need to rearrange the array to make the algorithm work
-    nearest_element_indices = np.swapaxes(nearest_element_indices, 0, 1)
 
     enclosing_elem_node_indices = np.zeros((gll_points, npoints, 8),
                                            dtype=np.int64)
     weights = np.zeros((gll_points, npoints, 8))
-    permutation = [0, 3, 2, 1, 4, 5, 6, 7]
-    i = np.argsort(permutation)
-    connectivity_reordered = np.ascontiguousarray(exodus.connectivity[:, i])
-    exopoints = np.ascontiguousarray(exodus.points)
     nfailed = 0
     for i in range(gll_points):
         if (i+1) % 10 == 0 or i == 124 or i == 0:
             print(f"Trilinear interpolation for gll point: {i+1}/{gll_points}")
-        nfailed += lib.triLinearInterpolator(nelem_to_search,
-                                             npoints,
-                                             np.ascontiguousarray(
-                                                 nearest_element_indices[
-                                                 i, :, :]),
-                                             connectivity_reordered,
-                                             enclosing_elem_node_indices[
-                                             i, :, :],
-                                             exopoints,
-                                             weights[i, :, :],
-                                             np.ascontiguousarray(
-                                                 gll_coords[:, i, :],
-                                                 dtype=np.float64))
-
-    assert nfailed is 0, f"{nfailed} points could not be interpolated."
+        enclosing_elem_node_indices[i], weights[i], nfailed_point = \
+            trilinear_weights(box_index, exodus.connectivity, exodus.points,
+                              gll_coords[:, i, :], nelem_to_search)
+        nfailed += nfailed_point
+
+    assert nfailed == 0, f"{nfailed} points could not be interpolated."
     # Lets just interpolate the first parameter
     # params = ["VSV", "VSH", "VPV", "VPH", "RHO"]
 
     isoparams = ["RHO", "VP", "VS", "QKAPPA", "QMU"]
-    ttiparams = ["VPV", "VPH", "VSV", "VSH", "RHO", "ETA", "QKAPPA", "QMU"]
-    # params_gll = gll["MODEL"]["data"].attrs.get("DIMENSION_LABELS")[1].decode()
-    # params_gll = params_gll[2:-2].replace(" ", "").split("|")
-    params_gll = isoparams
-    exodusparams = ttiparams
 
     # if "MODEL/data" in gll:
     #     params_gll = gll["MODEL"]["data"].attrs.get("DIMENSION_LABELS")[1].decode()
@@ -200,19 +224,12 @@ def interpolate_mesh_to_gll(mesh, gll_model, gll_order, params=["TTI"]):
     dimstr = '[ ' + ' | '.join(isoparams) + ' ]'
     gll['MODEL/data'].dims[1].label = dimstr
     gll['MODEL/data'].dims[2].label = 'point'
-    params_gll = gll["MODEL"]["data"].attrs.get("DIMENSION_LABELS")[1].decode()
-
-    params_gll = params_gll[2:-2].replace(" ", "").split("|")
+    params_gll = label_parameters(gll["MODEL/data"], strip_grad=False)
     s = 0
-    # Maybe faster to just load all nodal fields to memory and use those
-    for param_gll in params_gll:
-        if param_gll == "VS":
-            param = "VSV"
-        elif param_gll == "VP":
-            param = "VPV"
-        else:
-            param = param_gll
-        param_node = exodus.get_nodal_field(param)
+    exodus_names = {"VS": "VSV", "VP": "VPV"}
+    param_nodes = exodus.get_nodal_fields(
+        [exodus_names.get(param_gll, param_gll) for param_gll in params_gll])
+    for param_gll, param_node in zip(params_gll, param_nodes):
         for i in range(gll_points):
             if (i+1) % 10 == 0 or i == 124 or i == 0:
                 print(f"Putting values onto gll points: {i+1}/{gll_points} for "
@@ -238,8 +255,8 @@ def interpolate_mesh_to_gll(mesh, gll_model, gll_order, params=["TTI"]):
               required=True)
 @click.option('--gll_model', help="hdf5 mesh.",
               required=True)
-@click.option('--gll_order', help="Order of polynomials inside your gll "
-                                  "model", default=4)
+@click.option('--gll_order', help="Not used, the order of the polynomials "
+                                  "is taken from the gll model", default=4)
 # @click.option('--params', help="parameter to interpolate.", required=False,
 #               default=["TTI"], type=list)
 def interpolate_gll_to_mesh(mesh, gll_model, gll_order):
@@ -248,78 +265,40 @@ def interpolate_gll_to_mesh(mesh, gll_model, gll_order):
     interpolates them on to a nodal mesh
     :param mesh: name of meshfile
     :param gll_model: name of gll_model file
-    :param gll_order: order of lagrange polynomials
+    :param gll_order: not used, the order of the lagrange polynomials is
+    taken from the gll model
     """
 
     from multi_mesh.io.exodus import Exodus
-    from pykdtree.kdtree import KDTree
-    import h5py
-    import sys
-    import time
+    from multi_mesh.components.interpolator import gll_2_exodus_operator
+    from multi_mesh.io.gll_model import GLLModel
     start = time.time()
 
-    # Read in gll model
-    # gll = h5py.File(gll_model, 'r')
-    # Compute centroids
-    # if params == ["TTI"]:
-    #     params = ["VPV", "VPH", "VSV", "VSH", "RHO", "QKAPPA", "QMU", "ETA"]
     # Make sure that the data labels are in correct location.
     # 'MODEL' is sometimes 'ELASTIC'
-    with h5py.File(gll_model, 'r') as gll:
-        gll_points = gll['MODEL']['coordinates'][:]
-        gll_data = gll['MODEL']['data'][:]
-        params = gll["MODEL/data"].attrs.get("DIMENSION_LABELS")[1].decode()
-    centroids = _find_gll_centroids(gll_points, 3)
-    print("centroids", np.shape(centroids))
-    # Build a KDTree of the centroids to look for nearest elements
-    print("Building KDTree")
-    centroid_tree = KDTree(centroids)
+    with GLLModel(gll_model, model_path="MODEL/data") as gll:
+        gll_points = gll.read_coordinates()
+        gll_data = gll.read()
+        params = gll.labels
 
     nelem_to_search = 20
     # Read in mesh
     print("Read in mesh")
     exodus = Exodus(mesh, mode="a")
-    # Find nearest elements
-    print("Querying the KDTree")
-    _, nearest_element_indices = centroid_tree.query(exodus.points[:], k=nelem_to_search)
-    npoints = exodus.npoint
-    params = params[2:-2].replace(" ", "").split("|")
-    print(f"Parameters to interpolate: {params_gll}")
-    # sys.exit("Manual stop")
-    values = np.zeros(shape=[npoints, len(params_gll)])
-
-    # Temporary solution:
-    print("nearest_element_indices", np.shape(nearest_element_indices))
-    s = 0
-
-    for point in exodus.points[:]:
-        # print(f"Nearest element indices: {nearest_element_indices[s,:]}")
-        element, ref_coord = _check_if_inside_element(gll_points,
-                                           nearest_element_indices[s, :],
-                                           point)
-        coeffs = get_coefficients(4, 4, 4, ref_coord)
-        func = salvus_fem.tensor_gll.GetInterpolationCoefficients
-        i = 0
-
-        for param in params:
-            values[s, i] = np.sum(gll_data[element, i, :] * coeffs)
-            i += 1
-
-        if s % 20000 == 0:
-            print(s)
-        s += 1
+    print(f"Parameters to interpolate: {params}")
+    operator = gll_2_exodus_operator(gll_points, exodus.points,
+                                     gll_points.shape[-1], nelem_to_search)
+    values = operator.apply(gll_data)
 
-    i = 0
-    for param_gll in params:
+    fields = {}
+    for param_gll, value in zip(params, values):
         if param_gll == 'FemMassMatrix':
             continue
         if param_gll == "RHO":
             continue
 
-        param_exod = param_gll
-        exodus.attach_field(param_exod, np.zeros_like(values[:, i]))
-        exodus.attach_field(param_exod, values[:, i])
-        i += 1
+        fields[param_gll] = value
+    exodus.attach_fields(fields)
 
     end = time.time()
     runtime = end-start
@@ -331,72 +310,169 @@ def interpolate_gll_to_mesh(mesh, gll_model, gll_order):
         print(f"Finished in time: {runtime} seconds")
 
 
-def get_coefficients(a, b, c, ref_coord):
-    # return tensor_gll.GetInterpolationCoefficients(a, b, c, "Matrix", "Matrix", ref_coord)
-    # return salvus_fem._fcts[867][1](ref_coord)
-    return GetInterpolationCoefficients(ref_coord)
-    # return GetInterpolationCoefficients(4, 4, 4, "Matrix", "Matrix", ref_coord)
-
-def inverse_transform(point, gll_points):
-    # return hypercube.InverseCoordinateTransformWrapper(n=4, d=3, pnt=point,
-    #                                       ctrlNodes=gll_points)
-    return InverseCoordinateTransformWrapper(pnt=point, ctrlNodes=gll_points)
-    # return salvus_fem._fcts[29][1](pnt=point, ctrlNodes=gll_points)
-
-
-def _find_gll_centroids(gll_coordinates, dimensions):
+@cli.command()
+@click.option('--from_gll', help="hdf5 gll model to interpolate from.",
+              required=True)
+@click.option('--to_gll', help="hdf5 gll model to interpolate to.",
+              required=True)
+@click.option('--nelem_to_search', help="Amount of closest gll points to "
+                                        "consider.", default=20, type=int)
+@click.option('--workers', help="Amount of processes to locate the points "
+                                "with.", default=1, type=int)
+@click.option('--operator_file', help="Interpolation operator to use, it is "
+                                      "computed and saved there if it does "
+                                      "not exist.", default=None)
+@click.option('--cache_dir', help="Interpolation operator cache.",
+              default=None)
+@click.option('--memory_budget', help="Stream the models in chunks using "
+                                      "roughly this many GB instead of "
+                                      "loading them to memory. No "
+                                      "interpolation operators are used.",
+              default=None, type=float)
+@click.option('--precision', type=click.Choice(["double", "single"]),
+              default="double", help="Precision the values are stored and "
+                                     "interpolated in, the points are always "
+                                     "located in double precision.")
+@click.option('--changed_box', help="Only update the elements which depend "
+                                    "on this box of the source model, as "
+                                    "comma separated lower and upper "
+                                    "corners, e.g. x0,y0,z0,x1,y1,z1.",
+              default=None)
+@click.option('--previous_model', help="Only update the elements which "
+                                       "depend on source values which "
+                                       "differ from this previous source "
+                                       "model.", default=None)
+def interpolate_gll_to_gll(from_gll, to_gll, nelem_to_search, workers,
+                           operator_file, cache_dir, memory_budget,
+                           precision, changed_box, previous_model):
     """
-    A function to find the centroid coordinate of gll model
-    :param gll: gll model object
-    :param dimensions: 1, 2 or 3 dimensions
-    :return: array with 3 coordinates per element
+    Interpolate all the parameters of one gll model onto another one.
     """
+    from multi_mesh import api
+    from multi_mesh.components.region import Region
+
+    if memory_budget is not None:
+        memory_budget = int(memory_budget * 1024 ** 3)
+    region = None
+    if changed_box is not None and previous_model is not None:
+        raise click.UsageError("Give either --changed_box or "
+                               "--previous_model")
+    if changed_box is not None:
+        corners = [float(value) for value in changed_box.split(",")]
+        if len(corners) not in (4, 6):
+            raise click.UsageError("--changed_box needs the lower and upper "
+                                   "corner of the box")
+        half = len(corners) // 2
+        region = Region.box(corners[:half], corners[half:])
+    elif previous_model is not None:
+        region = Region.from_previous(previous_model)
+    api.gll_2_gll(from_gll, to_gll, nelem_to_search=nelem_to_search,
+                  operator_file=operator_file, cache_dir=cache_dir,
+                  workers=workers, memory_budget=memory_budget,
+                  precision=precision, region=region)
 
-    nelements = len(gll_coordinates[:, 0, 0])
 
-    if dimensions != len(gll_coordinates[0, 0, :]):
-        raise ValueError("Dimensions of GLL model not the same as input")
-    centroids = np.zeros(shape=[nelements, dimensions])
-
-    for d in range(dimensions):
-        centroids[:, d] = np.mean(gll_coordinates[:, :, d], axis=1, dtype=np.float64)
-
-    print("Found centroids")
-    return centroids
+@cli.command()
+@click.option('--master', help="hdf5 master model to sum the gradients on.",
+              required=True)
+@click.option('--gradient', 'gradients', help="hdf5 simulation gradient, "
+                                              "can be given many times.",
+              multiple=True)
+@click.option('--gradient_list', help="Text file with the path of one "
+                                      "simulation gradient per line.",
+              default=None)
+@click.option('--first/--add', help="Overwrite the gradient on the master "
+                                    "model or add the sum on top of it.",
+              default=True)
+@click.option('--nelem_to_search', help="Amount of closest elements to "
+                                        "consider.", default=25, type=int)
+@click.option('--workers', help="Amount of processes to locate the points "
+                                "with.", default=1, type=int)
+@click.option('--cache_dir', help="Interpolation operator cache.",
+              default=None)
+@click.option('--buffer_file', help="Sum in a memory mapped scratch file "
+                                    "instead of in memory.", default=None)
+@click.option('--precision', type=click.Choice(["double", "single"]),
+              default="double", help="Precision the values are stored and "
+                                     "interpolated in, the points are always "
+                                     "located in double precision.")
+def sum_gradients(master, gradients, gradient_list, first, nelem_to_search,
+                  workers, cache_dir, buffer_file, precision):
+    """
+    Interpolate the gradients of many simulations to the master model and
+    sum them up.
+    """
+    from multi_mesh import api
+
+    gradients = list(gradients)
+    if gradient_list is not None:
+        with open(gradient_list) as f:
+            gradients += [line.strip() for line in f if line.strip()]
+    if not gradients:
+        raise click.UsageError("Give at least one gradient")
+    api.sum_gll_gradients(gradients, master, first=first,
+                          nelem_to_search=nelem_to_search,
+                          cache_dir=cache_dir, workers=workers,
+                          buffer_file=buffer_file, precision=precision)
+
+
+@cli.group()
+def cache():
+    """
+    Inspect and prune the cache of interpolation operators.
+    """
+    pass
 
 
-def _check_if_inside_element(gll_model, nearest_elements, point):
+@cache.command(name="list")
+@click.option('--cache_dir', help="Cache directory, defaults to the "
+                                  "MULTI_MESH_CACHE_DIR environment variable",
+              default=None)
+def list_cache(cache_dir):
     """
-    A function to figure out inside which element the point to be interpolated is.
-    :param gll: gll model
-    :param nearest_elements: nearest elements of the point
-    :param point: The actual point
-    :return: the Index of the element which point is inside
+    List the cached interpolation operators, most recently used first.
     """
-    point = np.asfortranarray(point)
-    ref_coords = np.zeros(len(nearest_elements))
-    l = 0
-    for element in nearest_elements:
-        gll_points = gll_model[element, :, :]
-        gll_points = np.asfortranarray(gll_points)
-
-        # ref_coord = salvus_fem._fcts[29][1](pnt=point, ctrlNodes=gll_points)
-        ref_coord = inverse_transform(point=point, gll_points=gll_points)
-        ref_coords[l] = np.sum(np.abs(ref_coord))
-        l += 1
-
-        if not np.any(np.abs(ref_coord) > 1.02):
-            return element, ref_coord
-
-    ind = np.where(ref_coords == np.min(ref_coords))[0][0]
-    element = nearest_elements[ind]
-    ref_coord = inverse_transform(point=point, gll_points=np.asfortranarray(
-                                            gll_model[element, :, :]))
-    print(f"didn't find a good fit. ref_coord: {ref_coord}")
-    return element, ref_coord
-    # raise IndexError("Could not find an element which this points fits into."
-    #                  " Maybe you should add some tolerance")
-
+    from multi_mesh.components.cache import OperatorCache
+
+    operator_cache = OperatorCache(cache_dir)
+    entries = operator_cache.entries()
+    for entry in entries:
+        last_used = time.strftime("%Y-%m-%d %H:%M:%S",
+                                  time.localtime(entry["last_used"]))
+        print(f"{entry['key']}  {entry['size'] / 1024 ** 2:10.1f} MB  "
+              f"{last_used}  {entry.get('kind', '')}  "
+              f"{entry.get('source', '')} -> {entry.get('target', '')}")
+    total = sum(entry["size"] for entry in entries)
+    print(f"{len(entries)} operators, {total / 1024 ** 3:.2f} GB of "
+          f"{operator_cache.max_size / 1024 ** 3:.2f} GB in "
+          f"{operator_cache.directory}")
+
+
+@cache.command()
+@click.option('--cache_dir', help="Cache directory, defaults to the "
+                                  "MULTI_MESH_CACHE_DIR environment variable",
+              default=None)
+@click.option('--max_size', help="Evict the least recently used operators "
+                                 "until the cache is smaller than this many "
+                                 "GB. Defaults to the size cap of the cache.",
+              default=None, type=float)
+@click.option('--all', 'remove_all', help="Empty the cache.", is_flag=True)
+def prune(cache_dir, max_size, remove_all):
+    """
+    Remove interpolation operators from the cache.
+    """
+    from multi_mesh.components.cache import OperatorCache
+
+    operator_cache = OperatorCache(cache_dir)
+    if remove_all:
+        max_size = 0
+    elif max_size is not None:
+        max_size = int(max_size * 1024 ** 3)
+    removed = operator_cache.prune(max_size)
+    for key in removed:
+        print(f"Removed {key}")
+    print(f"Removed {len(removed)} operators, "
+          f"{operator_cache.size() / 1024 ** 3:.2f} GB left")
 
 
 # gll_model = "/home/solvi/workspace/InterpolationTests/smoothiesem_nlat08.h5"
@@ -3,6 +3,9 @@
 
 #include <stdio.h>
 #include <math.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 // Global variables
 const double mNodesR[] = {-1, -1, +1, +1, -1, +1, +1, -1};
@@ -45,7 +48,8 @@ long long int triLinearInterpolator(
         long long int *enclosing_elem_indices,  // element indices of the enclosing element [npoints, nNodes]
         double* nodes,                          // nodes with shape [npoints_mesh, 3]
         double* weights,                        // matrix [npoints, nNodes] containg interpolation weights
-        double* points)                         // points that require interpolation
+        double* points,                         // points that require interpolation
+        long long int nthreads)                 // number of OpenMP threads, <= 0 uses the OpenMP default
 {
     long long int i, j, k, l, m, n, idx, ii;
     double vtx[8][3];
@@ -58,6 +62,17 @@ long long int triLinearInterpolator(
 
     long long int elem_number;
     long long int best_elem_number;
+    int threads = 1;
+
+#ifdef _OPENMP
+    threads = nthreads > 0 ? (int) nthreads : omp_get_max_threads();
+#endif
+
+    // Every point is independent, the buffers are private to each thread.
+    #pragma omp parallel for num_threads(threads) schedule(dynamic, 256) \
+        private(i, j, k, l, m, n, idx, ii, vtx, pnt, solution, interpolator, \
+                max_error, smallest_error, elem_number, best_elem_number) \
+        reduction(+:npoints_failed)
     for (i=0; i<npoints; i = i + 1)
     {
         for (m = 0; m < nDim; m = m + 1)
@@ -68,6 +83,9 @@ long long int triLinearInterpolator(
         for (j = 0; j < nelem_to_search; j = j + 1){
             // Get element number from list of nearest elements
             elem_number = nearest_element_indices[i * nelem_to_search + j];
+            // Candidate lists of different lengths are padded with -1
+            if (elem_number < 0)
+                goto next_candidate;
             for (k = 0; k < nNodes; k = k + 1)
             {
                 idx = connectivity[elem_number * nNodes + k];       // get node number for each node
@@ -100,20 +118,17 @@ long long int triLinearInterpolator(
                 }
 
                 break; //interpolation weights found, go to next point
-//                printf("after %d\n", j);
             }
             else if (max_error < smallest_error)
             {
                 smallest_error = max_error;
                 best_elem_number = elem_number;
-//                printf("%d place 1 ", best_elem_number);
             }
 
             }
+            next_candidate:
             if  ((j == nelem_to_search - 1) && (smallest_error < 1.5) && (best_elem_number >= 0))
             {
-//            printf("smallest_error %f\n", smallest_error);
-//            printf("%d place 2 ", best_elem_number);
             for (k = 0; k < nNodes; k = k + 1){
                 idx = connectivity[best_elem_number * nNodes + k];       // get node number for each node
                 for (l = 0; l < nDim; l = l + 1)
@@ -131,14 +146,10 @@ long long int triLinearInterpolator(
                 }
                 }
                 else {
-                printf("not any %f\n", smallest_error);
                 npoints_failed = npoints_failed + 1; // count number of points that failed
                 }
             }
             else if (j == nelem_to_search - 1){
-//            printf("before %f\n", max_error);
-//            printf("before %f\n", smallest_error);
-                printf("not any %f\n", smallest_error);
                 npoints_failed = npoints_failed + 1;
 
             }
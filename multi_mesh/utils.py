@@ -2,9 +2,8 @@
 A few functions to help out with specific tasks
 """
 import numpy as np
-from pyexodus import exodus
 from multi_mesh.io.exodus import Exodus
-import h5py
+from multi_mesh.io.gll_model import GLLModel, parameter_label
 
 
 def get_rot_matrix(angle, x, y, z):
@@ -15,25 +14,9 @@ def get_rot_matrix(angle, x, y, z):
     :param z: z-component of rotational vector
     :return: Rotational Matrix
     """
-    # Normalize vector.
-    norm = np.sqrt(x ** 2 + y ** 2 + z ** 2)
-    x /= norm
-    y /= norm
-    z /= norm
+    from multi_mesh.components.rotation import rotation_matrix
 
-    # Setup matrix components.
-    matrix = np.empty((3, 3))
-    matrix[0, 0] = np.cos(angle) + (x ** 2) * (1 - np.cos(angle))
-    matrix[1, 0] = z * np.sin(angle) + x * y * (1 - np.cos(angle))
-    matrix[2, 0] = (-1) * y * np.sin(angle) + x * z * (1 - np.cos(angle))
-    matrix[0, 1] = x * y * (1 - np.cos(angle)) - z * np.sin(angle)
-    matrix[1, 1] = np.cos(angle) + (y ** 2) * (1 - np.cos(angle))
-    matrix[2, 1] = x * np.sin(angle) + y * z * (1 - np.cos(angle))
-    matrix[0, 2] = y * np.sin(angle) + x * z * (1 - np.cos(angle))
-    matrix[1, 2] = (-1) * x * np.sin(angle) + y * z * (1 - np.cos(angle))
-    matrix[2, 2] = np.cos(angle) + (z * z) * (1 - np.cos(angle))
-
-    return matrix
+    return rotation_matrix(angle, [x, y, z])
 
 
 def rotate(x, y, z, matrix):
@@ -49,56 +32,65 @@ def rotate(x, y, z, matrix):
     return matrix.dot(np.array([x, y, z]))
 
 
-def rotate_mesh(mesh, event_loc, backwards=False):
+def rotate_mesh(mesh, event_loc, backwards=False, chunk_size=None):
     """
     Rotate the coordinates of a mesh to make the source show up below
     the North Pole of the mesh. Can also be used to rotate backwards.
+    Works on exodus meshes and gll models, in place and in chunks, see
+    multi_mesh.components.rotation to compose several rotations.
     :param mesh: filename of mesh to be rotated
     :param event_loc: location of event to be rotated to N [lat, lon]
     :param backwards: Backrotation uses transpose of rot matrix
+    :param chunk_size: Elements (gll) or nodes (exodus) rotated at once
     """
+    from multi_mesh.components import rotation
 
-    event_vec = [np.cos(event_loc[0]) * np.cos(event_loc[1]),
-                 np.cos(event_loc[0]) * np.sin(event_loc[1]),
-                 np.sin(event_loc[0])]
-    event_vec = np.array(event_vec) / np.linalg.norm(event_vec)
-    north_vec = np.array([0.0, 0.0, 1.0])
-
-    rotate_axis = np.cross(event_vec, north_vec)
-    rotate_axis /= np.linalg.norm(rotate_axis)
-    # Make sure that both axis and angle make sense with r-hand-rule
-    rot_angle = np.arccos(np.dot(event_vec, north_vec))
-    rot_mat = get_rot_matrix(rot_angle, rotate_axis[0], rotate_axis[1],
-                             rotate_axis[2])
-    if backwards:
-        rot_mat = rot_mat.T
-
-    mesh = exodus(mesh, mode="a")
-    points = mesh.get_coords()
-    rotated_points = rotate(x=points[0], y=points[1],
-                            z=points[2], matrix=rot_mat)
-    rotated_points = rotated_points.T
-
-    mesh.put_coords(rotated_points[:, 0], rotated_points[:, 1],
-                    rotated_points[:, 2])
+    rotation.rotate_mesh(mesh, rotation.event_rotation(event_loc, backwards),
+                         chunk_size=chunk_size)
 
     # It's not rotating in the right direction but that remains to be
     # configured properly.
 
 
+def value_dtype(precision="double"):
+    """
+    The dtype of the field values for a precision. Coordinates are always
+    kept in double precision, single precision only applies to the values
+    of models and gradients, which are not more accurate than about six
+    digits anyway.
+    :param precision: "double" or "single"
+    """
+    dtypes = {"double": np.float64, "single": np.float32}
+    if precision not in dtypes:
+        raise ValueError(f"Unknown precision {precision}, use one of "
+                         f"{sorted(dtypes)}")
+    return dtypes[precision]
+
+
 def remove_and_create_empty_dataset(gll_model, parameters: list,
-                                    model: str, coordinates: str):
+                                    model: str, coordinates: str,
+                                    chunks=None, compression=None,
+                                    compression_opts=None, dtype=np.float64):
     """
     Take gll dataset, delete it and create an empty one ready for the new
     set of parameters that are to be input to the mesh.
+    :param chunks: HDF5 chunking of the new dataset. An integer is the
+    amount of elements per chunk, every chunk holding all the parameters
+    and points of its elements. Anything else is passed on to h5py.
+    :param compression: HDF5 compression filter, e.g. "gzip" or "lzf"
+    :param compression_opts: Settings of the compression filter
+    :param dtype: dtype of the values, see value_dtype
     """
     if model in gll_model:
         del gll_model[model]
-    gll_model.create_dataset(name=model,
-                             shape=(gll_model[coordinates].shape[0],
-                                    len(parameters),
-                                    gll_model[coordinates].shape[1]),
-                             dtype=np.float64)
+    shape = (gll_model[coordinates].shape[0], len(parameters),
+             gll_model[coordinates].shape[1])
+    if isinstance(chunks, (int, np.integer)) and \
+            not isinstance(chunks, bool):
+        chunks = (min(int(chunks), shape[0]),) + shape[1:]
+    gll_model.create_dataset(name=model, shape=shape, dtype=dtype,
+                             chunks=chunks, compression=compression,
+                             compression_opts=compression_opts)
 
     create_dimension_labels(gll_model, parameters)
 
@@ -109,7 +101,7 @@ def create_dimension_labels(gll, parameters: list):
     :param gll_model: The gll mesh which needs the new dimstring
     :param parameters: The parameters which should be in the dimstring
     """
-    dimstr = '[ ' + ' | '.join(parameters) + ' ]'
+    dimstr = parameter_label(parameters)
     gll['MODEL/data'].dims[0].label = 'element'
     gll['MODEL/data'].dims[1].label = dimstr
     gll['MODEL/data'].dims[2].label = 'point'
@@ -135,22 +127,27 @@ def load_exodus(file: str, find_centroids=True):
 
     exodus = Exodus(file)
     if find_centroids:
+        from scipy.spatial import cKDTree
+
         centroids = exodus.get_element_centroid()
-        centroid_tree = KDTree(centroids)
+        centroid_tree = cKDTree(centroids)
         return exodus, centroid_tree
     else:
         return exodus
 
 
-def load_hdf5_params_to_memory(gll: str, model: str, coordinates: str):
+def load_hdf5_params_to_memory(gll: str, model: str, coordinates: str,
+                               dtype=None):
     """
     Load coordinates, data and parameter list from and hdf5 file into memory
+    :param dtype: Read the data as this dtype, as stored if None. The
+    coordinates are always read in double precision.
     """
 
-    with h5py.File(gll, 'r') as mesh:
-        points = np.array(mesh[coordinates][:], dtype=np.float64)
-        data = mesh[model][:]
-        params = mesh[model].attrs.get("DIMENSION_LABELS")[1].decode()
-        params = params[2:-2].replace(" ", "").replace("grad", "").split("|")
+    with GLLModel(gll, model_path=model, coordinates_path=coordinates,
+                  dtype=dtype) as mesh:
+        points = mesh.read_coordinates()
+        data = mesh.read()
+        params = mesh.parameters
 
     return points, data, params
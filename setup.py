@@ -1,16 +1,23 @@
 import os
 
-from setuptools import find_packages
-from numpy.distutils.core import setup, Extension
+from setuptools import find_packages, setup, Extension
 
 
-#src = os.path.join("multi_mesh", 'src')
-#lib = Extension('multi_mesh',
-#                sources=[
-#                    os.path.join(src, "centroid.c"),
-#                    os.path.join(src, "trilinearinterpolator.c")],
-#                extra_compile_args=["-O3", "-fopenmp"],
-#                extra_link_args=['-lgomp'])
+# The C code is a plain shared library loaded with ctypes by
+# multi_mesh.helpers.load_lib. Set MULTI_MESH_NO_OPENMP to build it without
+# OpenMP, e.g. with compilers that do not support it.
+if os.environ.get("MULTI_MESH_NO_OPENMP"):
+    openmp_compile_args, openmp_link_args = [], []
+else:
+    openmp_compile_args, openmp_link_args = ["-fopenmp"], ["-fopenmp"]
+
+src = os.path.join("multi_mesh", 'src')
+lib = Extension('multi_mesh',
+                sources=[
+                    os.path.join(src, "centroid.c"),
+                    os.path.join(src, "trilinearinterpolator.c")],
+                extra_compile_args=["-O3"] + openmp_compile_args,
+                extra_link_args=openmp_link_args)
 
 
 def readme():
@@ -42,7 +49,7 @@ setup(
     entry_points='''
     [console_scripts]
     multi_mesh=multi_mesh.scripts.cli:cli
-    '''
-    #ext_package='multi_mesh.lib',
-    #ext_modules=[lib]
+    ''',
+    ext_package='multi_mesh.lib',
+    ext_modules=[lib]
 )
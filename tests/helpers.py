@@ -0,0 +1,73 @@
+"""
+Linear fields on the synthetic meshes of the benchmarks. Every
+interpolation in multi_mesh reproduces fields which are linear in the
+coordinates exactly, also on deformed elements, which makes them a sharp
+check of the point location and the interpolation weights.
+"""
+import h5py
+import numpy as np
+
+from benchmarks import meshes
+from multi_mesh.io.exodus import Exodus
+
+TOLERANCE = 1e-8
+
+
+def linear_values(points, nparameters):
+    """
+    Values linear in the coordinates, one row per parameter, all well
+    above zero so none of them looks like a fluid.
+
+    :param points: Points [..., dimension]
+    :return: Values [nparameters, ...]
+    """
+    x = np.moveaxis(points, -1, 0)
+    return np.stack([10.0 + i + (i + 1) * x[0] - 2.0 * x[1] +
+                     0.5 * x[-1] * (x.shape[0] == 3) for i in
+                     range(nparameters)])
+
+
+def write_linear_gll(filename, coordinates, parameters=meshes.ISO_PARAMETERS):
+    """
+    Write a gll model whose values are linear fields.
+    """
+    meshes.write_gll_model(filename, coordinates, parameters)
+    with h5py.File(filename, "r+") as f:
+        f["MODEL/data"][:] = linear_values(
+            coordinates, len(parameters)).transpose(1, 0, 2)
+
+
+def write_linear_exodus(filename, points, connectivity,
+                        parameters=meshes.ISO_PARAMETERS):
+    """
+    Write an exodus mesh whose nodal fields are linear fields.
+    """
+    meshes.write_exodus(filename, points, connectivity, parameters)
+    exodus = Exodus(filename, mode="a")
+    exodus.attach_fields(dict(zip(parameters,
+                                  linear_values(points, len(parameters)))))
+
+
+def write_linear_gradient(filename, coordinates,
+                          parameters=("RHO", "VP", "VS", "MassMatrix"),
+                          scale=1.0):
+    """
+    Write a gradient in the layout of salvus simulation output, with scale
+    times linear fields as its values.
+    """
+    with h5py.File(filename, "w") as f:
+        f["ELASTIC/coordinates"] = coordinates
+        data = f.create_dataset("ELASTIC/data", data=scale * linear_values(
+            coordinates, len(parameters)).transpose(1, 0, 2)[np.newaxis])
+        labels = ["time", "element", "[ " + " | ".join(
+            "grad" + param for param in parameters) + " ]", "point"]
+        for i, label in enumerate(labels):
+            data.dims[i].label = label
+
+
+def read_gll(filename):
+    """
+    Coordinates and values of a gll model.
+    """
+    with h5py.File(filename, "r") as f:
+        return f["MODEL/coordinates"][:], f["MODEL/data"][:]
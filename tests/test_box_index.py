@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh.components.box_index import ElementBoxIndex
+
+
+def random_boxes(dimension, seed=0):
+    """
+    Many small boxes and a few which span most of the domain, like a mesh
+    with some very large elements.
+    """
+    rng = np.random.default_rng(seed)
+    lower = rng.random((500, dimension))
+    size = np.where(np.arange(500)[:, np.newaxis] % 100 == 0,
+                    rng.uniform(0.5, 0.9, (500, dimension)),
+                    rng.uniform(0.02, 0.1, (500, dimension)))
+    return lower, lower + size
+
+
+def brute_force(points, lower, upper):
+    return [set(np.flatnonzero(np.all((point >= lower) & (point <= upper),
+                                      axis=1))) for point in points]
+
+
+@pytest.mark.parametrize("dimension", [2, 3])
+def test_query_with_large_elements(dimension):
+    lower, upper = random_boxes(dimension)
+    index = ElementBoxIndex(lower, upper, max_cells_per_element=8)
+    assert index._large_index is not None
+    assert 0 < index._large.size < 500
+    points = np.random.default_rng(1).uniform(0.0, 1.2, (2000, dimension))
+
+    candidates = index.query(points, fallback=0, chunk_size=300)
+
+    expected = brute_force(points, lower, upper)
+    assert any(expected[i] & set(index._large) for i in range(len(points)))
+    for i, point in enumerate(points):
+        found = candidates[i][candidates[i] >= 0]
+        assert set(found) == expected[i]
+        assert len(found) == len(expected[i])
+        distance = np.sum((point - (lower[found] + upper[found]) / 2.0) ** 2,
+                          axis=1)
+        assert np.all(np.diff(distance) >= 0)
+
+
+def test_capping_large_elements_keeps_the_results():
+    lower, upper = random_boxes(3, seed=2)
+    points = np.random.default_rng(3).uniform(0.0, 1.0, (1000, 3))
+    capped = ElementBoxIndex(lower, upper)
+    uncapped = ElementBoxIndex(lower, upper, max_cells_per_element=10 ** 9)
+    assert uncapped._large_index is None
+    assert capped._elements.size < uncapped._elements.size
+    np.testing.assert_array_equal(capped.query(points),
+                                  uncapped.query(points))
+
+
+def test_points_outside_all_boxes_get_the_nearest_elements():
+    coordinates = meshes.gll_coordinates(4, order=2)
+    index = ElementBoxIndex.from_elements(coordinates)
+    points = np.array([[1.5, 0.1, 0.1], [-0.5, 0.9, 0.4]])
+
+    candidates = index.query(points, fallback=3)
+
+    np.testing.assert_array_equal(candidates, index.nearest(points, 3))
+    centres = coordinates.mean(axis=1)
+    for point, nearest in zip(points, candidates):
+        distance = np.sum((centres - point) ** 2, axis=1)
+        assert set(nearest) == set(np.argsort(distance)[:3])
@@ -0,0 +1,54 @@
+import os
+
+import h5py
+import numpy as np
+
+from benchmarks import meshes
+from multi_mesh import api
+from multi_mesh.components.cache import OperatorCache
+from multi_mesh.components.operator import InterpolationOperator
+
+from tests.helpers import write_linear_gll, write_linear_gradient
+
+
+def small_operator(nelem):
+    return InterpolationOperator.from_elements(
+        np.arange(nelem), np.full((nelem, 8), 0.125), source_shape=(nelem, 8),
+        target_shape=(nelem,))
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    cache = OperatorCache(str(tmp_path), max_size=10 ** 9)
+    for age, key in enumerate(["new", "old", "older"]):
+        cache.put(key, small_operator(100))
+        os.utime(cache._operator_file(key), (1e9 - age, 1e9 - age))
+    assert cache.get("older") is not None
+    size = cache.entries()[0]["size"]
+
+    assert cache.prune(max_size=2 * size) == ["old"]
+    assert [entry["key"] for entry in cache.entries()] == ["older", "new"]
+    assert cache.prune(max_size=0, keep="new") == ["older"]
+    assert cache.prune(max_size=0) == ["new"]
+    assert cache.entries() == []
+
+
+def test_models_and_gradients_share_operators(tmp_path):
+    source_coordinates = meshes.gll_coordinates(
+        3, deformation=0.05).astype(np.float32)
+    target_coordinates = meshes.gll_coordinates(
+        4, deformation=0.02).astype(np.float32)
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    gradient, master = str(tmp_path / "gradient.h5"), \
+        str(tmp_path / "master.h5")
+    write_linear_gll(source, source_coordinates)
+    write_linear_gll(target, target_coordinates)
+    write_linear_gradient(gradient, source_coordinates)
+    write_linear_gradient(master, target_coordinates)
+    with h5py.File(target, "r") as f:
+        assert f["MODEL/coordinates"].dtype == np.float32
+
+    cache_dir = str(tmp_path / "cache")
+    api.gll_2_gll(source, target, nelem_to_search=25, cache_dir=cache_dir)
+    api.sum_gll_gradients([gradient], master, cache_dir=cache_dir)
+
+    assert len(OperatorCache(cache_dir).entries()) == 1
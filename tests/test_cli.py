@@ -0,0 +1,108 @@
+import json
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+from click.testing import CliRunner
+
+from benchmarks import meshes
+from multi_mesh.io.exodus import Exodus
+from multi_mesh.scripts.cli import cli
+
+from tests.helpers import (TOLERANCE, linear_values, read_gll,
+                           write_linear_gll, write_linear_gradient)
+
+
+def invoke(*args):
+    result = CliRunner().invoke(cli, list(args))
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def test_interpolate_gll_to_mesh(tmp_path):
+    source, mesh = str(tmp_path / "source.h5"), str(tmp_path / "mesh.e")
+    write_linear_gll(source, meshes.gll_coordinates(3, order=2,
+                                                    deformation=0.05))
+    points, connectivity = meshes.exodus_hex_mesh(5, deformation=0.03)
+    meshes.write_exodus(mesh, points, connectivity, meshes.ISO_PARAMETERS)
+
+    invoke("interpolate-gll-to-mesh", "--mesh", mesh, "--gll_model", source)
+
+    expected = dict(zip(meshes.ISO_PARAMETERS, linear_values(points, 5)))
+    del expected["RHO"]
+    values = Exodus(mesh).get_nodal_fields(list(expected))
+    np.testing.assert_allclose(values, list(expected.values()),
+                               atol=TOLERANCE)
+
+
+def test_loading_the_cli_does_not_import_the_interpolation():
+    code = ("import sys, multi_mesh.scripts.cli; print(sorted(m for m in "
+            "('numpy', 'h5py', 'scipy', 'multi_mesh.api') if m in "
+            "sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "[]"
+    assert "interpolate-gll-to-gll" in invoke("--help").output
+
+
+def test_interpolate_gll_to_gll_with_stats_and_cache(tmp_path):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    cache_dir, stats_file = str(tmp_path / "cache"), str(tmp_path / "s.json")
+    write_linear_gll(source, meshes.gll_coordinates(3, deformation=0.05))
+    meshes.write_gll_model(target, meshes.gll_coordinates(2, order=2))
+
+    for _ in range(2):
+        invoke("--stats-file", stats_file, "interpolate-gll-to-gll",
+               "--from_gll", source, "--to_gll", target,
+               "--cache_dir", cache_dir)
+
+    with open(stats_file) as f:
+        assert json.load(f)["counters"]["operator_cache_hits"] == 1
+    coordinates, values = read_gll(target)
+    np.testing.assert_allclose(
+        values, linear_values(coordinates, 5).transpose(1, 0, 2),
+        atol=TOLERANCE)
+
+    listed = invoke("cache", "list", "--cache_dir", cache_dir).output
+    assert "1 operators" in listed
+    pruned = invoke("cache", "prune", "--cache_dir", cache_dir, "--all")
+    assert "Removed 1 operators" in pruned.output
+    assert "0 operators" in invoke("cache", "list", "--cache_dir",
+                                   cache_dir).output
+
+
+def test_interpolate_gll_to_gll_rejects_two_regions(tmp_path):
+    result = CliRunner().invoke(cli, [
+        "interpolate-gll-to-gll", "--from_gll", "a.h5", "--to_gll", "b.h5",
+        "--changed_box", "0,0,0,1,1,1", "--previous_model", "c.h5"])
+    assert result.exit_code != 0
+    assert "either --changed_box or --previous_model" in result.output
+
+
+def test_sum_gradients(tmp_path):
+    master = str(tmp_path / "master.h5")
+    master_coordinates = meshes.gll_coordinates(2, deformation=0.02)
+    write_linear_gradient(master, master_coordinates)
+    gradients = []
+    for i in range(3):
+        gradients.append(str(tmp_path / f"gradient_{i}.h5"))
+        write_linear_gradient(gradients[-1],
+                              meshes.gll_coordinates(3, deformation=0.05),
+                              scale=i + 1.0)
+    gradient_list = str(tmp_path / "gradients.txt")
+    with open(gradient_list, "w") as f:
+        f.write("\n".join(gradients[1:]) + "\n\n")
+
+    invoke("sum-gradients", "--master", master, "--gradient", gradients[0],
+           "--gradient_list", gradient_list)
+
+    with h5py.File(master, "r") as f:
+        summed = f["ELASTIC/data"][0]
+    # The gradients of VP and VS, 1 + 2 + 3 times the linear fields
+    expected = 6.0 * linear_values(master_coordinates, 4)[1:3]
+    np.testing.assert_allclose(summed, expected.transpose(1, 0, 2),
+                               rtol=1e-6)
+    result = CliRunner().invoke(cli, ["sum-gradients", "--master", master])
+    assert result.exit_code != 0
+    assert "at least one gradient" in result.output
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh import api
+from multi_mesh.io.exodus import Exodus
+
+from tests.helpers import TOLERANCE, linear_values, write_linear_exodus
+
+FIELDS = ["VP", "VS"]
+
+
+def write_meshes(tmp_path, weights):
+    points, connectivity = meshes.exodus_hex_mesh(3, deformation=0.05)
+    collection = str(tmp_path / "collection.e")
+    write_linear_exodus(collection, points, connectivity, FIELDS)
+    added = []
+    for i in range(len(weights)):
+        added.append(str(tmp_path / f"added_{i}.e"))
+        meshes.write_exodus(added[-1], points, connectivity, FIELDS)
+        Exodus(added[-1], mode="a").attach_fields(dict(zip(
+            FIELDS, (i + 1.0) * linear_values(points, len(FIELDS)))))
+    return collection, added, linear_values(points, len(FIELDS))
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+@pytest.mark.parametrize("first", [True, False])
+def test_weighted_sum_exodus_fields(tmp_path, threads, first):
+    weights = [0.5, -1.0, 2.0, 1.0]
+    collection, added, values = write_meshes(tmp_path, weights)
+
+    api.weighted_sum_exodus_fields(collection, added, FIELDS,
+                                   weights=weights, first=first,
+                                   threads=threads)
+
+    # 0.5 * 1 - 1 * 2 + 2 * 3 + 1 * 4 and the collection mesh itself
+    factor = 8.5 if first else 9.5
+    np.testing.assert_allclose(Exodus(collection).get_nodal_fields(FIELDS),
+                               factor * values, atol=TOLERANCE)
+
+
+def test_sum_exodus_fields_adds_one_mesh(tmp_path):
+    collection, added, values = write_meshes(tmp_path, [1.0])
+    api.sum_exodus_fields(collection, added[0], FIELDS, first=False)
+    np.testing.assert_allclose(Exodus(collection).get_nodal_fields(FIELDS),
+                               2.0 * values, atol=TOLERANCE)
+
+
+def test_weighted_sum_exodus_fields_errors(tmp_path):
+    collection, added, _ = write_meshes(tmp_path, [1.0])
+    with pytest.raises(ValueError, match="one weight"):
+        api.weighted_sum_exodus_fields(collection, added, FIELDS,
+                                       weights=[1.0, 2.0])
+
+    other = str(tmp_path / "other.e")
+    meshes.write_exodus(other, *meshes.exodus_hex_mesh(2), FIELDS)
+    with pytest.raises(ValueError, match="same nodes"):
+        api.weighted_sum_exodus_fields(collection, added + [other], FIELDS)
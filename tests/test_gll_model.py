@@ -0,0 +1,113 @@
+import h5py
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh.io.gll_model import (GLLModel, label_parameters,
+                                     parse_parameters, parameter_label)
+
+from tests.helpers import write_linear_gradient
+
+
+@pytest.fixture
+def model(tmp_path):
+    filename = str(tmp_path / "model.h5")
+    meshes.write_gll_model(filename, meshes.gll_coordinates(3, order=2))
+    with h5py.File(filename, "r+") as f:
+        # Chunked values, so writes have to line up with the chunks
+        data = f["MODEL/data"][:]
+        labels = f["MODEL/data"].attrs["DIMENSION_LABELS"]
+        del f["MODEL/data"]
+        f.create_dataset("MODEL/data", data=data, chunks=(4, 5, 27))
+        f["MODEL/data"].attrs["DIMENSION_LABELS"] = labels
+    return filename
+
+
+def stored(filename):
+    with h5py.File(filename, "r") as f:
+        return f["MODEL/data"][:]
+
+
+def test_parse_parameters():
+    assert parse_parameters(b"[ RHO | VP | VS ]") == ["RHO", "VP", "VS"]
+    assert parse_parameters("[ gradVP | gradVS ]") == ["VP", "VS"]
+    assert parse_parameters("[ gradVP ]", strip_grad=False) == ["gradVP"]
+    assert parse_parameters(parameter_label(["A", "B"])) == ["A", "B"]
+    with pytest.raises(ValueError):
+        parse_parameters("element")
+
+
+@pytest.mark.parametrize("elements", [None, slice(2, 20), [1, 4, 5, 26]])
+@pytest.mark.parametrize("parameters", [None, ["VS", "RHO"],
+                                        ["QMU", "VP", "QKAPPA"]])
+def test_read(model, elements, parameters):
+    data = stored(model)
+    with GLLModel(model, dtype=np.float32) as gll:
+        assert gll.parameters == meshes.ISO_PARAMETERS
+        values = gll.read(elements, parameters)
+        coordinates = gll.read_coordinates(elements)
+
+    index = slice(None) if elements is None else elements
+    columns = [meshes.ISO_PARAMETERS.index(param)
+               for param in parameters or meshes.ISO_PARAMETERS]
+    assert values.dtype == np.float32
+    np.testing.assert_array_equal(
+        values, data[index][:, columns].astype(np.float32))
+    assert coordinates.dtype == np.float64
+    assert coordinates.shape == (values.shape[0], 27, 3)
+
+
+@pytest.mark.parametrize("elements", [None, slice(3, 22), [0, 1, 2, 9, 17,
+                                                           18, 26]])
+@pytest.mark.parametrize("parameters", [None, ["VS", "QKAPPA"],
+                                        ["RHO"]])
+def test_write(model, elements, parameters):
+    data = stored(model)
+    index = slice(None) if elements is None else elements
+    columns = [meshes.ISO_PARAMETERS.index(param)
+               for param in parameters or meshes.ISO_PARAMETERS]
+    nelem = data[index].shape[0]
+    values = np.random.default_rng(0).random((nelem, len(columns), 27))
+
+    with GLLModel(model, "r+") as gll:
+        # A buffer of a few elements, so the values are written in pieces
+        gll.write(values, elements, parameters, buffer_bytes=6 * 1000)
+
+    expected = data.copy()
+    rows = np.arange(27)[index]
+    expected[np.ix_(rows, columns)] = values
+    np.testing.assert_array_equal(stored(model), expected)
+
+
+def test_write_errors(model):
+    with GLLModel(model, "r+") as gll:
+        with pytest.raises(ValueError, match="not unique"):
+            gll.write(np.zeros((27, 2, 27)), parameters=["VS", "VS"])
+        with pytest.raises(ValueError, match="does not have"):
+            gll.write(np.zeros((27, 1, 27)), parameters=["ETA"])
+        with pytest.raises(ValueError, match="do not fit"):
+            gll.write(np.zeros((27, 2, 27)), parameters=["VS"])
+        with pytest.raises(ValueError, match="increasing"):
+            gll.write(np.zeros((2, 5, 27)), elements=[3, 1])
+    with GLLModel(model) as gll:
+        with pytest.raises(AssertionError):
+            gll.write(np.zeros((27, 5, 27)))
+
+
+def test_gradients_hide_the_time_axis(tmp_path):
+    filename = str(tmp_path / "gradient.h5")
+    coordinates = meshes.gll_coordinates(2)
+    write_linear_gradient(filename, coordinates)
+    with h5py.File(filename, "r") as f:
+        data = f["ELASTIC/data"][0]
+        assert label_parameters(f["ELASTIC/data"]) == \
+            ["RHO", "VP", "VS", "MassMatrix"]
+
+    with GLLModel(filename) as gll:
+        assert gll.model_path == "ELASTIC/data"
+        assert gll.labels == ["gradRHO", "gradVP", "gradVS",
+                              "gradMassMatrix"]
+        np.testing.assert_array_equal(gll.read([1, 5], ["VS", "VP"]),
+                                      data[[1, 5]][:, [2, 1]])
+        np.testing.assert_array_equal(gll.solid_elements(),
+                                      np.ones(8, dtype=bool))
@@ -0,0 +1,185 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh import api
+from multi_mesh.components.region import Region
+from multi_mesh.io.exodus import Exodus
+
+from tests.helpers import (TOLERANCE, linear_values, read_gll,
+                           write_linear_exodus, write_linear_gll,
+                           write_linear_gradient)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {}, {"memory_budget": 10 ** 6}, {"workers": 2}])
+def test_gll_2_gll_reproduces_linear_fields(tmp_path, kwargs):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    write_linear_gll(source, meshes.gll_coordinates(4, deformation=0.05))
+    meshes.write_gll_model(target, meshes.gll_coordinates(
+        5, order=2, deformation=0.03, refinement=2))
+
+    api.gll_2_gll(source, target, **kwargs)
+
+    coordinates, values = read_gll(target)
+    np.testing.assert_allclose(
+        values, linear_values(coordinates, 5).transpose(1, 0, 2),
+        atol=TOLERANCE)
+
+
+def test_gll_2_gll_reproduces_linear_fields_in_2d(tmp_path):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    write_linear_gll(source, meshes.gll_coordinates(6, dimension=2,
+                                                    deformation=0.05))
+    meshes.write_gll_model(target, meshes.gll_coordinates(
+        7, dimension=2, deformation=0.02))
+
+    api.gll_2_gll(source, target)
+
+    coordinates, values = read_gll(target)
+    np.testing.assert_allclose(
+        values, linear_values(coordinates, 5).transpose(1, 0, 2),
+        atol=TOLERANCE)
+
+
+@pytest.mark.parametrize("deformation", [0.0, 0.05])
+def test_exodus_2_gll_reproduces_linear_fields(tmp_path, deformation):
+    mesh, target = str(tmp_path / "mesh.e"), str(tmp_path / "target.h5")
+    write_linear_exodus(mesh, *meshes.exodus_hex_mesh(
+        6, deformation=deformation))
+    meshes.write_gll_model(target, meshes.gll_coordinates(
+        4, deformation=0.03))
+
+    api.exodus_2_gll(mesh, target, parameters=meshes.ISO_PARAMETERS)
+
+    coordinates, values = read_gll(target)
+    np.testing.assert_allclose(
+        values, linear_values(coordinates, 5).transpose(1, 0, 2),
+        atol=TOLERANCE)
+
+
+def test_gll_2_exodus_reproduces_linear_fields(tmp_path):
+    source, mesh = str(tmp_path / "source.h5"), str(tmp_path / "mesh.e")
+    write_linear_gll(source, meshes.gll_coordinates(4, deformation=0.05))
+    points, connectivity = meshes.exodus_hex_mesh(6, deformation=0.03)
+    meshes.write_exodus(mesh, points, connectivity, meshes.ISO_PARAMETERS)
+
+    api.gll_2_exodus(source, mesh, parameters="ISO")
+
+    values = Exodus(mesh).get_nodal_fields(meshes.ISO_PARAMETERS)
+    np.testing.assert_allclose(values, linear_values(points, 5),
+                               atol=TOLERANCE)
+
+
+@pytest.mark.parametrize("region", ["box", "mask", "previous"])
+def test_region_update_matches_full_interpolation(tmp_path, region):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    previous = str(tmp_path / "previous.h5")
+    full = str(tmp_path / "full.h5")
+    source_coordinates = meshes.gll_coordinates(5, deformation=0.05)
+    write_linear_gll(source, source_coordinates)
+    write_linear_gll(previous, source_coordinates)
+    meshes.write_gll_model(target, meshes.gll_coordinates(
+        6, deformation=0.02))
+    api.gll_2_gll(source, target)
+    with open(target, "rb") as f, open(full, "wb") as g:
+        g.write(f.read())
+
+    changed = np.all(source_coordinates.mean(axis=1) < 0.4, axis=1)
+    with h5py.File(source, "r+") as f:
+        data = f["MODEL/data"][:]
+        data[changed] *= 1.5
+        f["MODEL/data"][:] = data
+    region = {"box": Region.box([0.0] * 3, [0.4] * 3),
+              "mask": Region.from_mask(changed),
+              "previous": Region.from_previous(previous)}[region]
+
+    before = read_gll(target)[1]
+    collected = api.gll_2_gll(source, target, region=region)
+    api.gll_2_gll(source, full)
+
+    updated = read_gll(target)[1]
+    np.testing.assert_array_equal(updated, read_gll(full)[1])
+    touched = np.any(updated != before, axis=(1, 2))
+    assert 0 < touched.sum() <= collected.counters["elements_updated"] < \
+        updated.shape[0]
+
+
+@pytest.mark.parametrize("deformation", [0.0, 0.05])
+def test_gradient_2_cartesian_hdf5_reproduces_linear_fields(tmp_path,
+                                                            deformation):
+    gradient, mesh = str(tmp_path / "gradient.h5"), str(tmp_path / "mesh.e")
+    coordinates = meshes.gll_coordinates(6, dimension=2,
+                                         deformation=deformation)
+    write_linear_gradient(gradient, coordinates)
+    points, connectivity = meshes.exodus_hex_mesh(5, deformation=0.03)
+    meshes.write_exodus(mesh, points, connectivity, ["VP", "VS"])
+
+    api.gradient_2_cartesian_hdf5(gradient, mesh, first=True)
+
+    np.testing.assert_allclose(
+        Exodus(mesh).get_nodal_fields(["VP", "VS"]),
+        linear_values(points[:, :2], 4)[1:3], atol=TOLERANCE)
+
+
+@pytest.mark.parametrize("buffer", [False, True])
+def test_sum_gll_gradients_sums_linear_fields(tmp_path, buffer):
+    master = str(tmp_path / "master.h5")
+    buffer_file = str(tmp_path / "buffer") if buffer else None
+    master_coordinates = meshes.gll_coordinates(4, deformation=0.02)
+    write_linear_gradient(master, master_coordinates)
+    simulations = []
+    for i, (nelem, deformation) in enumerate([(5, 0.05), (5, 0.05),
+                                              (6, 0.03)]):
+        simulations.append(str(tmp_path / f"gradient_{i}.h5"))
+        write_linear_gradient(simulations[-1], meshes.gll_coordinates(
+            nelem, deformation=deformation), scale=i + 1.0)
+
+    api.sum_gll_gradients(simulations, master, first=False,
+                          buffer_file=buffer_file)
+
+    with h5py.File(master, "r") as f:
+        summed = f["ELASTIC/data"][0]
+    # 1 + 2 + 3 from the simulations and 1 from the master model
+    expected = 7.0 * linear_values(master_coordinates, 4)[1:3]
+    np.testing.assert_allclose(summed, expected.transpose(1, 0, 2),
+                               rtol=1e-6)
+    assert buffer_file is None or not os.path.exists(buffer_file)
+
+
+def test_sum_gll_gradients_errors(tmp_path):
+    master = str(tmp_path / "master.h5")
+    buffer_file = str(tmp_path / "buffer")
+    write_linear_gradient(master, meshes.gll_coordinates(3))
+    with pytest.raises(ValueError, match="no gradients"):
+        api.sum_gll_gradients([], master)
+
+    simulations = [str(tmp_path / "gradient_0.h5"),
+                   str(tmp_path / "gradient_1.h5")]
+    write_linear_gradient(simulations[0], meshes.gll_coordinates(3))
+    write_linear_gradient(simulations[1], meshes.gll_coordinates(3),
+                          parameters=("RHO", "VP", "MassMatrix"))
+    with pytest.raises(ValueError, match="VS"):
+        api.sum_gll_gradients(simulations, master, buffer_file=buffer_file)
+    assert not os.path.exists(buffer_file)
+
+
+def test_gll_2_gll_gradients_interpolates_one_gradient(tmp_path):
+    simulation, master = str(tmp_path / "gradient.h5"), \
+        str(tmp_path / "master.h5")
+    master_coordinates = meshes.gll_coordinates(5, dimension=2,
+                                                deformation=0.02)
+    write_linear_gradient(simulation, meshes.gll_coordinates(
+        4, dimension=2, deformation=0.05), scale=2.0)
+    write_linear_gradient(master, master_coordinates)
+
+    api.gll_2_gll_gradients(simulation, master, first=False)
+
+    with h5py.File(master, "r") as f:
+        values = f["ELASTIC/data"][0]
+    expected = 3.0 * linear_values(master_coordinates, 4)[1:3]
+    np.testing.assert_allclose(values, expected.transpose(1, 0, 2),
+                               rtol=1e-6)
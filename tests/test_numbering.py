@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh.components.numbering import global_numbering
+
+
+@pytest.mark.parametrize("dimension", [2, 3])
+def test_global_numbering_shares_points_between_elements(dimension):
+    nelem, order = 4, 4
+    coordinates = meshes.gll_coordinates(nelem, order, dimension,
+                                         deformation=0.05)
+
+    number, unique_points = global_numbering(coordinates)
+
+    assert unique_points.shape[0] == (nelem * order + 1) ** dimension
+    points = coordinates.reshape(-1, dimension)
+    np.testing.assert_allclose(unique_points[number], points, atol=1e-10)
+
+
+def test_global_numbering_keeps_distinct_points_apart():
+    coordinates = meshes.gll_coordinates(2, 2)
+    # Move one element away, it shares no points with the others any more.
+    coordinates[0] += 10.0
+
+    number, unique_points = global_numbering(coordinates)
+
+    assert not np.isin(number[:coordinates.shape[1]],
+                       number[coordinates.shape[1]:]).any()
+    # 5 ** 3 points of the whole mesh plus a second copy of the 3 ** 3 - 2 ** 3
+    # points element 0 shared with its neighbours.
+    assert unique_points.shape[0] == 5 ** 3 + 3 ** 3 - 2 ** 3
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh import api
+from multi_mesh.components.operator import (InterpolationOperator,
+                                            read_operator)
+
+from tests.helpers import write_linear_gll
+
+
+def random_operator(seed=0):
+    rng = np.random.default_rng(seed)
+    nelem, ngll = 6, 8
+    return InterpolationOperator.from_elements(
+        rng.integers(0, nelem, 20), rng.random((20, ngll)),
+        source_shape=(nelem, ngll), target_shape=(5, 4),
+        target_index=rng.permutation(20))
+
+
+@pytest.mark.parametrize("suffix", [".h5", ".npz"])
+def test_write_read_round_trip(tmp_path, suffix):
+    filename = str(tmp_path / ("operator" + suffix))
+    operator = random_operator()
+    operator.source_hash, operator.target_hash = "source", "target"
+    operator.write(filename)
+
+    read = read_operator(filename, "source", "target")
+    assert (read.source_shape, read.target_shape) == ((6, 8), (5, 4))
+    assert (read.source_hash, read.target_hash) == ("source", "target")
+    values = np.random.default_rng(1).random((6, 3, 8))
+    np.testing.assert_array_equal(read.apply(values), operator.apply(values))
+
+
+@pytest.mark.parametrize("suffix", [".h5", ".npz"])
+def test_read_operator_checks_the_meshes(tmp_path, suffix):
+    filename = str(tmp_path / ("operator" + suffix))
+    operator = random_operator()
+    operator.source_hash, operator.target_hash = "source", "target"
+    operator.write(filename)
+
+    with pytest.raises(ValueError, match="different target mesh"):
+        read_operator(filename, "source", "other")
+    with pytest.raises(ValueError, match="different source mesh"):
+        read_operator(filename, "other", "target")
+    assert read_operator(str(tmp_path / ("missing" + suffix))) is None
+
+    random_operator().write(filename)
+    with pytest.warns(UserWarning, match="does not record"):
+        read_operator(filename, "source", "target")
+
+
+def test_operator_file_of_other_meshes_is_an_error(tmp_path):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    other = str(tmp_path / "other.h5")
+    operator_file = str(tmp_path / "operator.h5")
+    write_linear_gll(source, meshes.gll_coordinates(3, deformation=0.05))
+    meshes.write_gll_model(target, meshes.gll_coordinates(4))
+    meshes.write_gll_model(other, meshes.gll_coordinates(4,
+                                                         deformation=0.02))
+
+    api.gll_2_gll(source, target, operator_file=operator_file)
+    api.gll_2_gll(source, target, operator_file=operator_file)
+    with pytest.raises(ValueError, match="different target mesh"):
+        api.gll_2_gll(source, other, operator_file=operator_file)
@@ -0,0 +1,59 @@
+import h5py
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh.components import rotation
+from multi_mesh.io.exodus import Exodus
+
+from tests.helpers import TOLERANCE
+
+
+def test_event_rotation_moves_the_event_to_the_north_pole():
+    for event in [(0.3, -1.2), (-0.7, 2.5), (np.pi / 2, 0.0),
+                  (-np.pi / 2, 0.4)]:
+        matrix = rotation.event_rotation(event)
+        vector = np.array([np.cos(event[0]) * np.cos(event[1]),
+                           np.cos(event[0]) * np.sin(event[1]),
+                           np.sin(event[0])])
+        np.testing.assert_allclose(matrix @ vector, [0.0, 0.0, 1.0],
+                                   atol=1e-12)
+        np.testing.assert_allclose(
+            rotation.compose(matrix, rotation.event_rotation(event, True)),
+            np.eye(3), atol=1e-12)
+
+
+def test_rotate_exodus_in_chunks_matches_the_whole_mesh(tmp_path):
+    chunked, whole = str(tmp_path / "chunked.e"), str(tmp_path / "whole.e")
+    points, connectivity = meshes.exodus_hex_mesh(4, deformation=0.05)
+    for mesh in [chunked, whole]:
+        meshes.write_exodus(mesh, points, connectivity)
+    matrix = rotation.compose(rotation.event_rotation((0.4, 1.1)),
+                              rotation.rotation_matrix(0.3, [1, 2, 3]))
+
+    rotation.rotate_exodus(chunked, matrix, chunk_size=7)
+    rotation._rotate_exodus_whole(whole, matrix)
+
+    rotated = Exodus(chunked).points
+    np.testing.assert_allclose(rotated, Exodus(whole).points, atol=TOLERANCE)
+    np.testing.assert_allclose(rotated, points @ matrix.T, atol=TOLERANCE)
+
+
+def test_rotate_mesh_rotates_gll_models_in_chunks(tmp_path):
+    model = str(tmp_path / "model.h5")
+    coordinates = meshes.gll_coordinates(3, deformation=0.05)
+    meshes.write_gll_model(model, coordinates)
+    matrix = rotation.event_rotation((0.4, 1.1))
+
+    rotation.rotate_mesh(model, matrix, chunk_size=5)
+
+    with h5py.File(model, "r") as f:
+        np.testing.assert_allclose(f["MODEL/coordinates"][:],
+                                   coordinates @ matrix.T, atol=TOLERANCE)
+
+
+def test_rotate_gll_rejects_2d_models(tmp_path):
+    model = str(tmp_path / "model.h5")
+    meshes.write_gll_model(model, meshes.gll_coordinates(2, dimension=2))
+    with pytest.raises(ValueError, match="3D"):
+        rotation.rotate_gll(model, np.eye(3))
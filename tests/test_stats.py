@@ -0,0 +1,88 @@
+import json
+
+import h5py
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh import api
+from multi_mesh.components import stats
+
+from tests.helpers import write_linear_gll
+
+
+def test_collections_nest_and_merge():
+    stats.count("ignored")
+    with stats.phase(stats.READ):
+        pass
+
+    with stats.collect() as outer:
+        stats.count("points", 2)
+        with stats.collect() as inner:
+            stats.count("points", 3)
+            stats.count("tests")
+            with stats.phase(stats.READ):
+                with stats.phase(stats.WRITE):
+                    pass
+        with stats.phase(stats.READ):
+            pass
+
+    assert stats.active() is None
+    assert inner.counters == {"points": 3, "tests": 1}
+    assert inner.calls == {stats.READ: 1, stats.WRITE: 1}
+    assert outer.counters == {"points": 5, "tests": 1}
+    assert outer.calls == {stats.READ: 2, stats.WRITE: 1}
+    assert inner.phases[stats.READ] >= inner.phases[stats.WRITE]
+    assert outer.total >= inner.total > 0.0
+
+
+def test_stats_round_trip(tmp_path):
+    collected = stats.Stats()
+    collected.total = 2.0
+    collected.add_time(stats.GATHER, 1.5, calls=3)
+    collected.count("points_located", 10)
+
+    filename = str(tmp_path / "stats.json")
+    collected.write_json(filename)
+    with open(filename) as f:
+        read = stats.Stats.from_dict(json.load(f))
+    assert read.to_dict() == collected.to_dict()
+    report = read.report()
+    assert "gather" in report and "75.0%" in report
+    assert "points_located" in report
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_interpolation_counters(tmp_path, workers):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    cache_dir = str(tmp_path / "cache")
+    write_linear_gll(source, meshes.gll_coordinates(3, deformation=0.05))
+    meshes.write_gll_model(target, meshes.gll_coordinates(3, order=2))
+
+    built = api.gll_2_gll(source, target, cache_dir=cache_dir,
+                          workers=workers)
+    cached = api.gll_2_gll(source, target, cache_dir=cache_dir,
+                           workers=workers)
+
+    # The distinct points of 3 ** 3 elements of order 2
+    assert built.counters["points_located"] == 7 ** 3
+    assert built.counters["operators_built"] == 1
+    assert built.counters["candidates_tested"] >= 7 ** 3
+    assert built.counters.get("points_not_found", 0) == 0
+    assert built.counters.get("nan_values", 0) == 0
+    for phase in [stats.READ, stats.POINT_LOCATION, stats.WRITE]:
+        assert built.calls[phase] >= 1
+    assert cached.counters["operator_cache_hits"] == 1
+    assert "points_located" not in cached.counters
+
+
+def test_nan_values_are_counted(tmp_path):
+    source, target = str(tmp_path / "source.h5"), str(tmp_path / "target.h5")
+    write_linear_gll(source, meshes.gll_coordinates(3))
+    meshes.write_gll_model(target, meshes.gll_coordinates(3))
+    with h5py.File(source, "r+") as f:
+        f["MODEL/data"][0, 0, :] = np.nan
+
+    collected = api.gll_2_gll(source, target)
+
+    assert collected.counters["nan_values"] > 0
@@ -0,0 +1,41 @@
+import numpy as np
+
+from benchmarks import meshes
+from multi_mesh.components import tensor_gll
+from multi_mesh.components.structured import StructuredGrid
+
+from tests.helpers import linear_values
+
+
+def test_structured_grid_is_only_detected_on_grids():
+    assert StructuredGrid.from_elements(meshes.gll_coordinates(3)) \
+        is not None
+    assert StructuredGrid.from_elements(
+        meshes.gll_coordinates(3, deformation=0.05)) is None
+
+
+def test_structured_grid_locates_points():
+    elements = meshes.gll_coordinates(4, 2)
+    grid = StructuredGrid.from_elements(elements)
+    points = np.random.default_rng(0).uniform(0.0, 1.0, (1000, 3))
+
+    found_elements, ref_coords, found = grid.locate(points)
+
+    assert found.all()
+    np.testing.assert_allclose(
+        tensor_gll.coordinate_transform(ref_coords,
+                                        elements[found_elements]),
+        points, atol=1e-12)
+
+
+def test_structured_grid_trilinear_weights_reproduce_linear_fields():
+    points, connectivity = meshes.exodus_hex_mesh(5)
+    grid = StructuredGrid.from_connectivity(points, connectivity)
+    targets = np.random.default_rng(1).uniform(0.0, 1.0, (1000, 3))
+
+    nodes, weights, nfailed = grid.trilinear_weights(targets)
+
+    assert nfailed == 0
+    values = np.sum(weights * linear_values(points, 1)[0][nodes], axis=1)
+    np.testing.assert_allclose(values, linear_values(targets, 1)[0],
+                               atol=1e-10)
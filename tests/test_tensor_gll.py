@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from benchmarks import meshes
+from multi_mesh.components import tensor_gll
+
+from tests.helpers import linear_values
+
+
+@pytest.mark.parametrize("order,dimension", [(1, 3), (2, 2), (4, 2),
+                                             (4, 3)])
+def test_inverse_transform_recovers_reference_coordinates(order, dimension):
+    elements = meshes.gll_coordinates(3, order, dimension, deformation=0.08)
+    rng = np.random.default_rng(0)
+    ref_coords = rng.uniform(-1.0, 1.0, (elements.shape[0], dimension))
+    points = tensor_gll.coordinate_transform(ref_coords, elements)
+
+    found, converged = tensor_gll.inverse_transform(points, elements)
+
+    assert converged.all()
+    np.testing.assert_allclose(found, ref_coords, atol=1e-8)
+
+
+@pytest.mark.parametrize("order", [1, 2, 4])
+def test_shape_functions_reproduce_linear_fields(order):
+    elements = meshes.gll_coordinates(2, order, deformation=0.08)
+    rng = np.random.default_rng(1)
+    ref_coords = rng.uniform(-1.0, 1.0, (elements.shape[0], 3))
+    points = tensor_gll.coordinate_transform(ref_coords, elements)
+
+    shape = tensor_gll.get_coefficients_batch(order, ref_coords)
+    values = np.einsum("na,na->n", shape, linear_values(elements, 1)[0])
+
+    np.testing.assert_allclose(values, linear_values(points, 1)[0],
+                               atol=1e-10)